@@ -1,20 +1,29 @@
 import asyncio
+import base64
 import datetime
+import hashlib
+import os
 import re
-import shutil
 from pathlib import Path
+from typing import AsyncIterator, List, Optional
 
 import aiofiles
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import (APIRouter, Depends, File, Form, Header, HTTPException,
+                     Request, Response, UploadFile, status)
 from fastapi.security.api_key import APIKey
-from sqlalchemy.orm import Session
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import schemas
 from app.api import deps
+from app.api.utils import (haadf_metadata_path, move_haadf_images,
+                           pop_haadf_metadata)
 from app.core.config import settings
+from app.core.constants import HAADF_IMAGE_VARIANT_SUFFIX, HAADF_IMAGE_VARIANTS
 from app.core.logging import logger
 from app.crud import scan as scan_crud
 from app.kafka.producer import (send_filesystem_event_to_kafka,
+                                send_filesystem_events_to_kafka,
                                 send_haadf_event_to_kafka,
                                 send_scan_event_to_kafka,
                                 send_sync_event_to_kafka)
@@ -31,6 +40,15 @@ async def file_events(
     return event
 
 
+@router.post("/batch")
+async def file_events_batch(
+    events: List[schemas.FileSystemEvent], api_key: APIKey = Depends(deps.get_api_key)
+):
+    await send_filesystem_events_to_kafka(events)
+
+    return events
+
+
 @router.post("/sync")
 async def sync_events(
     event: schemas.SyncEvent, api_key: APIKey = Depends(deps.get_api_key)
@@ -40,26 +58,85 @@ async def sync_events(
     return event
 
 
-async def upload_haadf_dm4(file: UploadFile) -> None:
+# Uploads are written to a .part file and renamed once complete, so a partial
+# file is never picked up.
+def _part_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.part")
+
+
+async def _read_chunks(file: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await file.read(settings.HAADF_UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        yield chunk
+
+
+# Write the data to disk in chunks of HAADF_UPLOAD_CHUNK_SIZE, rather than
+# buffering the whole upload. Returns the number of bytes written.
+async def _write_chunks(fp, chunks: AsyncIterator[bytes]) -> int:
+    size = 0
+    buffer = bytearray()
+    async for data in chunks:
+        buffer += data
+        if len(buffer) >= settings.HAADF_UPLOAD_CHUNK_SIZE:
+            await fp.write(buffer)
+            size += len(buffer)
+            buffer = bytearray()
+
+    if buffer:
+        await fp.write(buffer)
+        size += len(buffer)
+
+    return size
+
+
+async def _save_upload(file: UploadFile, path: Path) -> None:
+    part_path = _part_path(path)
+    async with aiofiles.open(part_path, "wb") as fp:
+        await _write_chunks(fp, _read_chunks(file))
+
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, os.replace, part_path, path)
+
+
+def _sha256(path: Path) -> bytes:
+    sha256 = hashlib.sha256()
+    with path.open("rb") as fp:
+        for chunk in iter(lambda: fp.read(settings.HAADF_UPLOAD_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+
+    return sha256.digest()
+
+
+def _dm4_scan_id(filename: str) -> str:
     scan_regex = re.compile(r"^scan([0-9]*)\.dm4")
 
     # Extract out the scan ids
-    match = scan_regex.match(file.filename)
+    match = scan_regex.match(filename)
     if not match:
         raise HTTPException(status_code=400, detail="Can't extract scan id.")
 
-    scan_id = match.group(1)
+    return match.group(1)
+
+
+async def upload_haadf_dm4(file: UploadFile) -> None:
+    scan_id = _dm4_scan_id(file.filename)
     upload_path = Path(settings.HAADF_DM4_UPLOAD_DIR) / f"scan{scan_id}.dm4"
-    async with aiofiles.open(upload_path, "wb") as fp:
-        contents = await file.read()
-        await fp.write(contents)
+    await _save_upload(file, upload_path)
 
     await send_haadf_event_to_kafka(
         schemas.HaadfUploaded(path=str(upload_path), scan_id=scan_id)
     )
 
 
-async def upload_haadf_png(db: Session, file: UploadFile) -> None:
+async def upload_haadf_png(
+    db: AsyncSession,
+    file: UploadFile,
+    variants: List[UploadFile],
+    metadata: Optional[str],
+) -> None:
     scan_regex = re.compile(r"^([0-9]*)\.png")
 
     # Extract out the scan ids
@@ -68,34 +145,63 @@ async def upload_haadf_png(db: Session, file: UploadFile) -> None:
         raise HTTPException(status_code=400, detail="Can't extract scan id.")
 
     scan_id = int(match.group(1))
-    upload_path = Path(settings.HAADF_IMAGE_UPLOAD_DIR) / f"scan{scan_id}.png"
-    async with aiofiles.open(upload_path, "wb") as fp:
-        contents = await file.read()
-        await fp.write(contents)
+
+    # The downscaled versions of the image, named {scan_id}_{variant}.webp
+    variant_regex = re.compile(
+        rf"^{scan_id}_({'|'.join(HAADF_IMAGE_VARIANTS)})"
+        rf"{re.escape(HAADF_IMAGE_VARIANT_SUFFIX)}$"
+    )
+    variant_names = []
+    for variant_file in variants:
+        match = variant_regex.match(variant_file.filename)
+        if not match:
+            raise HTTPException(status_code=400, detail="Invalid image variant.")
+        variant_names.append(match.group(1))
+
+    if metadata is not None:
+        try:
+            metadata = schemas.HaadfMetadata.parse_raw(metadata)
+        except ValidationError:
+            raise HTTPException(status_code=400, detail="Invalid metadata.")
+
+    upload_dir = Path(settings.HAADF_IMAGE_UPLOAD_DIR)
+    for (variant, variant_file) in zip(variant_names, variants):
+        upload_path = (
+            upload_dir / f"scan{scan_id}_{variant}{HAADF_IMAGE_VARIANT_SUFFIX}"
+        )
+        await _save_upload(variant_file, upload_path)
+
+    if metadata is not None:
+        async with aiofiles.open(haadf_metadata_path(scan_id), "w") as fp:
+            await fp.write(metadata.json())
+
+    # The full image is written last, as its presence is what marks the upload
+    # as complete.
+    upload_path = upload_dir / f"scan{scan_id}.png"
+    await _save_upload(file, upload_path)
 
     current_time = datetime.datetime.utcnow()
     created_since = current_time - datetime.timedelta(
         hours=settings.HAADF_SCAN_AGE_LIMIT
     )
 
-    scans = scan_crud.get_scans(
+    scans = await scan_crud.get_scans_async(
         db, scan_id=scan_id, has_haadf=False, created_since=created_since
     )
 
     if len(scans) > 0:
         scan = scans[0]
         logger.info(f"Adding HAADF image '{upload_path}' to scan {scan.id}")
-        # Move the file to the right location
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(
-            None,
-            shutil.move,
-            upload_path,
-            Path(settings.HAADF_IMAGE_STATIC_DIR) / f"{scan.id}.png",
-        )
+        # Move the files to the right location
+        await move_haadf_images(scan_id, scan.id)
+        haadf_metadata = await pop_haadf_metadata(scan_id)
+        if haadf_metadata is not None:
+            haadf_metadata = schemas.HaadfMetadata(**haadf_metadata)
 
         haaf_path = f"{settings.HAADF_IMAGE_URL_PREFIX}/{scan.id}.png"
-        (updated, _) = scan_crud.update_scan(db, scan.id, haadf_path=haaf_path)
+        (updated, _) = await scan_crud.update_scan_async(
+            db, scan.id, haadf_path=haaf_path, haadf_metadata=haadf_metadata
+        )
 
         if updated:
             await send_scan_event_to_kafka(
@@ -105,8 +211,10 @@ async def upload_haadf_png(db: Session, file: UploadFile) -> None:
 
 @router.post("/haadf")
 async def upload_haadf(
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
     file: UploadFile = File(...),
+    variants: List[UploadFile] = File([]),
+    metadata: Optional[str] = Form(None),
     api_key: APIKey = Depends(deps.get_api_key),
 ) -> None:
     suffix = Path(file.filename).suffix
@@ -114,6 +222,86 @@ async def upload_haadf(
     if suffix.lower() == ".dm4":
         await upload_haadf_dm4(file)
     elif suffix.lower() == ".png":
-        await upload_haadf_png(db, file)
+        await upload_haadf_png(db, file, variants, metadata)
     else:
         raise HTTPException(status_code=400, detail="Invalid format.")
+
+
+# Resumable upload of DM4 files, the data is sent as the body of one or more
+# PATCH requests, each starting at the Upload-Offset returned by HEAD. Once
+# Upload-Length bytes have been received the file is verified against the
+# Upload-Checksum ("sha256 <base64 digest>") and handed on for processing.
+
+
+def _upload_offset(part_path: Path) -> int:
+    if part_path.exists():
+        return part_path.stat().st_size
+
+    return 0
+
+
+@router.head("/haadf/uploads/{filename}")
+async def get_haadf_upload_offset(
+    filename: str, api_key: APIKey = Depends(deps.get_api_key)
+) -> Response:
+    scan_id = _dm4_scan_id(filename)
+    upload_path = Path(settings.HAADF_DM4_UPLOAD_DIR) / f"scan{scan_id}.dm4"
+    offset = _upload_offset(_part_path(upload_path))
+
+    return Response(headers={"Upload-Offset": str(offset)})
+
+
+@router.patch("/haadf/uploads/{filename}")
+async def upload_haadf_dm4_chunk(
+    filename: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    upload_length: int = Header(...),
+    upload_checksum: str = Header(...),
+    api_key: APIKey = Depends(deps.get_api_key),
+) -> Response:
+    scan_id = _dm4_scan_id(filename)
+    upload_path = Path(settings.HAADF_DM4_UPLOAD_DIR) / f"scan{scan_id}.dm4"
+    part_path = _part_path(upload_path)
+
+    (algorithm, _, digest) = upload_checksum.partition(" ")
+    if algorithm != "sha256":
+        raise HTTPException(status_code=400, detail="Unsupported checksum.")
+    try:
+        checksum = base64.b64decode(digest, validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid checksum.")
+
+    # The client needs to resume from where we are
+    offset = _upload_offset(part_path)
+    if upload_offset != offset:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload offset mismatch.",
+            headers={"Upload-Offset": str(offset)},
+        )
+
+    async with aiofiles.open(part_path, "ab") as fp:
+        offset += await _write_chunks(fp, request.stream())
+
+    headers = {"Upload-Offset": str(offset)}
+    if offset < upload_length:
+        return Response(status_code=status.HTTP_204_NO_CONTENT, headers=headers)
+
+    loop = asyncio.get_event_loop()
+    if (
+        offset > upload_length
+        or await loop.run_in_executor(None, _sha256, part_path) != checksum
+    ):
+        # Start again
+        await loop.run_in_executor(None, os.remove, part_path)
+        logger.warning(f"Verification of upload '{upload_path}' failed.")
+        raise HTTPException(status_code=400, detail="Upload verification failed.")
+
+    await loop.run_in_executor(None, os.replace, part_path, upload_path)
+
+    await send_haadf_event_to_kafka(
+        schemas.HaadfUploaded(path=str(upload_path), scan_id=scan_id)
+    )
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=headers)
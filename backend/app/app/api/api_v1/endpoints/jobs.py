@@ -1,10 +1,11 @@
 from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app import schemas
-from app.api.deps import get_db, oauth2_password_bearer_or_api_key
+from app.api.deps import get_async_db, get_db, oauth2_password_bearer_or_api_key
 from app.crud import job as crud
 from app.crud import scan as scan_crud
 from app.kafka.producer import (send_scan_event_to_kafka,
@@ -20,19 +21,21 @@ router = APIRouter()
     response_model=schemas.Job,
     dependencies=[Depends(oauth2_password_bearer_or_api_key)],
 )
-async def create_job(job: schemas.JobCreate, db: Session = Depends(get_db)):
-    scan = scan_crud.get_scan(db, job.scan_id)
+async def create_job(
+    job: schemas.JobCreate, db: AsyncSession = Depends(get_async_db)
+):
+    scan = await scan_crud.get_scan_async(db, job.scan_id)
     if scan is None:
         raise HTTPException(status_code=404, detail="Scan not found")
 
-    job = crud.create_job(db=db, job=job)
+    job = await crud.create_job_async(db=db, job=job)
 
     scan = schemas.Scan.from_orm(scan)
     job = schemas.Job.from_orm(job)
 
     await send_submit_job_event_to_kafka(SubmitJobEvent(scan=scan, job=job))
 
-    jobs = crud.get_jobs(db, scan_id=job.scan_id)
+    jobs = await crud.get_jobs_async(db, scan_id=job.scan_id)
     await send_scan_event_to_kafka(ScanUpdateEvent(id=job.scan_id, jobs=jobs))
 
     return job
@@ -73,17 +76,36 @@ def read_job(id: int, db: Session = Depends(get_db)):
     dependencies=[Depends(oauth2_password_bearer_or_api_key)],
 )
 async def update_job(
-    id: int, payload: schemas.JobUpdate, db: Session = Depends(get_db)
+    id: int, payload: schemas.JobUpdate, db: AsyncSession = Depends(get_async_db)
 ):
 
-    db_job = crud.get_job(db, id=id)
+    db_job = await crud.get_job_async(db, id=id)
     if db_job is None:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    (updated, job) = crud.update_job(db, id, payload)
+    (updated, job) = await crud.update_job_async(db, id, payload)
 
     if updated:
-        jobs = crud.get_jobs(db, scan_id=job.scan_id)
+        jobs = await crud.get_jobs_async(db, scan_id=job.scan_id)
         await send_scan_event_to_kafka(ScanUpdateEvent(id=job.scan_id, jobs=jobs))
 
     return job
+
+
+@router.patch(
+    "",
+    response_model=List[schemas.Job],
+    dependencies=[Depends(oauth2_password_bearer_or_api_key)],
+)
+async def update_jobs(
+    payload: List[schemas.JobBulkUpdate], db: AsyncSession = Depends(get_async_db)
+):
+    # Only the jobs that have changed are returned
+    jobs = await crud.update_jobs_async(db, payload)
+
+    # One event per scan with changed jobs
+    for scan_id in {job.scan_id for job in jobs}:
+        scan_jobs = await crud.get_jobs_async(db, scan_id=scan_id)
+        await send_scan_event_to_kafka(ScanUpdateEvent(id=scan_id, jobs=scan_jobs))
+
+    return jobs
@@ -4,11 +4,14 @@ from typing import Any
 
 from fastapi import APIRouter, status
 from fastapi.exceptions import HTTPException
+from pydantic import ValidationError
 from starlette.endpoints import WebSocketEndpoint
+from starlette.status import WS_1013_TRY_AGAIN_LATER
 
 from app.api.deps import get_current_user, get_db
 from app.core.logging import logger
-from app.kafka import consumer
+from app.schemas import NotificationSubscribe
+from app.kafka.hub import hub
 
 router = APIRouter()
 
@@ -18,7 +21,7 @@ from fastapi import WebSocket
 @router.websocket_route("/notifications")
 class WebsocketConsumer(WebSocketEndpoint):
     relay_task = None
-    consumer = None
+    subscriber = None
 
     async def on_connect(self, websocket: WebSocket) -> None:
         try:
@@ -28,7 +31,15 @@ class WebsocketConsumer(WebSocketEndpoint):
             with contextmanager(get_db)() as db:
                 await get_current_user(db, websocket.query_params.get("token"))
 
-            self.consumer = await consumer.create()
+            # A reconnecting client passes the last sequence number it received
+            since = websocket.query_params.get("since")
+            if since is not None:
+                try:
+                    since = int(since)
+                except ValueError:
+                    since = None
+
+            self.subscriber = hub.subscribe(since)
             self.relay_task = asyncio.create_task(self.relay_events())
         except HTTPException as hex:
             if hex.status_code == status.HTTP_401_UNAUTHORIZED:
@@ -40,23 +51,31 @@ class WebsocketConsumer(WebSocketEndpoint):
     async def on_disconnect(self, websocket: WebSocket, close_code: int) -> None:
         if self.relay_task:
             self.relay_task.cancel()
-        if self.consumer:
-            await self.consumer.stop()
+        if self.subscriber:
+            hub.unsubscribe(self.subscriber)
 
     async def on_receive(self, websocket: WebSocket, data: Any) -> None:
-        # For now do nothing
-        pass
+        if self.subscriber is None:
+            return
+
+        try:
+            subscribe = NotificationSubscribe.parse_raw(data)
+        except ValidationError:
+            logger.warning(f"Invalid notifications subscription: {data}")
+            return
+
+        self.subscriber.subscribe(subscribe.subscribe)
 
     async def relay_events(self) -> None:
         try:
-            async for msg in self.consumer:
-                event = msg.value
-                try:
-                    del event["__faust"]
-                except KeyError:
-                    pass
+            async for event in self.subscriber:
                 await self.websocket.send_json(event)
+
+            # We have been dropped for falling too far behind
+            if self.subscriber.dropped:
+                logger.warning("Dropping slow notifications client.")
+                await self.websocket.close(code=WS_1013_TRY_AGAIN_LATER)
         except:
-            logger.exception("Exception relaying kafka message.")
+            logger.exception("Exception relaying notification.")
         finally:
-            await self.consumer.stop()
+            hub.unsubscribe(self.subscriber)
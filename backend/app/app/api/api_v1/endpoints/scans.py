@@ -1,16 +1,17 @@
-import asyncio
-import os
-import shutil
 from datetime import datetime
 from pathlib import Path
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.security.api_key import APIKey
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app import schemas
-from app.api.deps import get_api_key, get_db, oauth2_password_bearer_or_api_key
+from app.api.deps import (get_api_key, get_async_db, get_db,
+                          oauth2_password_bearer_or_api_key)
+from app.api.utils import (decode_cursor, encode_cursor, move_haadf_images,
+                           pop_haadf_metadata, remove_haadf_images)
 from app.core.config import settings
 from app.core.logging import logger
 from app.crud import scan as crud
@@ -26,34 +27,71 @@ router = APIRouter()
 @router.post("", response_model=schemas.Scan)
 async def create_scan(
     scan: schemas.ScanCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     api_key: APIKey = Depends(get_api_key),
 ):
 
-    scan = crud.create_scan(db=db, scan=scan)
+    scan = await crud.create_scan_async(db=db, scan=scan)
+    scan = await _add_haadf_image(db, scan)
+
+    await send_scan_event_to_kafka(
+        ScanCreatedEvent(**schemas.Scan.from_orm(scan).dict())
+    )
 
+    return scan
+
+
+async def _add_haadf_image(db: AsyncSession, scan: Scan) -> Scan:
     # See if we have HAADF image for this scan
     upload_path = Path(settings.HAADF_IMAGE_UPLOAD_DIR) / f"scan{scan.scan_id}.png"
     if upload_path.exists():
-        # Move it to the right location to be served statically
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(
-            None,
-            shutil.move,
-            upload_path,
-            Path(settings.HAADF_IMAGE_STATIC_DIR) / f"{scan.id}.png",
+        # Move it, and its variants, to the right location to be served statically
+        await move_haadf_images(scan.scan_id, scan.id)
+        haadf_metadata = await pop_haadf_metadata(scan.scan_id)
+        if haadf_metadata is not None:
+            haadf_metadata = schemas.HaadfMetadata(**haadf_metadata)
+
+        # Finally update the haadf path and metadata
+        (_, scan) = await crud.update_scan_async(
+            db,
+            scan.id,
+            haadf_path=f"{settings.HAADF_IMAGE_URL_PREFIX}/{scan.id}.png",
+            haadf_metadata=haadf_metadata,
         )
 
-        # Finally update the haadf path
-        (_, scan) = crud.update_scan(
-            db, scan.id, haadf_path=f"{settings.HAADF_IMAGE_URL_PREFIX}/{scan.id}.png"
-        )
+    return scan
 
-    await send_scan_event_to_kafka(
-        ScanCreatedEvent(**schemas.Scan.from_orm(scan).dict())
-    )
 
-    return scan
+@router.post("/bulk", response_model=List[schemas.Scan])
+async def upsert_scans(
+    scans: List[schemas.ScanUpsert],
+    db: AsyncSession = Depends(get_async_db),
+    api_key: APIKey = Depends(get_api_key),
+):
+    (scans, created, updated) = await crud.upsert_scans_async(db, scans)
+
+    results = []
+    for scan in scans:
+        if scan.id in created:
+            scan = await _add_haadf_image(db, scan)
+            await send_scan_event_to_kafka(
+                ScanCreatedEvent(**schemas.Scan.from_orm(scan).dict())
+            )
+        elif scan.id in updated:
+            # A single event with the current state of the scan
+            await send_scan_event_to_kafka(
+                schemas.ScanUpdateEvent(
+                    id=scan.id,
+                    log_files=scan.log_files,
+                    locations=[
+                        schemas.scan.Location.from_orm(l) for l in scan.locations
+                    ],
+                )
+            )
+
+        results.append(scan)
+
+    return results
 
 
 @router.get(
@@ -62,6 +100,7 @@ async def create_scan(
     dependencies=[Depends(oauth2_password_bearer_or_api_key)],
 )
 def read_scans(
+    request: Request,
     response: Response,
     skip: int = 0,
     limit: int = 100,
@@ -69,8 +108,29 @@ def read_scans(
     state: schemas.ScanState = None,
     created: datetime = None,
     has_haadf: bool = None,
+    metadata: schemas.HaadfMetadataFilter = Depends(),
+    order_by: schemas.ScanOrderBy = schemas.ScanOrderBy.CREATED,
+    descending: bool = True,
+    cursor: str = None,
+    count: schemas.ScanCountStrategy = schemas.ScanCountStrategy.EXACT,
     db: Session = Depends(get_db),
 ):
+    # The cursor is the ( created, id ) of the last scan, so it can only be used
+    # with the default order.
+    keyset = order_by == schemas.ScanOrderBy.CREATED and descending
+
+    after = None
+    if cursor is not None:
+        if not keyset:
+            raise HTTPException(
+                status_code=400, detail="Cursor requires the default order."
+            )
+
+        try:
+            after = decode_cursor(cursor)
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
     scans = crud.get_scans(
         db,
         skip=skip,
@@ -79,19 +139,36 @@ def read_scans(
         state=state,
         created=created,
         has_haadf=has_haadf,
+        metadata=metadata,
+        order_by=order_by,
+        descending=descending,
+        after=after,
     )
 
-    count = crud.get_scans_count(
-        db,
-        skip=skip,
-        limit=limit,
-        scan_id=scan_id,
-        state=state,
-        created=created,
-        has_haadf=has_haadf,
-    )
+    # If we have a full page there may be more
+    if keyset and len(scans) > 0 and len(scans) == limit:
+        last = scans[-1]
+        next_cursor = encode_cursor(last.created, last.id)
+        next_url = request.url.remove_query_params("skip").include_query_params(
+            cursor=next_cursor
+        )
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+
+    if count != schemas.ScanCountStrategy.NONE:
+        (total, estimated) = crud.get_scans_count(
+            db,
+            scan_id=scan_id,
+            state=state,
+            created=created,
+            has_haadf=has_haadf,
+            metadata=metadata,
+            strategy=count,
+        )
 
-    response.headers["X-Total-Count"] = str(count)
+        response.headers["X-Total-Count"] = str(total)
+        if estimated:
+            response.headers["X-Total-Count-Estimated"] = "true"
 
     return scans
 
@@ -123,14 +200,14 @@ def read_scan(response: Response, id: int, db: Session = Depends(get_db)):
     dependencies=[Depends(oauth2_password_bearer_or_api_key)],
 )
 async def update_scan(
-    id: int, payload: schemas.ScanUpdate, db: Session = Depends(get_db)
+    id: int, payload: schemas.ScanUpdate, db: AsyncSession = Depends(get_async_db)
 ):
 
-    db_scan = crud.get_scan(db, id=id)
+    db_scan = await crud.get_scan_async(db, id=id)
     if db_scan is None:
         raise HTTPException(status_code=404, detail="Scan not found")
 
-    (updated, scan) = crud.update_scan(
+    (updated, scan) = await crud.update_scan_async(
         db,
         id,
         log_files=payload.log_files,
@@ -175,9 +252,11 @@ async def _remove_scan_files(db_scan: Scan, host: str = None):
 
 
 @router.delete("/{id}", dependencies=[Depends(oauth2_password_bearer_or_api_key)])
-async def delete_scan(id: int, remove_scan_files: bool, db: Session = Depends(get_db)):
+async def delete_scan(
+    id: int, remove_scan_files: bool, db: AsyncSession = Depends(get_async_db)
+):
 
-    db_scan = crud.get_scan(db, id=id)
+    db_scan = await crud.get_scan_async(db, id=id)
     if db_scan is None:
         raise HTTPException(status_code=404, detail="Scan not found")
 
@@ -185,23 +264,20 @@ async def delete_scan(id: int, remove_scan_files: bool, db: Session = Depends(ge
         logger.info("Removing scan files.")
         await _remove_scan_files(db_scan)
 
-    crud.delete_scan(db, id)
+    await crud.delete_scan_async(db, id)
 
-    haadf_path = Path(settings.HAADF_IMAGE_STATIC_DIR) / f"{id}.png"
-    logger.info(f"Checking if HAADF image exists: {haadf_path}")
-    if haadf_path.exists():
-        logger.info(f"Removing HAADF image: {haadf_path}")
-        # Remove it
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, os.remove, haadf_path)
+    logger.info(f"Removing any HAADF images for scan: {id}")
+    await remove_haadf_images(id)
 
 
 @router.put(
     "/{id}/remove",
     dependencies=[Depends(oauth2_password_bearer_or_api_key)],
 )
-async def remove_scan_files(id: int, host: str, db: Session = Depends(get_db)):
-    db_scan = crud.get_scan(db, id=id)
+async def remove_scan_files(
+    id: int, host: str, db: AsyncSession = Depends(get_async_db)
+):
+    db_scan = await crud.get_scan_async(db, id=id)
     if db_scan is None:
         raise HTTPException(status_code=404, detail="Scan not found")
 
@@ -228,14 +304,14 @@ def delete_location(id: int, location_id: int, db: Session = Depends(get_db)):
     "/{id}/locations",
     dependencies=[Depends(oauth2_password_bearer_or_api_key)],
 )
-async def remove_scan(id: int, host: str, db: Session = Depends(get_db)):
-    db_scan = crud.get_scan(db, id=id)
+async def remove_scan(id: int, host: str, db: AsyncSession = Depends(get_async_db)):
+    db_scan = await crud.get_scan_async(db, id=id)
     if db_scan is None:
         raise HTTPException(status_code=404, detail="Scan not found")
 
-    crud.delete_locations(db, scan_id=id, host=host)
+    await crud.delete_locations_async(db, scan_id=id, host=host)
 
-    db_scan = crud.get_scan(db, id=id)
+    db_scan = await crud.get_scan_async(db, id=id)
     scan_updated_event = schemas.ScanUpdateEvent(id=id)
     if db_scan is not None:
         scan_updated_event.locations = db_scan.locations
@@ -1,4 +1,4 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 from fastapi import Depends, HTTPException, Security, status
 from fastapi.security import OAuth2PasswordBearer
@@ -9,7 +9,7 @@ from starlette.status import HTTP_403_FORBIDDEN
 
 from app.core.config import settings
 from app.crud import user as crud
-from app.db.session import SessionLocal
+from app.db.session import AsyncSessionLocal, SessionLocal
 from app.schemas import TokenData
 
 # DB
@@ -23,6 +23,11 @@ def get_db() -> Generator:
         db.close()
 
 
+async def get_async_db() -> AsyncGenerator:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 # API key
 api_key_query = APIKeyQuery(name=settings.API_KEY_NAME, auto_error=False)
 api_key_header = APIKeyHeader(name=settings.API_KEY_NAME, auto_error=False)
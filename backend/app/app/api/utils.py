@@ -1,5 +1,18 @@
+import asyncio
+import base64
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiofiles
 from passlib.context import CryptContext
 
+from app.core.config import settings
+from app.core.constants import HAADF_IMAGE_VARIANT_SUFFIX, HAADF_IMAGE_VARIANTS
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
@@ -9,3 +22,76 @@ def verify_password(plain_password, hashed_password):
 
 def get_password_hash(password):
     return pwd_context.hash(password)
+
+
+# Opaque cursors used for keyset pagination
+
+
+def encode_cursor(created: datetime, id: int) -> str:
+    cursor = json.dumps({"created": created.isoformat(), "id": id})
+
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    cursor = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+    return (datetime.fromisoformat(cursor["created"]), int(cursor["id"]))
+
+
+# HAADF images are uploaded as scan{scan_id}.png, along with the downscaled
+# variants scan{scan_id}_{variant}.webp, and served as {id}.png and
+# {id}_{variant}.webp once we have the scan.
+
+
+def haadf_image_names(name: str) -> List[str]:
+    return [f"{name}.png"] + [
+        f"{name}_{variant}{HAADF_IMAGE_VARIANT_SUFFIX}"
+        for variant in HAADF_IMAGE_VARIANTS
+    ]
+
+
+async def move_haadf_images(scan_id: int, id: int) -> None:
+    loop = asyncio.get_event_loop()
+    upload_dir = Path(settings.HAADF_IMAGE_UPLOAD_DIR)
+    static_dir = Path(settings.HAADF_IMAGE_STATIC_DIR)
+
+    for (upload_name, static_name) in zip(
+        haadf_image_names(f"scan{scan_id}"), haadf_image_names(str(id))
+    ):
+        upload_path = upload_dir / upload_name
+        if upload_path.exists():
+            await loop.run_in_executor(
+                None, shutil.move, upload_path, static_dir / static_name
+            )
+
+
+async def remove_haadf_images(id: int) -> None:
+    loop = asyncio.get_event_loop()
+    static_dir = Path(settings.HAADF_IMAGE_STATIC_DIR)
+
+    for name in haadf_image_names(str(id)):
+        path = static_dir / name
+        if path.exists():
+            await loop.run_in_executor(None, os.remove, path)
+
+
+# The metadata of the HAADF image is uploaded along with it and kept in
+# scan{scan_id}.json until we have the scan to store it on.
+
+
+def haadf_metadata_path(scan_id: int) -> Path:
+    return Path(settings.HAADF_IMAGE_UPLOAD_DIR) / f"scan{scan_id}.json"
+
+
+async def pop_haadf_metadata(scan_id: int) -> Optional[Dict[str, Any]]:
+    path = haadf_metadata_path(scan_id)
+    if not path.exists():
+        return None
+
+    async with aiofiles.open(path, "r") as fp:
+        metadata = json.loads(await fp.read())
+
+    await asyncio.get_event_loop().run_in_executor(None, os.remove, path)
+
+    return metadata
@@ -46,6 +46,23 @@ class Settings(BaseSettings):
             path=f"/{values.get('POSTGRES_DB') or ''}",
         )
 
+    # The async engine, using asyncpg
+    SQLALCHEMY_ASYNC_DATABASE_URI: Optional[str] = None
+
+    @validator("SQLALCHEMY_ASYNC_DATABASE_URI", pre=True)
+    def assemble_async_db_connection(
+        cls, v: Optional[str], values: Dict[str, Any]
+    ) -> Any:
+        if isinstance(v, str):
+            return v
+        return PostgresDsn.build(
+            scheme="postgresql+asyncpg",
+            user=values.get("POSTGRES_USER"),
+            password=values.get("POSTGRES_PASSWORD"),
+            host=values.get("POSTGRES_SERVER"),
+            path=f"/{values.get('POSTGRES_DB') or ''}",
+        )
+
     API_KEY_NAME: str
     API_KEY: str
 
@@ -58,6 +75,15 @@ class Settings(BaseSettings):
 
     KAFKA_BOOTSTRAP_SERVERS: List[str]
 
+    # Max number of events queued for a websocket client before its updates
+    # are coalesced or it is dropped.
+    NOTIFICATION_QUEUE_SIZE: int = 1000
+    # Max number of scans to track the last sent state of per websocket client,
+    # used to send only the fields that have changed.
+    NOTIFICATION_STATE_SIZE: int = 1000
+    # Number of recent events kept to replay to reconnecting websocket clients
+    NOTIFICATION_BUFFER_SIZE: int = 1000
+
     HAADF_DM4_UPLOAD_DIR: str
     HAADF_IMAGE_UPLOAD_DIR: str
     HAADF_IMAGE_URL_PREFIX: str
@@ -66,6 +92,11 @@ class Settings(BaseSettings):
     # This is need to avoid associate a HAADF with a old scan if the scan ids
     # have been reset in in the detector software.
     HAADF_SCAN_AGE_LIMIT: int = 1
+    # Uploads are streamed to disk in chunks of this size (bytes)
+    HAADF_UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+
+    # How long to cache exact counts for filtered scan listings (seconds)
+    SCAN_COUNT_CACHE_TTL: float = 30
 
     SENTRY_DSN_URL: AnyHttpUrl = None
 
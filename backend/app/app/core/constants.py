@@ -7,4 +7,9 @@ TOPIC_HAADF_FILE_EVENTS = "haadf_file_events"
 TOPIC_JOB_EVENTS = "job_events"
 TOPIC_CUSTODIAN_EVENT = "custodian_events"
 
+# The downscaled versions of the HAADF images, stored next to the full image as
+# {id}_{variant}.webp
+HAADF_IMAGE_VARIANTS = ["thumbnail", "medium"]
+HAADF_IMAGE_VARIANT_SUFFIX = ".webp"
+
 NERSC_STATUS_URL_PREFIX = "https://api.nersc.gov/api/v1.2/status/"
\ No newline at end of file
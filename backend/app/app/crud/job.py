@@ -1,6 +1,7 @@
-from typing import Tuple
+from typing import List, Tuple
 
-from sqlalchemy import desc, or_, update
+from sqlalchemy import desc, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app import models, schemas
@@ -40,9 +41,7 @@ def create_job(db: Session, job: schemas.JobCreate):
     return db_job
 
 
-def update_job(
-    db: Session, id: int, updates: schemas.JobUpdate
-) -> Tuple[bool, models.Job]:
+def _update_job_statement(id: int, updates: schemas.JobUpdate):
     statement = update(models.Job).where(models.Job.id == id)
 
     or_comparisons = []
@@ -66,10 +65,101 @@ def update_job(
         or_comparisons.append(models.Job.elapsed != updates.elapsed)
         or_comparisons.append(models.Job.elapsed == None)
 
-    statement = statement.where(or_(*or_comparisons))
+    return statement.where(or_(*or_comparisons))
+
+
+def update_job(
+    db: Session, id: int, updates: schemas.JobUpdate
+) -> Tuple[bool, models.Job]:
+    statement = _update_job_statement(id, updates)
 
     resultproxy = db.execute(statement)
     updated = resultproxy.rowcount == 1
     db.commit()
 
     return (updated, get_job(db, id))
+
+
+# Async variants
+
+
+async def get_job_async(db: AsyncSession, id: int):
+    result = await db.execute(
+        select(models.Job)
+        .where(models.Job.id == id)
+        .execution_options(populate_existing=True)
+    )
+
+    return result.scalars().first()
+
+
+async def get_jobs_async(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    scan_id: int = None,
+    slurm_id: int = None,
+):
+    statement = select(models.Job)
+    if scan_id is not None:
+        statement = statement.where(models.Job.scan_id == scan_id)
+
+    if slurm_id is not None:
+        statement = statement.where(models.Job.slurm_id == slurm_id)
+
+    statement = (
+        statement.order_by(desc(models.Job.id))
+        .offset(skip)
+        .limit(limit)
+        .execution_options(populate_existing=True)
+    )
+    result = await db.execute(statement)
+
+    return result.scalars().all()
+
+
+async def create_job_async(db: AsyncSession, job: schemas.JobCreate):
+    db_job = models.Job(**job.dict())
+    db.add(db_job)
+    await db.commit()
+    await db.refresh(db_job)
+
+    return db_job
+
+
+async def update_job_async(
+    db: AsyncSession, id: int, updates: schemas.JobUpdate
+) -> Tuple[bool, models.Job]:
+    statement = _update_job_statement(id, updates)
+
+    resultproxy = await db.execute(statement)
+    updated = resultproxy.rowcount == 1
+    await db.commit()
+
+    return (updated, await get_job_async(db, id))
+
+
+async def update_jobs_async(
+    db: AsyncSession, updates: List[schemas.JobBulkUpdate]
+) -> List[models.Job]:
+    ids = []
+    for job_update in updates:
+        # Nothing to update
+        if not job_update.dict(exclude={"id"}, exclude_none=True):
+            continue
+
+        statement = _update_job_statement(job_update.id, job_update)
+        result = await db.execute(statement.returning(models.Job.id))
+        ids += result.scalars().all()
+    await db.commit()
+
+    if not ids:
+        return []
+
+    result = await db.execute(
+        select(models.Job)
+        .where(models.Job.id.in_(ids))
+        .execution_options(populate_existing=True)
+    )
+
+    return result.scalars().all()
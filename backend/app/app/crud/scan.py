@@ -1,11 +1,16 @@
+import time
 from datetime import datetime
-from typing import List, Tuple, Union
+from typing import Dict, List, Set, Tuple, Union
 
-from sqlalchemy import desc, or_, update
-from sqlalchemy.orm import Session
+from sqlalchemy import (asc, delete, desc, func, literal_column, or_, select,
+                        tuple_, update)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 
 from app import models, schemas
 from app.core import constants
+from app.core.config import settings
 
 
 def get_scan(db: Session, id: int):
@@ -16,43 +21,59 @@ def get_scan_by_scan_id(db: Session, scan_id: int):
     return db.query(models.Scan).filter(models.Scan.scan_id == scan_id).first()
 
 
-def _get_scans_query(
-    db: Session,
-    skip: int = 0,
-    limit: int = 100,
+def _get_haadf_metadata_filters(metadata: schemas.HaadfMetadataFilter):
+    filters = []
+    for (name, value) in metadata.dict(exclude_none=True).items():
+        if name.startswith("min_"):
+            column = getattr(models.Scan, f"haadf_{name[len('min_'):]}")
+            filters.append(column >= value)
+        elif name.startswith("max_"):
+            column = getattr(models.Scan, f"haadf_{name[len('max_'):]}")
+            filters.append(column <= value)
+        else:
+            filters.append(getattr(models.Scan, f"haadf_{name}") == value)
+
+    return filters
+
+
+def _get_scans_filters(
     scan_id: int = -1,
     state: schemas.ScanState = None,
     created: datetime = None,
     created_since: datetime = None,
     has_haadf: bool = None,
+    metadata: schemas.HaadfMetadataFilter = None,
 ):
-    query = db.query(models.Scan)
+    filters = []
     if scan_id > -1:
-        query = query.filter(models.Scan.scan_id == scan_id)
+        filters.append(models.Scan.scan_id == scan_id)
 
     if state is not None:
         if state == schemas.ScanState.TRANSFER:
-            query = query.filter(models.Scan.log_files < constants.NUMBER_OF_LOG_FILES)
+            filters.append(models.Scan.log_files < constants.NUMBER_OF_LOG_FILES)
         elif state == schemas.ScanState.COMPLETE:
 
-            query = query.filter(models.Scan.log_files == constants.NUMBER_OF_LOG_FILES)
+            filters.append(models.Scan.log_files == constants.NUMBER_OF_LOG_FILES)
 
     if created is not None:
-        query = query.filter(models.Scan.created == created)
+        filters.append(models.Scan.created == created)
 
     if created_since is not None:
-        query = query.filter(models.Scan.created > created_since)
+        filters.append(models.Scan.created > created_since)
 
     if has_haadf is not None:
         if has_haadf:
-            query = query.filter(models.Scan.haadf_path != None)
+            filters.append(models.Scan.haadf_path != None)
         else:
-            query = query.filter(models.Scan.haadf_path == None)
+            filters.append(models.Scan.haadf_path == None)
 
-    return query
+    if metadata is not None:
+        filters += _get_haadf_metadata_filters(metadata)
 
+    return filters
 
-def get_scans(
+
+def _get_scans_query(
     db: Session,
     skip: int = 0,
     limit: int = 100,
@@ -61,26 +82,140 @@ def get_scans(
     created: datetime = None,
     created_since: datetime = None,
     has_haadf: bool = None,
+    metadata: schemas.HaadfMetadataFilter = None,
 ):
-    query = _get_scans_query(
-        db, skip, limit, scan_id, state, created, created_since, has_haadf
+    filters = _get_scans_filters(
+        scan_id, state, created, created_since, has_haadf, metadata
     )
 
-    return query.order_by(desc(models.Scan.created)).offset(skip).limit(limit).all()
+    return db.query(models.Scan).filter(*filters)
 
 
-def get_scans_count(
+def _get_scans_order(order_by: schemas.ScanOrderBy, descending: bool):
+    direction = desc if descending else asc
+
+    if order_by == schemas.ScanOrderBy.CREATED:
+        return [direction(models.Scan.created), direction(models.Scan.id)]
+
+    # Scans without the metadata go last, whichever the direction
+    column = getattr(models.Scan, f"haadf_{order_by.value}")
+
+    return [direction(column).nullslast(), direction(models.Scan.id)]
+
+
+def get_scans(
     db: Session,
     skip: int = 0,
     limit: int = 100,
     scan_id: int = -1,
     state: schemas.ScanState = None,
     created: datetime = None,
+    created_since: datetime = None,
     has_haadf: bool = None,
+    metadata: schemas.HaadfMetadataFilter = None,
+    order_by: schemas.ScanOrderBy = schemas.ScanOrderBy.CREATED,
+    descending: bool = True,
+    after: Tuple[datetime, int] = None,
 ):
-    query = _get_scans_query(db, skip, limit, scan_id, state, created, has_haadf)
+    query = _get_scans_query(
+        db, skip, limit, scan_id, state, created, created_since, has_haadf, metadata
+    )
+
+    # Keyset pagination, the scans following ( created, id ), only valid for the
+    # default order.
+    if after is not None:
+        query = query.filter(tuple_(models.Scan.created, models.Scan.id) < after)
+
+    return (
+        query.order_by(*_get_scans_order(order_by, descending))
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+
+
+# Exact counts for filtered queries, keyed on the filters
+_scans_count_cache: Dict[Tuple, Tuple[float, int]] = {}
+
+
+def _get_scans_count_from_counters(db: Session, state: schemas.ScanState = None):
+    query = db.query(func.coalesce(func.sum(models.ScanCount.count), 0))
+    if state is not None:
+        query = query.filter(models.ScanCount.state == state.value)
+
+    return query.scalar()
+
+
+def _get_scans_count_estimate(db: Session, filters: List):
+    statement = select(models.Scan.id).where(*filters)
+    compiled = statement.compile(dialect=db.bind.dialect)
+    plan = (
+        db.connection()
+        .exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params)
+        .scalar()
+    )
+
+    return plan[0]["Plan"]["Plan Rows"]
+
+
+def _get_scans_count_cached(db: Session, filters: List, key: Tuple):
+    now = time.monotonic()
+    cached = _scans_count_cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    count = db.query(models.Scan).filter(*filters).count()
 
-    return query.count()
+    # Drop expired entries so the cache stays bounded
+    for k in [k for k, (expires, _) in _scans_count_cache.items() if expires <= now]:
+        del _scans_count_cache[k]
+
+    _scans_count_cache[key] = (now + settings.SCAN_COUNT_CACHE_TTL, count)
+
+    return count
+
+
+# Returns the count and whether it is an estimate
+def get_scans_count(
+    db: Session,
+    scan_id: int = -1,
+    state: schemas.ScanState = None,
+    created: datetime = None,
+    created_since: datetime = None,
+    has_haadf: bool = None,
+    metadata: schemas.HaadfMetadataFilter = None,
+    strategy: schemas.ScanCountStrategy = schemas.ScanCountStrategy.EXACT,
+) -> Tuple[int, bool]:
+    filters = _get_scans_filters(
+        scan_id=scan_id,
+        state=state,
+        created=created,
+        created_since=created_since,
+        has_haadf=has_haadf,
+        metadata=metadata,
+    )
+    metadata_filters = (
+        tuple(sorted(metadata.dict(exclude_none=True).items()))
+        if metadata is not None
+        else ()
+    )
+
+    # Unfiltered and state filtered counts are maintained in the counter table
+    if (
+        scan_id == -1
+        and created is None
+        and created_since is None
+        and has_haadf is None
+        and not metadata_filters
+    ):
+        return (_get_scans_count_from_counters(db, state), False)
+
+    if strategy == schemas.ScanCountStrategy.ESTIMATE:
+        return (_get_scans_count_estimate(db, filters), True)
+
+    key = (scan_id, state, created, created_since, has_haadf, metadata_filters)
+
+    return (_get_scans_count_cached(db, filters, key), False)
 
 
 def create_scan(db: Session, scan: schemas.ScanCreate, haadf_path: str = None):
@@ -212,3 +347,226 @@ def get_prev_next_scan(
     )
 
     return (prev_scan, next_scan)
+
+
+# Async variants
+
+# Eagerly load the relationships, we can't lazy load them with an AsyncSession
+def _select_scans():
+    return (
+        select(models.Scan)
+        .options(selectinload(models.Scan.locations), selectinload(models.Scan.jobs))
+        .execution_options(populate_existing=True)
+    )
+
+
+async def get_scan_async(db: AsyncSession, id: int):
+    result = await db.execute(_select_scans().where(models.Scan.id == id))
+
+    return result.scalars().first()
+
+
+async def get_scans_async(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    scan_id: int = -1,
+    state: schemas.ScanState = None,
+    created: datetime = None,
+    created_since: datetime = None,
+    has_haadf: bool = None,
+    metadata: schemas.HaadfMetadataFilter = None,
+):
+    filters = _get_scans_filters(
+        scan_id, state, created, created_since, has_haadf, metadata
+    )
+    statement = (
+        _select_scans()
+        .where(*filters)
+        .order_by(desc(models.Scan.created))
+        .offset(skip)
+        .limit(limit)
+    )
+    result = await db.execute(statement)
+
+    return result.scalars().all()
+
+
+async def create_scan_async(
+    db: AsyncSession, scan: schemas.ScanCreate, haadf_path: str = None
+):
+    db_scan = models.Scan(**scan.dict(exclude={"locations"}), haadf_path=haadf_path)
+    db_scan.locations = [models.Location(**l.dict()) for l in scan.locations]
+    db.add(db_scan)
+    await db.commit()
+
+    return await get_scan_async(db, db_scan.id)
+
+
+async def update_scan_async(
+    db: AsyncSession,
+    id: int,
+    log_files: int = None,
+    locations: List[schemas.Location] = None,
+    haadf_path: str = None,
+    notes: str = None,
+    haadf_metadata: schemas.HaadfMetadata = None,
+):
+    updated = False
+
+    if log_files is not None:
+        statement = (
+            update(models.Scan)
+            .where(models.Scan.id == id)
+            .where(models.Scan.log_files < log_files)
+            .values(log_files=log_files)
+        )
+
+        resultsproxy = await db.execute(statement)
+        log_files_updated = resultsproxy.rowcount == 1
+        updated = updated or log_files_updated
+
+    if locations:
+        # Only the locations we don't already have are inserted
+        statement = (
+            insert(models.Location)
+            .values([{"host": l.host, "path": l.path, "scan_id": id} for l in locations])
+            .on_conflict_do_nothing(constraint="scan_id_host_path")
+            .returning(models.Location.id)
+        )
+        result = await db.execute(statement)
+        locations_updated = len(result.all()) > 0
+        updated = updated or locations_updated
+
+    if haadf_path is not None:
+        statement = (
+            update(models.Scan)
+            .where(models.Scan.id == id)
+            .where(
+                or_(
+                    models.Scan.haadf_path != haadf_path, models.Scan.haadf_path == None
+                )
+            )
+            .values(haadf_path=haadf_path)
+        )
+        resultsproxy = await db.execute(statement)
+        haadf_path_updated = resultsproxy.rowcount == 1
+        updated = updated or haadf_path_updated
+
+    if haadf_metadata is not None:
+        values = {
+            f"haadf_{name}": value for (name, value) in haadf_metadata.dict().items()
+        }
+        statement = update(models.Scan).where(models.Scan.id == id).values(**values)
+        resultsproxy = await db.execute(statement)
+        haadf_metadata_updated = resultsproxy.rowcount == 1
+        updated = updated or haadf_metadata_updated
+
+    if notes is not None:
+        statement = (
+            update(models.Scan)
+            .where(models.Scan.id == id)
+            .where(or_(models.Scan.notes != notes, models.Scan.notes == None))
+            .values(notes=notes)
+        )
+        resultsproxy = await db.execute(statement)
+        notes_updated = resultsproxy.rowcount == 1
+        updated = updated or notes_updated
+
+    await db.commit()
+
+    return (updated, await get_scan_async(db, id))
+
+
+async def upsert_scans_async(
+    db: AsyncSession, scans: List[schemas.ScanUpsert]
+) -> Tuple[List[models.Scan], Set[int], Set[int]]:
+    # Merge any entries for the same scan, we can't touch a row twice in an upsert
+    merged: Dict[Tuple[int, datetime], schemas.ScanUpsert] = {}
+    for scan in scans:
+        key = (scan.scan_id, scan.created)
+        if key not in merged:
+            merged[key] = scan.copy(deep=True)
+            continue
+
+        m = merged[key]
+        if scan.log_files is not None:
+            m.log_files = max(m.log_files or 0, scan.log_files)
+        m.locations = m.locations + scan.locations
+
+    if not merged:
+        return ([], set(), set())
+
+    # Create the scans, or update the log files count if it has increased.
+    statement = insert(models.Scan).values(
+        [
+            {"scan_id": s.scan_id, "created": s.created, "log_files": s.log_files or 0}
+            for s in merged.values()
+        ]
+    )
+    statement = statement.on_conflict_do_update(
+        constraint="scan_id_created",
+        set_={"log_files": statement.excluded.log_files},
+        where=models.Scan.log_files < statement.excluded.log_files,
+    ).returning(models.Scan.id, literal_column("xmax = 0").label("inserted"))
+
+    created = set()
+    updated = set()
+    for (id, inserted) in await db.execute(statement):
+        if inserted:
+            created.add(id)
+        else:
+            updated.add(id)
+
+    # Look up the ids for all the scans, including the ones that didn't change
+    statement = select(models.Scan.id, models.Scan.scan_id, models.Scan.created).where(
+        tuple_(models.Scan.scan_id, models.Scan.created).in_(list(merged.keys()))
+    )
+    ids = {
+        (scan_id, scan_created): id
+        for (id, scan_id, scan_created) in await db.execute(statement)
+    }
+
+    # Add any new locations
+    locations = {
+        (ids[key], l.host, l.path)
+        for key, scan in merged.items()
+        for l in scan.locations
+        if key in ids
+    }
+    if locations:
+        statement = (
+            insert(models.Location)
+            .values(
+                [
+                    {"scan_id": scan_id, "host": host, "path": path}
+                    for (scan_id, host, path) in locations
+                ]
+            )
+            .on_conflict_do_nothing(constraint="scan_id_host_path")
+            .returning(models.Location.scan_id)
+        )
+        updated.update(scan_id for (scan_id,) in await db.execute(statement))
+
+    await db.commit()
+
+    result = await db.execute(
+        _select_scans().where(models.Scan.id.in_(list(ids.values())))
+    )
+    scans = result.scalars().all()
+
+    return (scans, created, updated - created)
+
+
+async def delete_scan_async(db: AsyncSession, id: int) -> None:
+    await db.execute(delete(models.Scan).where(models.Scan.id == id))
+    await db.commit()
+
+
+async def delete_locations_async(db: AsyncSession, scan_id: int, host: str) -> None:
+    await db.execute(
+        delete(models.Location).where(
+            models.Location.scan_id == scan_id, models.Location.host == host
+        )
+    )
+    await db.commit()
@@ -3,3 +3,4 @@
 from app.db.base_class import Base  # noqa
 from app.models.location import Location  # noqa
 from app.models.scan import Scan  # noqa
+from app.models.scan_count import ScanCount  # noqa
@@ -0,0 +1,226 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.kafka import consumer
+from app.schemas.notification import NotificationFilter
+from app.schemas.scan import ScanEventType
+
+Event = Dict[str, Any]
+
+# Sent to a reconnecting client when the events it missed are no longer
+# buffered, so it has to reload.
+RELOAD_EVENT_TYPE = "notifications.reload"
+
+# Fields sent with every event
+EVENT_KEYS = ["id", "event_type", "seq"]
+
+_missing = object()
+
+
+# A connected client. The hub queues events here and the client relays them to
+# its websocket. If a client falls behind, queued updates for the same scan are
+# coalesced, if that is not enough the client is dropped.
+#
+# Only events matching the client's filter are queued, and updates are reduced
+# to the fields that differ from the last state sent to the client.
+class Subscriber:
+    def __init__(self, max_size: int, state_size: int):
+        self.max_size = max_size
+        self.state_size = state_size
+        self.filter: Optional[NotificationFilter] = None
+        # The last state sent for each scan, least recently sent first
+        self.sent: Dict[int, Event] = OrderedDict()
+        # Each event is held in a single element list so a queued update can be
+        # replaced in place when coalescing.
+        self.events: Deque[List[Event]] = deque()
+        self.updates: Dict[int, List[Event]] = {}
+        self.dropped = False
+        self._ready = asyncio.Event()
+
+    def subscribe(self, filter: Optional[NotificationFilter]) -> None:
+        self.filter = filter
+
+    def matches(self, event: Event) -> bool:
+        if self.filter is None:
+            return True
+
+        event_type = event.get("event_type")
+        if self.filter.created_only and event_type != ScanEventType.CREATED:
+            return False
+
+        if self.filter.jobs_only and "jobs" not in event:
+            return False
+
+        return self.filter.matches_id(event.get("id"))
+
+    def put(self, event: Event) -> None:
+        if self.dropped or not self.matches(event):
+            return
+
+        update = event.get("event_type") == ScanEventType.UPDATED
+
+        if len(self.events) >= self.max_size:
+            queued = self.updates.get(event.get("id")) if update else None
+            if queued is None:
+                self.dropped = True
+                self._ready.set()
+                return
+
+            # Events are shared between subscribers, so merge into a copy
+            queued[0] = {**queued[0], **event}
+            return
+
+        cell = [event]
+        self.events.append(cell)
+        if update:
+            self.updates[event["id"]] = cell
+        self._ready.set()
+
+    def _remember(self, id: int, state: Event) -> None:
+        self.sent[id] = state
+        self.sent.move_to_end(id)
+        if len(self.sent) > self.state_size:
+            self.sent.popitem(last=False)
+
+    # Reduce an update to the fields that have changed since the last state sent
+    # for the scan, returns None if nothing has changed.
+    def delta(self, event: Event) -> Optional[Event]:
+        id = event.get("id")
+
+        event_type = event.get("event_type")
+        if event_type == ScanEventType.CREATED:
+            self._remember(id, event)
+        if event_type != ScanEventType.UPDATED:
+            return event
+
+        if self.filter is not None and self.filter.jobs_only:
+            event = {k: event[k] for k in EVENT_KEYS + ["jobs"] if k in event}
+
+        last = self.sent.get(id, {})
+        delta = {
+            k: v
+            for k, v in event.items()
+            if k in EVENT_KEYS or last.get(k, _missing) != v
+        }
+        if len(delta) == len(EVENT_KEYS):
+            return None
+
+        self._remember(id, {**last, **delta})
+
+        return delta
+
+    async def get(self) -> Optional[Event]:
+        while True:
+            while not self.events:
+                if self.dropped:
+                    return None
+                self._ready.clear()
+                await self._ready.wait()
+
+            cell = self.events.popleft()
+            event = cell[0]
+            if self.updates.get(event.get("id")) is cell:
+                del self.updates[event["id"]]
+
+            event = self.delta(event)
+            if event is not None:
+                return event
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Event:
+        event = await self.get()
+        if event is None:
+            raise StopAsyncIteration
+
+        return event
+
+
+# A single kafka consumer per API worker fanning scan events out to all the
+# connected websockets.
+#
+# Events carry a sequence number, the kafka offset of the event. The scan events
+# topic has a single partition so this is monotonic and the same across API
+# workers. The most recent events are buffered so a reconnecting client can be
+# replayed the events it missed.
+class NotificationHub:
+    def __init__(self):
+        self.subscribers: Set[Subscriber] = set()
+        self.buffer: Deque[Event] = deque(maxlen=settings.NOTIFICATION_BUFFER_SIZE)
+        # The last sequence number seen
+        self.seq: Optional[int] = None
+        self._consumer = None
+        self._task = None
+
+    async def start(self) -> None:
+        self._consumer = await consumer.create()
+        self._task = asyncio.create_task(self._relay_events())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self._consumer is not None:
+            await self._consumer.stop()
+
+    def subscribe(self, since: Optional[int] = None) -> Subscriber:
+        subscriber = Subscriber(
+            settings.NOTIFICATION_QUEUE_SIZE, settings.NOTIFICATION_STATE_SIZE
+        )
+        if since is not None:
+            self._replay(subscriber, since)
+        self.subscribers.add(subscriber)
+
+        return subscriber
+
+    def _replay(self, subscriber: Subscriber, since: int) -> None:
+        # Nothing has been missed
+        if self.seq is not None and since >= self.seq:
+            return
+
+        # The events following since are no longer ( or were never ) buffered
+        if len(self.buffer) == 0 or self.buffer[0]["seq"] > since + 1:
+            reload = {"id": None, "event_type": RELOAD_EVENT_TYPE, "seq": self.seq}
+            subscriber.put(reload)
+            return
+
+        for event in self.buffer:
+            if event["seq"] > since:
+                subscriber.put(event)
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: Event) -> None:
+        for subscriber in self.subscribers:
+            subscriber.put(event)
+
+    async def _relay_events(self) -> None:
+        while True:
+            try:
+                async for msg in self._consumer:
+                    event = msg.value
+                    event.pop("__faust", None)
+                    event["seq"] = msg.offset
+                    self.seq = msg.offset
+                    self.buffer.append(event)
+                    self.publish(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Exception relaying kafka message.")
+                await asyncio.sleep(1)
+
+
+hub = NotificationHub()
+
+
+async def start():
+    await hub.start()
+
+
+async def stop():
+    await hub.stop()
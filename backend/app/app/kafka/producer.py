@@ -1,3 +1,6 @@
+import asyncio
+from typing import List
+
 from aiokafka import AIOKafkaProducer
 
 from app.core.config import settings
@@ -38,6 +41,17 @@ async def send_filesystem_event_to_kafka(event: FileSystemEvent) -> None:
         logger.exception(f"Exception send on topic: {TOPIC_LOG_FILE_EVENTS}")
 
 
+async def send_filesystem_events_to_kafka(events: List[FileSystemEvent]) -> None:
+    try:
+        # The producer accumulates the messages into a single batch, so we only
+        # need to wait for the batch to be delivered once they are all queued.
+        futures = [await producer.send(TOPIC_LOG_FILE_EVENTS, e) for e in events]
+        if futures:
+            await asyncio.gather(*futures)
+    except:
+        logger.exception(f"Exception send on topic: {TOPIC_LOG_FILE_EVENTS}")
+
+
 async def send_sync_event_to_kafka(event: SyncEvent) -> None:
     try:
         await producer.send(TOPIC_LOG_FILE_SYNC_EVENTS, event)
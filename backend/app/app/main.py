@@ -7,7 +7,7 @@ from starlette.middleware.cors import CORSMiddleware
 from app.api.api_v1.api import api_router
 from app.core.config import settings
 from app.core.logging import logger
-from app.kafka import producer
+from app.kafka import hub, producer
 
 app = FastAPI(
     title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json"
@@ -23,10 +23,13 @@ if settings.SENTRY_DSN_URL is not None:
 async def startup_event():
     logger.info("starting kafka producer")
     await producer.start()
+    logger.info("starting notification hub")
+    await hub.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await hub.stop()
     await producer.stop()
 
 
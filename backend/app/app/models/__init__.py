@@ -1,4 +1,5 @@
 from .job import Job
 from .location import Location
 from .scan import Scan
+from .scan_count import ScanCount
 from .user import User
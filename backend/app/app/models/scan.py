@@ -1,4 +1,5 @@
-from sqlalchemy import Column, DateTime, Integer, String, UniqueConstraint
+from sqlalchemy import (Column, DateTime, Float, Index, Integer, String,
+                        UniqueConstraint)
 from sqlalchemy.orm import relationship
 
 from app.db.base_class import Base
@@ -11,8 +12,28 @@ class Scan(Base):
     created = Column(DateTime(timezone=True), nullable=False, index=True)
     haadf_path = Column(String, nullable=True, default=None, index=True)
 
+    # Metadata extracted from the HAADF image, indexed so scans can be filtered
+    # and sorted on it.
+    haadf_pixel_size = Column(Float, nullable=True, index=True)
+    haadf_pixel_unit = Column(String, nullable=True, index=True)
+    haadf_width = Column(Integer, nullable=True, index=True)
+    haadf_height = Column(Integer, nullable=True, index=True)
+    haadf_dtype = Column(String, nullable=True, index=True)
+    haadf_intensity_min = Column(Float, nullable=True)
+    haadf_intensity_max = Column(Float, nullable=True)
+    haadf_intensity_mean = Column(Float, nullable=True, index=True)
+    haadf_intensity_std = Column(Float, nullable=True)
+    haadf_voltage = Column(Float, nullable=True, index=True)
+    haadf_magnification = Column(Float, nullable=True, index=True)
+    haadf_camera_length = Column(Float, nullable=True, index=True)
+    haadf_dwell_time = Column(Float, nullable=True, index=True)
+
     locations = relationship("Location", cascade="delete")
     notes = Column(String, nullable=True)
     jobs = relationship("Job", cascade="delete")
 
-    __table_args__ = (UniqueConstraint("scan_id", "created", name="scan_id_created"),)
+    __table_args__ = (
+        UniqueConstraint("scan_id", "created", name="scan_id_created"),
+        # Used for keyset pagination
+        Index("ix_scans_created_id", "created", "id"),
+    )
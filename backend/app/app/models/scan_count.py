@@ -0,0 +1,9 @@
+from sqlalchemy import Column, Integer, String
+
+from app.db.base_class import Base
+
+
+# Number of scans in each state, maintained by a trigger on the scans table
+class ScanCount(Base):
+    state = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
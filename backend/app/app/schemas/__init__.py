@@ -1,9 +1,11 @@
 from .events import SubmitJobEvent
 from .file import (FileSystemEvent, FileSystemEventType, HaadfUploaded,
                    SyncEvent)
-from .job import Job, JobCreate, JobUpdate
+from .job import Job, JobBulkUpdate, JobCreate, JobUpdate
 from .jwt import Token, TokenData
 from .machine import Machine
-from .scan import (Location, Scan, ScanCreate, ScanState, ScanUpdate,
-                   ScanUpdateEvent)
+from .notification import NotificationFilter, NotificationSubscribe
+from .scan import (HaadfMetadata, HaadfMetadataFilter, Location, Scan,
+                   ScanCountStrategy, ScanCreate, ScanOrderBy, ScanState,
+                   ScanUpdate, ScanUpdateEvent, ScanUpsert)
 from .user import User, UserCreate, UserResponse
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -35,6 +35,11 @@ class File(BaseModel):
 
 class SyncEvent(BaseModel):
     files: List[File]
+    # Large snapshots are split into chunks, the id identifies the snapshot the
+    # chunk is part of.
+    id: Optional[str] = None
+    chunk: int = 0
+    last: bool = True
 
 
 class HaadfUploaded(BaseModel):
@@ -73,3 +73,7 @@ class JobUpdate(BaseModel):
     state: Optional[JobState]
     output: Optional[str]
     elapsed: Optional[timedelta]
+
+
+class JobBulkUpdate(JobUpdate):
+    id: int
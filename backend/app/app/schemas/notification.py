@@ -0,0 +1,34 @@
+from typing import List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+
+class NotificationFilter(BaseModel):
+    # Only send events for these scans, for example the scans on the current page
+    ids: Optional[Set[int]] = None
+    # Only send events for scans with ids in these inclusive ranges, a range with
+    # no end is open ended.
+    id_ranges: Optional[List[Tuple[int, Optional[int]]]] = None
+    # Only send scan created events
+    created_only: bool = False
+    # Only send updates that change a scan's jobs
+    jobs_only: bool = False
+
+    def matches_id(self, id: int) -> bool:
+        if self.ids is None and self.id_ranges is None:
+            return True
+
+        if self.ids is not None and id in self.ids:
+            return True
+
+        for (start, end) in self.id_ranges or []:
+            if start <= id and (end is None or id <= end):
+                return True
+
+        return False
+
+
+# Sent by a websocket client to change its subscription, a null filter
+# subscribes to everything.
+class NotificationSubscribe(BaseModel):
+    subscribe: Optional[NotificationFilter]
@@ -1,9 +1,11 @@
 from datetime import datetime
 from enum import Enum
+from pathlib import PurePosixPath
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 
+from app.core.constants import HAADF_IMAGE_VARIANT_SUFFIX
 from app.schemas.job import Job
 
 
@@ -26,6 +28,88 @@ class ScanState(str, Enum):
     COMPLETE = "complete"
 
 
+class ScanCountStrategy(str, Enum):
+    EXACT = "exact"
+    ESTIMATE = "estimate"
+    NONE = "none"
+
+
+# The metadata extracted from the DM4 file of the HAADF image, stored on the scan
+# as haadf_{field}.
+class HaadfMetadata(BaseModel):
+    pixel_size: Optional[float]
+    pixel_unit: Optional[str]
+    width: Optional[int]
+    height: Optional[int]
+    dtype: Optional[str]
+    intensity_min: Optional[float]
+    intensity_max: Optional[float]
+    intensity_mean: Optional[float]
+    intensity_std: Optional[float]
+    voltage: Optional[float]
+    magnification: Optional[float]
+    camera_length: Optional[float]
+    dwell_time: Optional[float]
+
+
+# Ranges are given as min_{field} and max_{field}, both inclusive
+class HaadfMetadataFilter(BaseModel):
+    min_pixel_size: Optional[float]
+    max_pixel_size: Optional[float]
+    pixel_unit: Optional[str]
+    min_width: Optional[int]
+    max_width: Optional[int]
+    min_height: Optional[int]
+    max_height: Optional[int]
+    dtype: Optional[str]
+    min_intensity_mean: Optional[float]
+    max_intensity_mean: Optional[float]
+    min_voltage: Optional[float]
+    max_voltage: Optional[float]
+    min_magnification: Optional[float]
+    max_magnification: Optional[float]
+    min_camera_length: Optional[float]
+    max_camera_length: Optional[float]
+    min_dwell_time: Optional[float]
+    max_dwell_time: Optional[float]
+
+
+class ScanOrderBy(str, Enum):
+    CREATED = "created"
+    PIXEL_SIZE = "pixel_size"
+    WIDTH = "width"
+    HEIGHT = "height"
+    INTENSITY_MEAN = "intensity_mean"
+    VOLTAGE = "voltage"
+    MAGNIFICATION = "magnification"
+    CAMERA_LENGTH = "camera_length"
+    DWELL_TIME = "dwell_time"
+
+
+def haadf_variant_path(haadf_path: str, variant: str) -> str:
+    path = PurePosixPath(haadf_path)
+
+    return str(path.with_name(f"{path.stem}_{variant}{HAADF_IMAGE_VARIANT_SUFFIX}"))
+
+
+# The paths of the downscaled HAADF images are derived from the full image, so
+# list views can fetch the thumbnails.
+def _haadf_variant_paths(cls, v, values, field):
+    haadf_path = values.get("haadf_path")
+    if v is not None or haadf_path is None:
+        return v
+
+    variant = field.name[len("haadf_") : -len("_path")]
+
+    return haadf_variant_path(haadf_path, variant)
+
+
+def haadf_variants_validator():
+    return validator(
+        "haadf_thumbnail_path", "haadf_medium_path", always=True, allow_reuse=True
+    )(_haadf_variant_paths)
+
+
 class Scan(BaseModel):
     id: int
     scan_id: int
@@ -33,9 +117,26 @@ class Scan(BaseModel):
     created: datetime
     locations: List[Location]
     haadf_path: Optional[str]
+    haadf_thumbnail_path: Optional[str]
+    haadf_medium_path: Optional[str]
+    haadf_pixel_size: Optional[float]
+    haadf_pixel_unit: Optional[str]
+    haadf_width: Optional[int]
+    haadf_height: Optional[int]
+    haadf_dtype: Optional[str]
+    haadf_intensity_min: Optional[float]
+    haadf_intensity_max: Optional[float]
+    haadf_intensity_mean: Optional[float]
+    haadf_intensity_std: Optional[float]
+    haadf_voltage: Optional[float]
+    haadf_magnification: Optional[float]
+    haadf_camera_length: Optional[float]
+    haadf_dwell_time: Optional[float]
     notes: Optional[str]
     jobs: List[Job]
 
+    _haadf_variants = haadf_variants_validator()
+
     class Config:
         orm_mode = True
 
@@ -46,6 +147,13 @@ class ScanCreate(BaseModel):
     locations: List[LocationCreate]
 
 
+class ScanUpsert(BaseModel):
+    scan_id: int
+    created: datetime
+    log_files: Optional[int] = None
+    locations: List[LocationCreate] = []
+
+
 class ScanUpdate(BaseModel):
     log_files: Optional[int] = None
     locations: Optional[List[LocationCreate]] = None
@@ -76,10 +184,18 @@ class ScanCreatedEvent(ScanEvent):
     created: datetime
     event_type = ScanEventType.CREATED
     haadf_path: Optional[str] = None
+    haadf_thumbnail_path: Optional[str] = None
+    haadf_medium_path: Optional[str] = None
+
+    _haadf_variants = haadf_variants_validator()
 
 
 class ScanUpdateEvent(ScanEvent):
     event_type = ScanEventType.UPDATED
     jobs: Optional[List[Job]]
     haadf_path: Optional[str]
+    haadf_thumbnail_path: Optional[str]
+    haadf_medium_path: Optional[str]
     notes: Optional[str]
+
+    _haadf_variants = haadf_variants_validator()
@@ -0,0 +1,118 @@
+# Load test the API with concurrent file event ingestion and scan listing, and
+# report the latency percentiles for each request type.
+#
+# Usage: python benchmarks/load.py --url http://localhost:8000/api/v1 \
+#            --api-key letmeout --concurrency 50 --duration 30
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+import aiohttp
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+
+    return values[index]
+
+
+async def post_file_event(session: aiohttp.ClientSession, args, i: int) -> None:
+    event = {
+        "event_type": "created",
+        "src_path": f"/tmp/load/log_scan{i // 72}_module{i % 72}_dst0.data",
+        "is_directory": False,
+        "host": "load-test",
+        "created": datetime.now().astimezone().isoformat(),
+    }
+    async with session.post(f"{args.url}/files", json=event) as r:
+        r.raise_for_status()
+
+
+async def list_scans(session: aiohttp.ClientSession, args, i: int) -> None:
+    async with session.get(
+        f"{args.url}/scans", params={"skip": (i % 10) * 20, "limit": 20}
+    ) as r:
+        r.raise_for_status()
+        await r.read()
+
+
+async def worker(
+    session: aiohttp.ClientSession,
+    args,
+    request,
+    latencies: List[float],
+    errors: Dict[str, int],
+    deadline: float,
+) -> None:
+    i = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            await request(session, args, i)
+            latencies.append(time.perf_counter() - start)
+        except aiohttp.ClientError:
+            errors[request.__name__] += 1
+        i += 1
+
+
+async def run(args) -> None:
+    headers = {args.api_key_name: args.api_key}
+    connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+        deadline = time.monotonic() + args.duration
+        workers = []
+        for request in [post_file_event, list_scans]:
+            for _ in range(args.concurrency):
+                workers.append(
+                    worker(
+                        session,
+                        args,
+                        request,
+                        latencies[request.__name__],
+                        errors,
+                        deadline,
+                    )
+                )
+        await asyncio.gather(*workers)
+
+    print(
+        f"{'request':>16} {'count':>8} {'errors':>8} {'req/s':>8} "
+        f"{'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}"
+    )
+    for name, values in latencies.items():
+        if not values:
+            continue
+        print(
+            f"{name:>16} {len(values):>8} {errors[name]:>8} "
+            f"{len(values) / args.duration:>8.1f} "
+            f"{percentile(values, 50) * 1000:>10.1f} "
+            f"{percentile(values, 95) * 1000:>10.1f} "
+            f"{percentile(values, 99) * 1000:>10.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test file event ingestion and scan listing."
+    )
+    parser.add_argument("--url", default="http://localhost:8000/api/v1")
+    parser.add_argument("--api-key-name", default="access_key")
+    parser.add_argument("--api-key", default="letmeout")
+    parser.add_argument(
+        "--concurrency", type=int, default=50, help="Clients per request type"
+    )
+    parser.add_argument("--duration", type=float, default=30.0)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Benchmark the notifications fan-out. Opens a number of websocket clients,
+# publishes scan update events directly to kafka and reports the delivery
+# latency percentiles along with any clients that were dropped.
+#
+# Usage: python benchmarks/notifications.py --url ws://localhost:8000/api/v1 \
+#            --token <access token> --kafka localhost:9092 --clients 500 \
+#            --events 1000 --rate 200
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+
+import aiohttp
+from aiokafka import AIOKafkaProducer
+
+TOPIC_SCAN_EVENTS = "scan_events"
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+
+    return values[index]
+
+
+async def client(
+    session: aiohttp.ClientSession,
+    args,
+    connected: asyncio.Event,
+    ready: List[int],
+    latencies: List[float],
+    received: List[int],
+    dropped: List[int],
+) -> None:
+    async with session.ws_connect(
+        f"{args.url}/notifications", params={"token": args.token}
+    ) as ws:
+        ready.append(1)
+        if len(ready) == args.clients:
+            connected.set()
+
+        count = 0
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                break
+            event = json.loads(msg.data)
+            if "sent" not in event:
+                continue
+            latencies.append(time.time() - event["sent"])
+            count += 1
+            if event.get("last"):
+                break
+
+        received.append(count)
+        if ws.close_code == 1013:
+            dropped.append(1)
+
+
+async def publish(args) -> None:
+    producer = AIOKafkaProducer(
+        bootstrap_servers=args.kafka, value_serializer=lambda v: json.dumps(v).encode()
+    )
+    await producer.start()
+    try:
+        for i in range(args.events):
+            event = {
+                "id": i % 100,
+                "log_files": i % 72,
+                "event_type": "scan.updated",
+                "sent": time.time(),
+                "last": i == args.events - 1,
+            }
+            await producer.send(TOPIC_SCAN_EVENTS, event)
+            await asyncio.sleep(1 / args.rate)
+        await producer.flush()
+    finally:
+        await producer.stop()
+
+
+async def run(args) -> None:
+    connected = asyncio.Event()
+    ready = []
+    latencies = []
+    received = []
+    dropped = []
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        clients = [
+            asyncio.create_task(
+                client(session, args, connected, ready, latencies, received, dropped)
+            )
+            for _ in range(args.clients)
+        ]
+        await connected.wait()
+
+        start = time.perf_counter()
+        await publish(args)
+        await asyncio.wait_for(asyncio.gather(*clients), args.timeout)
+        elapsed = time.perf_counter() - start
+
+    print(f"clients: {args.clients} events: {args.events} elapsed: {elapsed:.1f}s")
+    print(f"delivered: {len(latencies)} ({len(latencies) / elapsed:.1f} msg/s)")
+    print(
+        f"per client received: min {min(received)} max {max(received)}, "
+        f"dropped clients: {len(dropped)}"
+    )
+    if latencies:
+        print(
+            f"latency p50 {percentile(latencies, 50) * 1000:.1f}ms "
+            f"p95 {percentile(latencies, 95) * 1000:.1f}ms "
+            f"p99 {percentile(latencies, 99) * 1000:.1f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark notification fan-out.")
+    parser.add_argument("--url", default="ws://localhost:8000/api/v1")
+    parser.add_argument("--token", required=True, help="Access token")
+    parser.add_argument("--kafka", default="localhost:9092")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=200, help="Events per second")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
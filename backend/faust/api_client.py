@@ -0,0 +1,130 @@
+import asyncio
+import re
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Optional
+
+import aiohttp
+import orjson
+from pydantic.json import pydantic_encoder
+
+from config import settings
+
+
+def dumps(obj: Any) -> str:
+    return orjson.dumps(obj, default=pydantic_encoder).decode()
+
+
+class RequestMetrics:
+    def __init__(self, max_latencies: int = 1000):
+        self.requests: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        # The most recent request latencies by route (seconds)
+        self.latencies: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=max_latencies)
+        )
+
+    def record(self, route: str, latency: float, error: bool = False) -> None:
+        self.requests[route] += 1
+        self.latencies[route].append(latency)
+        if error:
+            self.errors[route] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        metrics = {}
+        for route, count in self.requests.items():
+            latencies = sorted(self.latencies[route])
+            p50 = latencies[int(0.50 * (len(latencies) - 1))]
+            p95 = latencies[int(0.95 * (len(latencies) - 1))]
+            metrics[route] = {
+                "requests": count,
+                "errors": self.errors[route],
+                "latency": {"p50": p50, "p95": p95, "max": latencies[-1]},
+            }
+
+        return metrics
+
+
+request_metrics = RequestMetrics()
+
+_id_pattern = re.compile(r"/\d+(?=/|$)")
+
+
+# Group requests by method and path, with ids replaced, so /scans/1 and /scans/2
+# are the same route.
+def route(method: str, url: aiohttp.client.URL) -> str:
+    return f"{method} {_id_pattern.sub('/{id}', url.path)}"
+
+
+async def _on_request_start(session, context, params) -> None:
+    context.start = asyncio.get_event_loop().time()
+
+
+async def _on_request_end(session, context, params) -> None:
+    latency = asyncio.get_event_loop().time() - context.start
+    error = params.response.status >= 400
+    request_metrics.record(route(params.method, params.url), latency, error)
+
+
+async def _on_request_exception(session, context, params) -> None:
+    latency = asyncio.get_event_loop().time() - context.start
+    request_metrics.record(route(params.method, params.url), latency, True)
+
+
+def create_session() -> aiohttp.ClientSession:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+
+    # Keep a pool of connections to the API open between requests
+    connector = aiohttp.TCPConnector(
+        limit=settings.API_MAX_CONNECTIONS,
+        keepalive_timeout=settings.API_KEEPALIVE_TIMEOUT,
+    )
+
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers={settings.API_KEY_NAME: settings.API_KEY},
+        json_serialize=dumps,
+        timeout=aiohttp.ClientTimeout(total=settings.API_TIMEOUT),
+        trace_configs=[trace_config],
+    )
+
+
+_session = None
+
+
+# The session shared by all the agents in the worker
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = create_session()
+
+    return _session
+
+
+async def api_request(
+    session: aiohttp.ClientSession,
+    method: str,
+    path: str,
+    json: Any = None,
+    params: Optional[Dict[str, Any]] = None,
+) -> Any:
+    async with session.request(
+        method, f"{settings.API_URL}/{path}", json=json, params=params
+    ) as r:
+        r.raise_for_status()
+        body = await r.read()
+
+        if not body:
+            return None
+
+        return orjson.loads(body)
+
+
+async def get_request_metrics(web, request):
+    return web.json(request_metrics.as_dict())
+
+
+def add_metrics_page(app) -> None:
+    app.page("/api/metrics/")(get_request_metrics)
@@ -0,0 +1,131 @@
+# Measure requests per second from a worker to the API, comparing a new session
+# per request and a default session using pydantic serialization against the
+# shared API client. The API is replaced with a stub running in a separate
+# process, that accepts job updates and returns the job.
+#
+# Usage: python benchmarks/api_client.py --requests 5000 --concurrency 20
+import argparse
+import asyncio
+import multiprocessing
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import api_client  # noqa: E402
+from config import settings  # noqa: E402
+from schemas import Job, JobUpdate  # noqa: E402
+
+
+def run_stub(port: int) -> None:
+    async def update_job(request):
+        update = await request.json()
+
+        return web.json_response(
+            {
+                "id": update["id"],
+                "job_type": "count",
+                "scan_id": 1,
+                "slurm_id": 1,
+                "state": update["state"],
+                "machine": "perlmutter",
+            }
+        )
+
+    app = web.Application()
+    app.router.add_patch("/jobs/{id}", update_job)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def job_update(i: int) -> JobUpdate:
+    return JobUpdate(id=i, state="RUNNING", elapsed=timedelta(seconds=i))
+
+
+async def new_session_per_request(session, i):
+    update = job_update(i)
+    async with aiohttp.ClientSession() as session:
+        async with session.patch(
+            f"{settings.API_URL}/jobs/{update.id}",
+            headers={
+                settings.API_KEY_NAME: settings.API_KEY,
+                "Content-Type": "application/json",
+            },
+            data=update.json(),
+        ) as r:
+            r.raise_for_status()
+            Job(**await r.json())
+
+
+async def default_session(session, i):
+    update = job_update(i)
+    async with session.patch(
+        f"{settings.API_URL}/jobs/{update.id}",
+        headers={
+            settings.API_KEY_NAME: settings.API_KEY,
+            "Content-Type": "application/json",
+        },
+        data=update.json(),
+    ) as r:
+        r.raise_for_status()
+        Job(**await r.json())
+
+
+async def shared_client(session, i):
+    update = job_update(i)
+    Job(**await api_client.api_request(session, "PATCH", f"jobs/{update.id}", update))
+
+
+async def measure(name, request, session, args):
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            await request(session, queue.get_nowait())
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+
+    print(f"{name:>26}: {args.requests / elapsed:>10.1f} req/s")
+
+
+async def run(args):
+    async with aiohttp.ClientSession() as session:
+        await measure("new session per request", new_session_per_request, None, args)
+        await measure("default session", default_session, session, args)
+
+    session = api_client.create_session()
+    try:
+        await measure("shared client", shared_client, session, args)
+    finally:
+        await session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark worker requests to the API.")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    settings.API_URL = f"http://127.0.0.1:{args.port}"
+
+    stub = multiprocessing.Process(target=run_stub, args=(args.port,), daemon=True)
+    stub.start()
+    time.sleep(1)
+
+    try:
+        asyncio.run(run(args))
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
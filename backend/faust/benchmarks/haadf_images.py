@@ -0,0 +1,216 @@
+# Measure how many HAADF images per second can be rendered from DM4 files,
+# comparing rendering with pyplot on the event loop against the render pool used
+# by the HAADF worker. The longest stall of the event loop is also reported, as
+# that is what delays the Kafka heartbeats of the worker.
+#
+# The DM4 files are synthetic, containing just the tags needed by ncempy.
+#
+# Usage: python benchmarks/haadf_images.py --files 32 --size 2048
+import argparse
+import asyncio
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import ncempy.io as nio  # noqa: E402
+import numpy as np  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import haadf_worker  # noqa: E402
+
+# DM tag encodings
+DM_LONG = 3
+DM_USHORT = 4
+DM_FLOAT = 6
+DM_ARRAY = 20
+# DM image data type for float32
+DM_IMAGE_FLOAT32 = 2
+
+
+def _label(label: str) -> bytes:
+    return struct.pack(">H", len(label)) + label.encode()
+
+
+def _group(label: str, entries) -> bytes:
+    body = struct.pack(">bbQ", 0, 1, len(entries)) + b"".join(entries)
+
+    return b"\x14" + _label(label) + struct.pack(">Q", len(body)) + body
+
+
+def _tag(label: str, info, value: bytes) -> bytes:
+    body = b"%%%%" + struct.pack(f">Q{len(info)}Q", len(info), *info) + value
+
+    return b"\x15" + _label(label) + struct.pack(">Q", len(body)) + body
+
+
+def _native(label: str, encoded_type: int, fmt: str, value) -> bytes:
+    return _tag(label, [encoded_type], struct.pack(f"<{fmt}", value))
+
+
+def _array(label: str, encoded_type: int, data: np.ndarray) -> bytes:
+    return _tag(label, [DM_ARRAY, encoded_type, data.size], data.tobytes())
+
+
+def _dimension(scale: float, units: str) -> bytes:
+    return _group(
+        "",
+        [
+            _native("Origin", DM_FLOAT, "f", 0),
+            _native("Scale", DM_FLOAT, "f", scale),
+            _array("Units", DM_USHORT, np.frombuffer(units.encode("utf-16-le"), "<u2")),
+        ],
+    )
+
+
+def write_dm4(path: Path, data: np.ndarray, pixel_size: float) -> None:
+    data = data.astype("<f4")
+    height, width = data.shape
+
+    image = _group(
+        "",
+        [
+            _group(
+                "ImageData",
+                [
+                    _group(
+                        "Calibrations",
+                        [
+                            _group(
+                                "Dimension",
+                                [
+                                    _dimension(pixel_size, "nm"),
+                                    _dimension(pixel_size, "nm"),
+                                ],
+                            )
+                        ],
+                    ),
+                    _array("Data", DM_FLOAT, data),
+                    _native("DataType", DM_LONG, "i", DM_IMAGE_FLOAT32),
+                    _group(
+                        "Dimensions",
+                        [
+                            _native("", DM_LONG, "i", width),
+                            _native("", DM_LONG, "i", height),
+                        ],
+                    ),
+                ],
+            )
+        ],
+    )
+    root = struct.pack(">bbQ", 0, 1, 1) + _group("ImageList", [image])
+
+    with path.open("wb") as fp:
+        fp.write(struct.pack(">IQI", 4, len(root), 1))
+        fp.write(root)
+
+
+def generate_dm4_files(dir: Path, count: int, size: int):
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size]
+    paths = []
+    for i in range(count):
+        # Some structure on top of noise
+        data = np.sin(x / (10 + i)) * np.cos(y / (20 + i)) + rng.random((size, size))
+        path = dir / f"{i}.dm4"
+        write_dm4(path, data, 0.1)
+        paths.append(path)
+
+    return paths
+
+
+async def render_pyplot(tmp_dir, dm4_path, scan_id):
+    haadf = nio.read(dm4_path)
+    path = Path(tmp_dir) / f"{scan_id}.png"
+    plt.imsave(str(path), haadf["data"])
+
+    return path
+
+
+# Track the longest time the event loop takes to wake up a sleeping task
+async def monitor_loop(stalls, interval=0.01):
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        stalls.append(loop.time() - start - interval)
+
+
+async def measure(name, render, paths, concurrency, out_dir):
+    stalls = [0.0]
+    monitor = asyncio.create_task(monitor_loop(stalls))
+    await asyncio.sleep(0)
+    queue = asyncio.Queue()
+    for i, path in enumerate(paths):
+        queue.put_nowait((i, path))
+
+    async def worker():
+        while not queue.empty():
+            i, path = queue.get_nowait()
+            await render(out_dir, str(path), i)
+            # Let the monitor run between images, as faust would between events
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.1)
+    monitor.cancel()
+
+    print(
+        f"{name:>12}: {len(paths) / elapsed:>8.1f} images/s, "
+        f"max event loop stall {max(stalls) * 1000:.0f} ms"
+    )
+
+
+async def run(args, paths, out_dir):
+    await measure("pyplot", render_pyplot, paths, 1, out_dir)
+
+    # Start the pool processes before measuring
+    pool = haadf_worker.render_pool()
+    await asyncio.gather(
+        *[
+            asyncio.get_event_loop().run_in_executor(pool, time.sleep, 0.1)
+            for _ in range(args.workers)
+        ]
+    )
+    await measure(
+        "render pool",
+        haadf_worker.generate_haadf_image,
+        paths,
+        args.queue_size,
+        out_dir,
+    )
+
+    pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HAADF image rendering.")
+    parser.add_argument("--files", type=int, default=32)
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=8)
+    args = parser.parse_args()
+
+    haadf_worker.settings.HAADF_RENDER_WORKERS = args.workers
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dm4_dir = Path(tmp) / "dm4"
+        out_dir = Path(tmp) / "png"
+        dm4_dir.mkdir()
+        out_dir.mkdir()
+
+        paths = generate_dm4_files(dm4_dir, args.files, args.size)
+        asyncio.run(run(args, paths, str(out_dir)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Measure how many job submissions per second can be rendered, comparing an
+# environment created per submission ( with a deep copy of the scan ) against
+# the cached environment used by the job worker.
+#
+# Usage: python benchmarks/job_scripts.py --submissions 1000
+import argparse
+import asyncio
+import copy
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import jinja2
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import job_worker  # noqa: E402
+from faust_records import Location, Scan  # noqa: E402
+from schemas import Machine  # noqa: E402
+
+MACHINE_NAMES = ["cori", "perlmutter"]
+
+
+async def render_uncached(scan, job, machine, dest_dir):
+    template_loader = jinja2.FileSystemLoader(
+        searchpath=Path(job_worker.__file__).parent / "templates"
+    )
+    template_env = jinja2.Environment(loader=template_loader, enable_async=True)
+    template = template_env.get_template(job_worker.COUNT_JOB_SCRIPT_TEMPLATE)
+
+    scan = copy.deepcopy(scan)
+    scan.locations = [x for x in scan.locations if x.host not in MACHINE_NAMES]
+
+    await template.render_async(
+        settings=job_worker.settings,
+        scan=scan,
+        dest_dir=dest_dir,
+        job=job,
+        machine=machine,
+        **job.params,
+    )
+
+    template = template_env.get_template("bbcp.sh.j2")
+    await template.render_async(
+        settings=job_worker.settings, dest_dir=dest_dir, job=job
+    )
+
+
+async def render_cached(scan, job, machine, dest_dir):
+    await job_worker.render_job_script(scan, job, machine, dest_dir, MACHINE_NAMES)
+    await job_worker.render_bbcp_script(job, dest_dir)
+
+
+async def measure(name, render, args, scan, job, machine):
+    start = time.perf_counter()
+    for _ in range(args.submissions):
+        await render(scan, job, machine, "/tmp")
+    elapsed = time.perf_counter() - start
+
+    print(f"{name:>10}: {args.submissions / elapsed:>10.1f} submissions/s")
+
+
+async def run(args):
+    # The bbcp script is logged on every render
+    job_worker.logger.disabled = True
+
+    locations = [
+        Location(host=host, path=f"/mnt/nvmedata{i}")
+        for i, host in enumerate(["picea", "picea", "picea", "cori", "perlmutter"])
+    ]
+    scan = Scan(
+        id=0, scan_id=1, log_files=72, created=datetime.now(), locations=locations
+    )
+    job = job_worker.Job(
+        id=0, job_type=job_worker.JobType.COUNT, machine="cori", params={"threshold": 4}
+    )
+    machine = Machine(
+        name="cori",
+        account="m3795",
+        qos="realtime",
+        nodes=20,
+        constraint="haswell",
+        ntasks=20,
+        cpus_per_task=64,
+        bbcp_dest_dir="${DW_JOB_STRIPED}",
+    )
+
+    await measure("uncached", render_uncached, args, scan, job, machine)
+    await measure("cached", render_cached, args, scan, job, machine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark job script rendering.")
+    parser.add_argument("--submissions", type=int, default=1000)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Compare the cost of overriding a scan using the scan id to paths index
+# against scanning the whole of the log_files table.
+#
+# The faust tables are replaced with in memory dictionaries, so this measures
+# the lookup work done by the worker rather than RocksDB performance.
+#
+# Usage: python benchmarks/scan_id_index.py --entries 1000000
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import scan_worker  # noqa: E402
+from constants import FILE_EVENT_TYPE_CREATED  # noqa: E402
+from utils import extract_scan_id  # noqa: E402
+
+
+class Table(dict):
+    def __init__(self, default):
+        self.default = default
+
+    # Same as a faust table, return the default without storing it
+    def __missing__(self, key):
+        return self.default()
+
+
+def populate(entries: int) -> None:
+    scan_worker.log_files = Table(scan_worker.LogFileState)
+    scan_worker.scan_id_to_id = Table(int)
+    scan_worker.scan_id_to_log_files = Table(list)
+    scan_worker.scan_id_to_paths = Table(list)
+
+    created = datetime.now()
+    for i in range(entries):
+        scan_id, module = divmod(i, 72)
+        path = f"/data/log_scan{scan_id}_module{module}_dst0.data"
+        state = scan_worker.LogFileState(created=created, processed=True, host="local")
+        scan_worker.set_log_file_state(path, state)
+        scan_worker.scan_id_to_id[scan_id] = scan_id
+        scan_worker.scan_id_to_log_files[scan_id] = [path]
+
+
+def override_by_table_scan(scan_id: int) -> None:
+    del scan_worker.scan_id_to_id[scan_id]
+    del scan_worker.scan_id_to_log_files[scan_id]
+    for p in list(scan_worker.log_files.keys()):
+        if scan_id == extract_scan_id(p):
+            del scan_worker.log_files[p]
+
+
+def override_event(scan_id: int) -> scan_worker.FileSystemEvent:
+    return scan_worker.FileSystemEvent(
+        event_type=FILE_EVENT_TYPE_CREATED,
+        src_path=f"/data/log_scan{scan_id}_module0_dst0.data",
+        is_directory=False,
+        created=datetime.now(),
+        host="local",
+    )
+
+
+async def run(entries: int, overrides: int) -> None:
+    scans = entries // 72
+    scan_ids = [int(i * scans / overrides) for i in range(overrides)]
+
+    populate(entries)
+    start = time.perf_counter()
+    for scan_id in scan_ids:
+        override_by_table_scan(scan_id)
+    table_scan = (time.perf_counter() - start) / overrides
+
+    populate(entries)
+    start = time.perf_counter()
+    for scan_id in scan_ids:
+        await scan_worker.process_override(override_event(scan_id))
+    index = (time.perf_counter() - start) / overrides
+
+    print(f"{'entries':>10} {'table scan (ms)':>16} {'index (ms)':>12}")
+    print(f"{entries:>10} {table_scan * 1000:>16.3f} {index * 1000:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark scan overrides with and without the scan id index."
+    )
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--overrides", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.entries, args.overrides))
+
+
+if __name__ == "__main__":
+    main()
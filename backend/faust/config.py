@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import AnyHttpUrl, BaseSettings
 
@@ -8,11 +8,18 @@ class Settings(BaseSettings):
     API_KEY_NAME: str
     API_KEY: str
     KAFKA_URL: str
+    # Connection pool used for requests to the API
+    API_MAX_CONNECTIONS: int = 20
+    API_KEEPALIVE_TIMEOUT: float = 60
+    API_TIMEOUT: float = 300
 
     SFAPI_CLIENT_ID: str
     SFAPI_PRIVATE_KEY: str
     SFAPI_GRANT_TYPE: str
     SFAPI_USER: str
+    # Backoff used when polling for the result of SFAPI tasks (seconds)
+    SFAPI_TASK_POLL_MIN_INTERVAL: float = 1
+    SFAPI_TASK_POLL_MAX_INTERVAL: float = 30
 
     ACQUISITION_USER: str
     JOB_COUNT_SCRIPT_PATH: str
@@ -24,10 +31,50 @@ class Settings(BaseSettings):
     JOB_QOS_FILTER: str
     JOB_BBCP_EXECUTABLE_PATH: str
     JOB_MACHINE_OVERRIDES_PATH: Optional[str]
+    # Job script templates compiled by scripts/compile_templates.py
+    JOB_COMPILED_TEMPLATES_PATH: Optional[str]
+    # The number of concurrent job submissions by machine name
+    JOB_SUBMIT_CONCURRENCY: Dict[str, int] = {}
+    JOB_SUBMIT_DEFAULT_CONCURRENCY: int = 4
+    # Max number of submissions in progress across all machines
+    JOB_SUBMIT_MAX_PENDING: int = 100
+    # How often to poll a machine for job state while one of our jobs is
+    # pending or running, and otherwise (seconds)
+    JOB_MONITOR_ACTIVE_INTERVAL: float = 15
+    JOB_MONITOR_IDLE_INTERVAL: float = 60
+    # Max time to spend fetching the jobs for a machine (seconds)
+    JOB_MONITOR_TIMEOUT: float = 120
+    # How long to remember that a job has completed, this needs to be longer than
+    # sacct will continue to report the job (seconds)
+    JOB_COMPLETED_TTL: float = 60 * 60 * 24 * 7
+
+    # Updates to the same scan within this window are sent as one request (seconds)
+    SCAN_UPDATE_WINDOW: float = 0.25
+    # Updates that fail with a transient error are retried up to this many times,
+    # waiting SCAN_UPDATE_RETRY_WAIT doubled for each attempt (seconds)
+    SCAN_UPDATE_MAX_ATTEMPTS: int = 5
+    SCAN_UPDATE_RETRY_WAIT: float = 1.0
 
     HAADF_IMAGE_UPLOAD_DIR: str
     HAADF_IMAGE_UPLOAD_DIR_EXPIRATION_HOURS: int
+    # Where the API writes DM4 uploads, incomplete uploads that haven't been
+    # written to for HAADF_IMAGE_UPLOAD_DIR_EXPIRATION_HOURS are removed
+    HAADF_DM4_UPLOAD_DIR: str
     HAADF_NCEMHUB_DM4_DATA_PATH: str
+    HAADF_IMAGE_COLORMAP: str = "viridis"
+    # The max width and height of the downscaled images by variant, and the WebP
+    # quality they are saved with
+    HAADF_IMAGE_SIZES: Dict[str, int] = {"thumbnail": 160, "medium": 640}
+    HAADF_IMAGE_VARIANT_QUALITY: int = 80
+    # The number of processes rendering images and the max number of images
+    # waiting to be rendered
+    HAADF_RENDER_WORKERS: int = 4
+    HAADF_RENDER_QUEUE_SIZE: int = 8
+    # The number of threads copying DM4 files to NCEMHub, the attempts made for
+    # each file and the size of the chunks read (bytes)
+    HAADF_NCEMHUB_COPY_WORKERS: int = 2
+    HAADF_NCEMHUB_COPY_ATTEMPTS: int = 5
+    HAADF_NCEMHUB_COPY_CHUNK_SIZE: int = 8 * 1024 * 1024
 
     CUSTODIAN_USER: str
     CUSTODIAN_PRIVATE_KEY: str
@@ -15,6 +15,9 @@ FILE_EVENT_TYPE_MODIFIED = "modified"
 PRIMARY_LOG_FILE_REGEX = r".*module0to1_dst0.*"
 
 LOG_PREFIX = "log_scan"
+
+# How long to wait for the next chunk of a sync snapshot (seconds)
+SYNC_SNAPSHOT_TIMEOUT = 60 * 10
 SFAPI_TOKEN_URL = "https://oidc.nersc.gov/c2id/token"
 SFAPI_BASE_URL = "https://api.nersc.gov/api/v1.2"
 
@@ -24,6 +27,10 @@ DW_JOB_STRIPED_VAR = "${DW_JOB_STRIPED}"
 
 DATE_DIR_FORMAT = "%Y.%m.%d"
 
+# The downscaled versions of the HAADF images, these need to match the API
+HAADF_IMAGE_VARIANTS = ["thumbnail", "medium"]
+HAADF_IMAGE_VARIANT_SUFFIX = ".webp"
+
 
 class JobState(str, Enum):
     INITIALIZING = (
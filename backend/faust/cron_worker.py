@@ -6,6 +6,7 @@ from aiopath import AsyncPath
 
 import faust
 from config import settings
+from constants import HAADF_IMAGE_VARIANT_SUFFIX
 
 # Setup logger
 logger = logging.getLogger("cron_worker")
@@ -19,10 +20,24 @@ async def haadf_reaper():
     logger.info("Reaping unclaimed HAADF images.")
     expiration = timedelta(hours=settings.HAADF_IMAGE_UPLOAD_DIR_EXPIRATION_HOURS)
     now = datetime.now().astimezone()
-    async for f in AsyncPath(settings.HAADF_IMAGE_UPLOAD_DIR).glob("*.png"):
+    upload_dir = AsyncPath(settings.HAADF_IMAGE_UPLOAD_DIR)
+    # The images, their downscaled variants and metadata
+    for pattern in ["*.png", f"*{HAADF_IMAGE_VARIANT_SUFFIX}", "*.json"]:
+        async for f in upload_dir.glob(pattern):
+            stat_info = await f.stat()
+            created = datetime.fromtimestamp(stat_info.st_ctime).astimezone()
+
+            if now - created > expiration:
+                logger.info(f"Removing: {f}")
+                await f.unlink()
+
+    # Resumable DM4 uploads that have been abandoned, an upload in progress is
+    # still being appended to
+    upload_dir = AsyncPath(settings.HAADF_DM4_UPLOAD_DIR)
+    async for f in upload_dir.glob("*.dm4.part"):
         stat_info = await f.stat()
-        created = datetime.fromtimestamp(stat_info.st_ctime).astimezone()
+        modified = datetime.fromtimestamp(stat_info.st_mtime).astimezone()
 
-        if now - created > expiration:
+        if now - modified > expiration:
             logger.info(f"Removing: {f}")
             await f.unlink()
@@ -0,0 +1,142 @@
+# Rendering of HAADF images, this module is imported by the processes of the
+# render pool, so it should stay free of faust. Only matplotlib's colormaps are
+# used, nothing here touches pyplot or sys.stdout.
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import matplotlib
+import numpy as np
+from ncempy.io import dm
+from PIL import Image
+
+from constants import HAADF_IMAGE_VARIANT_SUFFIX
+
+# The number of entries in the colormap lookup table
+COLORMAP_SIZE = 256
+
+# The acquisition parameters we extract, by the key returned by ncempy
+ACQUISITION_TAGS = {
+    # (V)
+    "voltage": "Microscope Info Voltage",
+    "magnification": "Microscope Info Indicated Magnification",
+    # (mm)
+    "camera_length": "Microscope Info STEM Camera Length",
+    # (us)
+    "dwell_time": "DigiScan Sample Time",
+}
+
+
+# RGB lookup table for a matplotlib colormap, indexed by the normalized intensity
+@lru_cache()
+def colormap_lut(name: str) -> np.ndarray:
+    cmap = matplotlib.colormaps[name].resampled(COLORMAP_SIZE)
+    rgba = cmap(np.arange(COLORMAP_SIZE), bytes=True)
+
+    return np.ascontiguousarray(rgba[:, :3])
+
+
+# Scale the intensities to indexes into the lookup table, using the full range of
+# the data, the same way as matplotlib's imsave.
+def normalize(data: np.ndarray) -> np.ndarray:
+    data = np.nan_to_num(data.astype(np.float32))
+    vmin = data.min()
+    vmax = data.max()
+
+    if vmax == vmin:
+        return np.zeros(data.shape, dtype=np.uint8)
+
+    data -= vmin
+    data *= COLORMAP_SIZE / (vmax - vmin)
+    np.clip(data, 0, COLORMAP_SIZE - 1, out=data)
+
+    return data.astype(np.uint8)
+
+
+def colorize(data: np.ndarray, colormap: str) -> Image.Image:
+    rgb = colormap_lut(colormap)[normalize(data)]
+
+    return Image.fromarray(rgb, "RGB")
+
+
+# The downscaled variants are stored next to the full image, as {id}_{variant}.webp
+def variant_path(path: str, variant: str) -> str:
+    path = Path(path)
+
+    return str(path.with_name(f"{path.stem}_{variant}{HAADF_IMAGE_VARIANT_SUFFIX}"))
+
+
+# Downscale the image for each variant, largest first, so each is resized from
+# the previous one rather than the full image.
+def create_variants(
+    image: Image.Image, sizes: Dict[str, int]
+) -> Dict[str, Image.Image]:
+    variants = {}
+    for variant, size in sorted(sizes.items(), key=lambda x: x[1], reverse=True):
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+        variants[variant] = image
+
+    return variants
+
+
+def _float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_metadata(haadf: Dict[str, Any], tags: Dict[str, Any]) -> Dict[str, Any]:
+    data = haadf["data"]
+    pixel_size = haadf.get("pixelSize") or [None]
+    pixel_unit = haadf.get("pixelUnit") or [None]
+
+    metadata = {
+        # The size along x, the last axis
+        "pixel_size": _float(pixel_size[-1]),
+        "pixel_unit": pixel_unit[-1] or None,
+        "width": data.shape[-1],
+        "height": data.shape[-2] if data.ndim > 1 else 1,
+        "dtype": str(data.dtype),
+        "intensity_min": _float(np.nanmin(data)),
+        "intensity_max": _float(np.nanmax(data)),
+        "intensity_mean": _float(np.nanmean(data, dtype=np.float64)),
+        "intensity_std": _float(np.nanstd(data, dtype=np.float64)),
+    }
+
+    for (name, tag) in ACQUISITION_TAGS.items():
+        metadata[name] = _float(tags.get(tag))
+
+    return metadata
+
+
+def read_haadf(dm4_path: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    with dm.fileDM(dm4_path) as dm_file:
+        haadf = dm_file.getDataset(0)
+        tags = dm_file.getMetadata(0, metadata_keys=["DigiScan"])
+
+    return (haadf, tags)
+
+
+# Render the full image as a PNG and the variants as WebP, decoding the DM4 file
+# once. Returns the paths of the variants and the metadata of the image.
+def render_haadf_image(
+    dm4_path: str,
+    png_path: str,
+    colormap: str,
+    sizes: Dict[str, int],
+    quality: int,
+) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    (haadf, tags) = read_haadf(dm4_path)
+    metadata = extract_metadata(haadf, tags)
+    image = colorize(haadf["data"], colormap)
+    image.save(png_path, format="PNG")
+
+    paths = {}
+    for variant, variant_image in create_variants(image, sizes).items():
+        path = variant_path(png_path, variant)
+        variant_image.save(path, format="WEBP", quality=quality)
+        paths[variant] = path
+
+    return (paths, metadata)
@@ -1,20 +1,23 @@
 import asyncio
 import logging
-import os
-import shutil
-import sys
+import multiprocessing
 import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from typing import Any, Dict, Tuple
 
 import aiohttp
-import matplotlib.pyplot as plt
-import ncempy.io as nio
 import tenacity
 from aiopath import AsyncPath
 
 import faust
+from api_client import add_metrics_page, dumps, get_session
 from config import settings
-from constants import DATE_DIR_FORMAT, TOPIC_HAADF_FILE_EVENTS
+from constants import (DATE_DIR_FORMAT, HAADF_IMAGE_VARIANTS,
+                       TOPIC_HAADF_FILE_EVENTS)
+from haadf_image import render_haadf_image
+from ncemhub import (CopyVerificationError, add_copy_metrics_page, copy_file,
+                     copy_metrics)
 
 # Setup logger
 logger = logging.getLogger("haadf_worker")
@@ -24,6 +27,9 @@ app = faust.App(
     "distiller-haadf", store="rocksdb://", broker=settings.KAFKA_URL, topic_partitions=1
 )
 
+add_metrics_page(app)
+add_copy_metrics_page(app)
+
 
 class HaadfEvent(faust.Record):
     path: str
@@ -33,34 +39,107 @@ class HaadfEvent(faust.Record):
 haadf_events_topic = app.topic(TOPIC_HAADF_FILE_EVENTS, value_type=HaadfEvent)
 
 
-async def generate_haadf_image(tmp_dir: str, dm4_path: str, scan_id: int) -> AsyncPath:
-    haadf = nio.read(dm4_path)
-    img = haadf["data"]
-    # TODO push to scan
-    # haadf['pixelSize'] # this contains the real space pixel size (most important meta data)
+_render_pool = None
+
+
+# Decoding the DM4 file and encoding the image are CPU bound, so they are run in a
+# pool of processes to keep the event loop free.
+def render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(
+            max_workers=settings.HAADF_RENDER_WORKERS,
+            # Don't fork the worker, with its event loop and threads
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    return _render_pool
+
+
+_copy_pool = None
+
+
+# Bounds the number of copies to NCEMHub running at once
+def copy_pool() -> ThreadPoolExecutor:
+    global _copy_pool
+    if _copy_pool is None:
+        _copy_pool = ThreadPoolExecutor(
+            max_workers=settings.HAADF_NCEMHUB_COPY_WORKERS,
+            thread_name_prefix="ncemhub-copy",
+        )
+
+    return _copy_pool
+
+
+# Returns the path of the full image, the paths of its downscaled variants and the
+# metadata extracted from the DM4 file.
+async def generate_haadf_image(
+    tmp_dir: str, dm4_path: str, scan_id: int
+) -> Tuple[AsyncPath, Dict[str, AsyncPath], Dict[str, Any]]:
     path = AsyncPath(tmp_dir) / f"{scan_id}.png"
+    sizes = {
+        variant: size
+        for (variant, size) in settings.HAADF_IMAGE_SIZES.items()
+        if variant in HAADF_IMAGE_VARIANTS
+    }
+
+    loop = asyncio.get_event_loop()
+    (variants, metadata) = await loop.run_in_executor(
+        render_pool(),
+        render_haadf_image,
+        dm4_path,
+        str(path),
+        settings.HAADF_IMAGE_COLORMAP,
+        sizes,
+        settings.HAADF_IMAGE_VARIANT_QUALITY,
+    )
+
+    variants = {variant: AsyncPath(p) for (variant, p) in variants.items()}
 
-    # Work around issue with how faust resets sys.stdout to an instance of FileLogProxy
-    # which doesn't have the property buffer, which is check by Pillow when its writing
-    # out the image, so just reset it to the real stdout while calling imsave.
-    stdout = sys.stdout
-    sys.stdout = sys.__stdout__
-    plt.imsave(str(path), img)
-    sys.stdout = stdout
+    return (path, variants, metadata)
 
-    return path
 
+@tenacity.retry(
+    retry=tenacity.retry_if_exception_type(OSError)
+    | tenacity.retry_if_exception_type(CopyVerificationError),
+    wait=tenacity.wait_exponential(max=30),
+    stop=tenacity.stop_after_attempt(settings.HAADF_NCEMHUB_COPY_ATTEMPTS),
+    before_sleep=lambda retry_state: copy_metrics.retry(),
+    reraise=True,
+)
+async def _copy_file(path: AsyncPath, dest_path: AsyncPath) -> None:
+    await dest_path.parent.mkdir(parents=True, exist_ok=True)
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(
+        copy_pool(),
+        copy_file,
+        str(path),
+        str(dest_path),
+        settings.HAADF_NCEMHUB_COPY_CHUNK_SIZE,
+    )
 
-async def copy_to_ncemhub(path: AsyncPath):
+
+# Returns whether the file was copied and verified
+async def copy_to_ncemhub(path: AsyncPath) -> bool:
 
     stat_info = await path.stat()
     created_datetime = datetime.fromtimestamp(stat_info.st_ctime).astimezone()
 
     date_dir = created_datetime.astimezone().strftime(DATE_DIR_FORMAT)
     dest_path = AsyncPath(settings.HAADF_NCEMHUB_DM4_DATA_PATH) / date_dir / path.name
-    await dest_path.parent.mkdir(parents=True, exist_ok=True)
-    loop = asyncio.get_event_loop()
-    loop.run_in_executor(None, shutil.copy, path, dest_path)
+
+    start = copy_metrics.start(stat_info.st_size)
+    try:
+        await _copy_file(path, dest_path)
+    except (OSError, CopyVerificationError):
+        logger.exception(f"Unable to copy '{path}' to '{dest_path}'.")
+        copy_metrics.finish(stat_info.st_size, start, error=True)
+
+        return False
+
+    copy_metrics.finish(stat_info.st_size, start)
+
+    return True
 
 
 @tenacity.retry(
@@ -72,30 +151,52 @@ async def copy_to_ncemhub(path: AsyncPath):
     wait=tenacity.wait_exponential(max=10),
     stop=tenacity.stop_after_attempt(10),
 )
-async def upload_haadf_image(session: aiohttp.ClientSession, path: AsyncPath):
-    # Now upload
+async def upload_haadf_image(
+    session: aiohttp.ClientSession,
+    path: AsyncPath,
+    variants: Dict[str, AsyncPath],
+    metadata: Dict[str, Any],
+):
+    # Now upload, the variants are small enough to just read in
     async with path.open("rb") as fp:
-        headers = {settings.API_KEY_NAME: settings.API_KEY}
         data = aiohttp.FormData()
         data.add_field("file", fp, filename=path.name, content_type="image/png")
-
-        return await session.post(
-            f"{settings.API_URL}/files/haadf", headers=headers, data=data
-        )
-
-
-@app.agent(haadf_events_topic)
+        for variant_path in variants.values():
+            data.add_field(
+                "variants",
+                await variant_path.read_bytes(),
+                filename=variant_path.name,
+                content_type="image/webp",
+            )
+        data.add_field("metadata", dumps(metadata), content_type="application/json")
+
+        async with session.post(
+            f"{settings.API_URL}/files/haadf", data=data
+        ) as r:
+            r.raise_for_status()
+
+
+# Each instance of the agent handles one event at a time, so the concurrency
+# bounds the number of images queued for the render pool.
+@app.agent(haadf_events_topic, concurrency=settings.HAADF_RENDER_QUEUE_SIZE)
 async def watch_for_haadf_events(haadf_events):
 
-    async with aiohttp.ClientSession() as session:
-        async for event in haadf_events:
-            path = event.path
-            scan_id = event.scan_id
+    session = get_session()
+    async for event in haadf_events:
+        path = AsyncPath(event.path)
+        scan_id = event.scan_id
+        # The copy and the rendering only read the file, so run them together
+        copy = asyncio.ensure_future(copy_to_ncemhub(path))
+        try:
             with tempfile.TemporaryDirectory() as tmp:
-                await copy_to_ncemhub(AsyncPath(path))
-                image_path = await generate_haadf_image(tmp, path, scan_id)
-                r = await upload_haadf_image(session, image_path)
-                r.raise_for_status()
-
-            loop = asyncio.get_event_loop()
-            loop.run_in_executor(None, os.remove, path)
+                (image_path, variants, metadata) = await generate_haadf_image(
+                    tmp, event.path, scan_id
+                )
+                await upload_haadf_image(session, image_path, variants, metadata)
+        finally:
+            copied = await copy
+
+        # Only remove the uploaded file once we have a verified copy, otherwise
+        # it is kept so it isn't lost.
+        if copied:
+            await path.unlink()
@@ -2,10 +2,12 @@ import asyncio
 import copy
 import json
 import logging
+import time
+from collections import defaultdict, deque
 from datetime import datetime, timedelta
 from enum import Enum
 from pathlib import Path
-from typing import Any, Dict, List, Union
+from typing import Any, Deque, Dict, List, Optional, Union
 
 import aiohttp
 import httpx
@@ -17,6 +19,7 @@ from authlib.oauth2.rfc7523 import PrivateKeyJWT
 from dotenv import dotenv_values
 
 import faust
+from api_client import add_metrics_page, get_session
 from config import settings
 from constants import (COUNT_JOB_SCRIPT_TEMPLATE, DATE_DIR_FORMAT,
                        SFAPI_BASE_URL, SFAPI_TOKEN_URL, SLURM_RUNNING_STATES,
@@ -25,13 +28,13 @@ from constants import (COUNT_JOB_SCRIPT_TEMPLATE, DATE_DIR_FORMAT,
 from faust_records import Scan as ScanRecord
 from schemas import JobUpdate
 from schemas import Location as LocationRest
-from schemas import Machine, Scan, ScanUpdate, SfapiJob
-from utils import get_job
+from schemas import Machine, ScanUpdate, SfapiJob
 from utils import get_machine
 from utils import get_machine as fetch_machine
 from utils import get_machines as fetch_machines
 from utils import get_scan
 from utils import update_job as update_job_request
+from utils import update_jobs as update_jobs_request
 from utils import update_scan
 
 # Setup logger
@@ -42,6 +45,8 @@ app = faust.App(
     "distiller-job", store="rocksdb://", broker=settings.KAFKA_URL, topic_partitions=1
 )
 
+add_metrics_page(app)
+
 _client = None
 
 
@@ -90,18 +95,32 @@ submit_job_events_topic = app.topic(TOPIC_JOB_SUBMIT_EVENTS, value_type=SubmitJo
 
 # Cache to store machines, we only need to fetch them once
 _machines = None
+# Held while the machines are fetched, so concurrent submissions wait for the
+# first fetch rather than each making their own.
+_machines_lock = None
 
 
 async def get_machines(session: aiohttp.ClientSession) -> Dict[str, Machine]:
-    global _machines
+    global _machines, _machines_lock
+
+    if _machines is not None:
+        return _machines
+
+    # Created here so it is bound to the running loop
+    if _machines_lock is None:
+        _machines_lock = asyncio.Lock()
 
-    # Fetch once
-    if _machines is None:
-        _machines = {}
-        names = await fetch_machines(session)
-        for name in names:
-            machine = await fetch_machine(session, name)
-            _machines[name] = machine
+    async with _machines_lock:
+        # Fetch once
+        if _machines is None:
+            machines = {}
+            names = await fetch_machines(session)
+            for name in names:
+                machine = await fetch_machine(session, name)
+                machines[name] = machine
+
+            # Only cache the machines once we have them all
+            _machines = machines
 
     return _machines
 
@@ -121,22 +140,45 @@ async def get_machine(session: aiohttp.ClientSession, name: str) -> Machine:
     return machine
 
 
+def create_template_env() -> jinja2.Environment:
+    template_loader = jinja2.FileSystemLoader(
+        searchpath=Path(__file__).parent / "templates"
+    )
+
+    # Use the templates compiled at build time if we have them
+    compiled_path = settings.JOB_COMPILED_TEMPLATES_PATH
+    if compiled_path is not None and Path(compiled_path).exists():
+        template_loader = jinja2.ChoiceLoader(
+            [jinja2.ModuleLoader(compiled_path), template_loader]
+        )
+
+    # The templates don't change while we are running, so compile them once and
+    # don't check for modifications.
+    return jinja2.Environment(
+        loader=template_loader, enable_async=True, auto_reload=False
+    )
+
+
+template_env = create_template_env()
+
+
 async def render_job_script(
-    scan: Scan, job: Job, machine: Machine, dest_dir: str, machine_names: List[str]
+    scan: ScanRecord,
+    job: Job,
+    machine: Machine,
+    dest_dir: str,
+    machine_names: List[str],
 ) -> str:
     if job.job_type == JobType.COUNT:
         template_name = COUNT_JOB_SCRIPT_TEMPLATE
     else:
         template_name = TRANSFER_JOB_SCRIPT_TEMPLATE
 
-    template_loader = jinja2.FileSystemLoader(
-        searchpath=Path(__file__).parent / "templates"
-    )
-    template_env = jinja2.Environment(loader=template_loader, enable_async=True)
     template = template_env.get_template(template_name)
 
-    # Make a copy and filter out machines from locations
-    scan = copy.deepcopy(scan)
+    # Make a shallow copy of the record and filter out machines from locations,
+    # assigning the new list leaves the caller's locations untouched.
+    scan = copy.copy(scan)
     scan.locations = [x for x in scan.locations if x.host not in machine_names]
 
     try:
@@ -156,10 +198,6 @@ async def render_job_script(
 
 
 async def render_bbcp_script(job: Job, dest_dir: str) -> str:
-    template_loader = jinja2.FileSystemLoader(
-        searchpath=Path(__file__).parent / "templates"
-    )
-    template_env = jinja2.Environment(loader=template_loader, enable_async=True)
     template = template_env.get_template("bbcp.sh.j2")
     output = await template.render_async(settings=settings, dest_dir=dest_dir, job=job)
 
@@ -240,6 +278,98 @@ class SfApiError(Exception):
         self.message = message
 
 
+# Tracks the outstanding SFAPI tasks, polling them all from a single loop and
+# resolving a future for each task when its result is available. Each task is
+# polled with an exponential backoff.
+class SfapiTaskTracker:
+    def __init__(self, min_interval: float, max_interval: float):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # task id => (future, interval, when to next poll)
+        self._tasks: Dict[str, List[Any]] = {}
+        self._wakeup = asyncio.Event()
+        self._poller = None
+
+    def track(self, task_id: str) -> asyncio.Future:
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._tasks[task_id] = [
+            future,
+            self.min_interval,
+            loop.time() + self.min_interval,
+        ]
+
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        self._wakeup.set()
+
+        return future
+
+    async def wait(self, task_id: str) -> Dict[str, Any]:
+        return await self.track(task_id)
+
+    def _resolve(self, task_id: str, result: Any = None, exception: Exception = None):
+        (future, _, _) = self._tasks.pop(task_id)
+        if future.done():
+            return
+
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    async def _poll_task(self, task_id: str) -> None:
+        r = await sfapi_get(f"tasks/{task_id}")
+        r.raise_for_status()
+
+        sfapi_response = r.json()
+        logger.info(sfapi_response)
+
+        if sfapi_response["status"] == "error":
+            self._resolve(task_id, exception=SfApiError(sfapi_response["error"]))
+        elif sfapi_response.get("result") is not None:
+            self._resolve(task_id, result=json.loads(sfapi_response["result"]))
+
+    async def _poll(self) -> None:
+        loop = asyncio.get_event_loop()
+
+        while self._tasks:
+            now = loop.time()
+            due = [id for (id, (_, _, when)) in self._tasks.items() if when <= now]
+
+            if not due:
+                next_poll = min(when for (_, _, when) in self._tasks.values())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), next_poll - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            results = await asyncio.gather(
+                *[self._poll_task(id) for id in due], return_exceptions=True
+            )
+
+            now = loop.time()
+            for (id, result) in zip(due, results):
+                if id not in self._tasks:
+                    continue
+
+                if isinstance(result, Exception):
+                    self._resolve(id, exception=result)
+                    continue
+
+                # Still running, backoff
+                task = self._tasks[id]
+                task[1] = min(task[1] * 2, self.max_interval)
+                task[2] = now + task[1]
+
+
+task_tracker = SfapiTaskTracker(
+    settings.SFAPI_TASK_POLL_MIN_INTERVAL, settings.SFAPI_TASK_POLL_MAX_INTERVAL
+)
+
+
 async def submit_job(machine: str, batch_submit_file: str) -> int:
     data = {"job": batch_submit_file, "isPath": True}
 
@@ -252,32 +382,17 @@ async def submit_job(machine: str, batch_submit_file: str) -> int:
 
     task_id = sfapi_response["task_id"]
 
-    # We now need to poll waiting for the task to complete!
-    while True:
-        r = await sfapi_get(f"tasks/{task_id}")
-        r.raise_for_status()
+    # Wait for the task to complete
+    results = await task_tracker.wait(task_id)
 
-        sfapi_response = r.json()
+    if results["status"] == "error":
+        raise SfApiError(results["error"])
 
-        if sfapi_response["status"] == "error":
-            raise SfApiError(sfapi_response["error"])
-
-        logger.info(sfapi_response)
+    slurm_id = results.get("jobid")
+    if slurm_id is None:
+        raise SfApiError(f"Unable to extract slurm job if for task: {task_id}")
 
-        if sfapi_response.get("result") is None:
-            await asyncio.sleep(1)
-            continue
-
-        results = json.loads(sfapi_response["result"])
-
-        if results["status"] == "error":
-            raise SfApiError(results["error"])
-
-        slurm_id = results.get("jobid")
-        if slurm_id is None:
-            raise SfApiError(f"Unable to extract slurm job if for task: {task_id}")
-
-        return int(slurm_id)
+    return int(slurm_id)
 
 
 async def update_slurm_job_id(
@@ -360,26 +475,137 @@ async def process_submit_job_event(
     # Update the job model with the slurm id
     await update_slurm_job_id(session, event.job.id, slurm_id)
 
+    # Start monitoring the new job
+    wake_machine_monitor(machine.name)
 
-@app.agent(submit_job_events_topic)
-async def watch_for_submit_job_events(submit_jobs_events):
-    async with aiohttp.ClientSession() as session:
-        async for event in submit_jobs_events:
-            try:
-                await process_submit_job_event(session, event)
-            except SfApiError as ex:
-                logger.error(f"Error submitting job: {ex.message}")
+
+class SubmissionMetrics:
+    def __init__(self, max_latencies: int = 1000):
+        # Submissions waiting to be made, by machine
+        self.queued: Dict[str, int] = defaultdict(int)
+        # Submissions in progress, by machine
+        self.running: Dict[str, int] = defaultdict(int)
+        self.submitted = 0
+        self.failed = 0
+        # The time from receiving the event to having a slurm id (seconds)
+        self.latencies: Deque[float] = deque(maxlen=max_latencies)
+
+    def as_dict(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+
+            index = min(len(latencies) - 1, int(p / 100 * len(latencies)))
+
+            return latencies[index]
+
+        return {
+            "queued": dict(self.queued),
+            "running": dict(self.running),
+            "submitted": self.submitted,
+            "failed": self.failed,
+            "latency": {
+                "p50": percentile(50),
+                "p95": percentile(95),
+                "max": latencies[-1] if latencies else None,
+            },
+        }
+
+
+submission_metrics = SubmissionMetrics()
+
+
+@app.page("/submissions/metrics/")
+async def get_submission_metrics(web, request):
+    return web.json(submission_metrics.as_dict())
 
 
-async def update_job(
+# Limits the number of concurrent submissions to each machine
+_machine_submission_slots: Dict[str, asyncio.Semaphore] = {}
+
+
+def machine_submission_slots(machine: str) -> asyncio.Semaphore:
+    if machine not in _machine_submission_slots:
+        concurrency = settings.JOB_SUBMIT_CONCURRENCY.get(
+            machine, settings.JOB_SUBMIT_DEFAULT_CONCURRENCY
+        )
+        _machine_submission_slots[machine] = asyncio.Semaphore(concurrency)
+
+    return _machine_submission_slots[machine]
+
+
+# The last submission for each scan, submissions for the same scan are made in
+# the order they are received.
+_scan_submissions: Dict[int, asyncio.Task] = {}
+
+
+async def submit_job_event(
     session: aiohttp.ClientSession,
-    job_id: int,
-    state: str,
-    elapsed: timedelta,
-    output: str = None,
+    event: faust.EventT,
+    previous: Optional[asyncio.Task],
 ) -> None:
-    update = JobUpdate(id=job_id, state=state, output=output, elapsed=elapsed)
-    await update_job_request(session, update)
+    submit_event = event.value
+    machine = submit_event.job.machine
+    received = time.monotonic()
+
+    submission_metrics.queued[machine] += 1
+    queued = True
+    try:
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        async with machine_submission_slots(machine):
+            submission_metrics.queued[machine] -= 1
+            queued = False
+            submission_metrics.running[machine] += 1
+            try:
+                await process_submit_job_event(session, submit_event)
+            finally:
+                submission_metrics.running[machine] -= 1
+
+        submission_metrics.submitted += 1
+        submission_metrics.latencies.append(time.monotonic() - received)
+    except SfApiError as ex:
+        submission_metrics.failed += 1
+        logger.error(f"Error submitting job: {ex.message}")
+    except Exception:
+        submission_metrics.failed += 1
+        logger.exception("Exception submitting job.")
+    finally:
+        if queued:
+            submission_metrics.queued[machine] -= 1
+
+        # Now we are done the event can be committed
+        event.ack()
+
+        scan_id = submit_event.scan.id
+        if _scan_submissions.get(scan_id) is asyncio.current_task():
+            del _scan_submissions[scan_id]
+
+
+@app.agent(submit_job_events_topic)
+async def watch_for_submit_job_events(submit_jobs_events):
+    # Bound the number of submissions in progress
+    pending = asyncio.Semaphore(settings.JOB_SUBMIT_MAX_PENDING)
+
+    async def submit(session, event, previous):
+        try:
+            await submit_job_event(session, event, previous)
+        finally:
+            pending.release()
+
+    session = get_session()
+    # Events are acked once they have been submitted
+    async for event in submit_jobs_events.noack().events():
+        await pending.acquire()
+
+        scan_id = event.value.scan.id
+        previous = _scan_submissions.get(scan_id)
+        _scan_submissions[scan_id] = asyncio.create_task(
+            submit(session, event, previous)
+        )
 
 
 def extract_jobs(sfapi_response: dict) -> List[SfapiJob]:
@@ -423,116 +649,220 @@ async def read_slurm_out(slurm_id: int, workdir: str) -> Union[str, None]:
     return None
 
 
-completed_jobs = set()
+# Jobs we have finished processing, keyed by job id with the time they were
+# completed. Stored in a table so restarts don't reprocess finished jobs, and
+# expired after JOB_COMPLETED_TTL. The table is updated from the monitor tasks
+# rather than an agent, so we need to use the partitioner.
+completed_jobs = app.Table("completed_jobs", default=float, use_partitioner=True)
 
+# Used to wake a machine's monitor early, for example after a job is submitted
+_monitor_wakeups: Dict[str, asyncio.Event] = {}
 
-@app.timer(interval=60)
-async def monitor_jobs():
-    async with aiohttp.ClientSession() as session:
-        try:
-            # First fetch all jobs for machines we have configured
-            jobs = []
-            machines = await get_machines(session)
-            for machine, machine_params in machines.items():
-                logger.info(f"Fetching jobs for '{machine}'")
-                kwargs = [f"user={settings.SFAPI_USER}"]
-                if machine_params.qos_filter is not None:
-                    logger.info(f"Using qos={machine_params.qos_filter}.")
-                    kwargs.append(f"qos={machine_params.qos_filter}")
-                params = {
-                    "kwargs": kwargs,
-                    "sacct": True,
-                }
 
-                try:
-                    logger.info(f"compute/jobs/{machine}")
-                    r = await sfapi_get(f"status/{machine}")
-                    r.raise_for_status()
+def wake_machine_monitor(machine: str) -> None:
+    wakeup = _monitor_wakeups.get(machine)
+    if wakeup is not None:
+        wakeup.set()
 
-                    response_json = r.json()
-                    status = response_json["status"]
 
-                    logger.info(f"{machine} is '{status}'")
+async def fetch_machine_jobs(machine: str, machine_params: Machine) -> List[SfapiJob]:
+    logger.info(f"Fetching jobs for '{machine}'")
+    kwargs = [f"user={settings.SFAPI_USER}"]
+    if machine_params.qos_filter is not None:
+        logger.info(f"Using qos={machine_params.qos_filter}.")
+        kwargs.append(f"qos={machine_params.qos_filter}")
+    params = {
+        "kwargs": kwargs,
+        "sacct": True,
+    }
 
-                    if status == "down":
-                        logger.warning(f"Skipping {machine}")
-                        continue
+    logger.info(f"compute/jobs/{machine}")
+    r = await sfapi_get(f"status/{machine}")
+    r.raise_for_status()
 
-                    r = await sfapi_get(f"compute/jobs/{machine}", params)
-                    r.raise_for_status()
+    response_json = r.json()
+    status = response_json["status"]
 
-                    response_json = r.json()
+    logger.info(f"{machine} is '{status}'")
 
-                    if response_json["status"] != "ok":
-                        error = response_json["error"]
-                        logger.warning(f"SFAPI request to fetch jobs failed with: {error}")
-                        continue
+    if status == "down":
+        logger.warning(f"Skipping {machine}")
+        return []
 
-                    logger.info(response_json)
+    r = await sfapi_get(f"compute/jobs/{machine}", params)
+    r.raise_for_status()
 
-                    jobs += extract_jobs(response_json)
-                except tenacity.RetryError:
-                    logger.exception('SF API timeout.')
-                    pass
+    response_json = r.json()
 
-            # Now process the jobs
-            for job in jobs:
-                id = extract_job_id(job.workdir)
-                if id is None:
-                    logger.warning(
-                        f"Unable to extract job id from workdir: {job.workdir}"
-                    )
-                    continue
+    if response_json["status"] != "ok":
+        error = response_json["error"]
+        logger.warning(f"SFAPI request to fetch jobs failed with: {error}")
+        return []
 
-                # if the is finished and we have already processed it just continue
-                if id in completed_jobs:
-                    continue
+    logger.info(response_json)
 
-                # We are done upload the output
-                output = None
-                if job.state not in SLURM_RUNNING_STATES:
-                    output = await read_slurm_out(job.slurm_id, job.workdir)
+    return extract_jobs(response_json)
 
-                    # Add to completed set so we can skip over it
-                    completed_jobs.add(id)
 
-                # sacct return a state of the form "CANCELLED by XXXX" for the
-                # cancelled state, reset set it so it will be converted to the
-                # right slurm state.
-                if job.state.startswith("CANCELLED by"):
-                    job.state = "CANCELLED"
+# The last state sent to the API for jobs that are still running, by machine, so
+# we only send the jobs that have changed. Only the jobs in the machine's latest
+# poll are kept.
+job_states: Dict[str, Dict[int, JobUpdate]] = {}
 
-                try:
-                    await update_job(
-                        session, id, job.state, elapsed=job.elapsed, output=output
-                    )
-                except aiohttp.client_exceptions.ClientResponseError as ex:
-                    # Ignore 404, this is not a job we created.
-                    if ex.status != 404:
-                        logger.exception("Exception updating job")
 
-                    continue
+async def process_machine_jobs(
+    session: aiohttp.ClientSession, machine: str, jobs: List[SfapiJob]
+) -> None:
+    states = job_states.setdefault(machine, {})
+    seen = set()
+    updates = []
+    for job in jobs:
+        id = extract_job_id(job.workdir)
+        if id is None:
+            logger.warning(f"Unable to extract job id from workdir: {job.workdir}")
+            continue
 
-                # If the job is completed and we are dealing with a transfer job
-                # then update the location.
-                if job.state == JobState.COMPLETED and JobType.TRANSFER in job.name:
-                    job = await get_job(session, id)
-                    scan = await get_scan(session, job.scan_id)
-                    date_dir = scan.created.astimezone().strftime(DATE_DIR_FORMAT)
-
-                    update = ScanUpdate(
-                        id=job.scan_id,
-                        locations=[
-                            LocationRest(
-                                host=f"{machine}",
-                                path=str(
-                                    AsyncPath(settings.JOB_NCEMHUB_RAW_DATA_PATH)
-                                    / date_dir
-                                ),
-                            )
-                        ],
+        seen.add(id)
+
+        # if the is finished and we have already processed it just continue
+        if id in completed_jobs:
+            continue
+
+        # We are done upload the output
+        output = None
+        if job.state not in SLURM_RUNNING_STATES:
+            output = await read_slurm_out(job.slurm_id, job.workdir)
+
+        # sacct return a state of the form "CANCELLED by XXXX" for the
+        # cancelled state, reset set it so it will be converted to the
+        # right slurm state.
+        if job.state.startswith("CANCELLED by"):
+            job.state = "CANCELLED"
+
+        update = JobUpdate(id=id, state=job.state, output=output, elapsed=job.elapsed)
+        if states.get(id) == update:
+            continue
+
+        updates.append((update, job))
+
+    # Forget the jobs that have dropped out of sacct's output
+    for id in states.keys() - seen:
+        del states[id]
+
+    if not updates:
+        return
+
+    # Jobs we didn't create are ignored by the API, only the jobs that changed
+    # are returned.
+    try:
+        updated_jobs = await update_jobs_request(session, [u for (u, _) in updates])
+    except aiohttp.client_exceptions.ClientResponseError:
+        logger.exception("Exception updating jobs")
+        return
+
+    for (update, job) in updates:
+        if job.state in SLURM_RUNNING_STATES:
+            states[update.id] = update
+        else:
+            # Add to completed table so we can skip over it
+            completed_jobs[update.id] = time.time()
+            states.pop(update.id, None)
+
+    # If a transfer job has completed then update the location.
+    updated_jobs = {job.id: job for job in updated_jobs}
+    for (update, job) in updates:
+        updated_job = updated_jobs.get(update.id)
+        if updated_job is None:
+            continue
+
+        if job.state == JobState.COMPLETED and JobType.TRANSFER in job.name:
+            scan = await get_scan(session, updated_job.scan_id)
+            date_dir = scan.created.astimezone().strftime(DATE_DIR_FORMAT)
+
+            scan_update = ScanUpdate(
+                id=updated_job.scan_id,
+                locations=[
+                    LocationRest(
+                        host=f"{machine}",
+                        path=str(
+                            AsyncPath(settings.JOB_NCEMHUB_RAW_DATA_PATH) / date_dir
+                        ),
                     )
-                    await update_scan(session, update)
+                ],
+            )
+            await update_scan(session, scan_update)
+
+
+@app.timer(interval=60 * 60)
+async def expire_completed_jobs():
+    expired_before = time.time() - settings.JOB_COMPLETED_TTL
+    expired = [
+        id for (id, completed) in completed_jobs.items() if completed < expired_before
+    ]
+    for id in expired:
+        del completed_jobs[id]
+
+    if expired:
+        logger.info(f"Expired {len(expired)} completed jobs.")
+
 
+# Returns True if one of our jobs is still pending or running
+def has_active_jobs(jobs: List[SfapiJob]) -> bool:
+    return any(
+        job.state in SLURM_RUNNING_STATES and extract_job_id(job.workdir) is not None
+        for job in jobs
+    )
+
+
+# Each machine is polled independently, so a slow or unavailable machine
+# doesn't hold up the others. Machines are polled more often while they are
+# running one of our jobs.
+async def monitor_machine(
+    session: aiohttp.ClientSession, machine: str, machine_params: Machine
+) -> None:
+    wakeup = _monitor_wakeups.setdefault(machine, asyncio.Event())
+
+    while True:
+        interval = settings.JOB_MONITOR_IDLE_INTERVAL
+        try:
+            jobs = await asyncio.wait_for(
+                fetch_machine_jobs(machine, machine_params),
+                settings.JOB_MONITOR_TIMEOUT,
+            )
+            await process_machine_jobs(session, machine, jobs)
+
+            if has_active_jobs(jobs):
+                interval = settings.JOB_MONITOR_ACTIVE_INTERVAL
+        except asyncio.TimeoutError:
+            logger.warning(f"Fetching jobs for '{machine}' timed out.")
+        except tenacity.RetryError:
+            logger.exception("SF API timeout.")
         except httpx.ReadTimeout as ex:
             logger.warning("Job monitoring request timed out", ex)
+        except Exception:
+            logger.exception(f"Exception monitoring jobs for '{machine}'.")
+
+        wakeup.clear()
+        try:
+            await asyncio.wait_for(wakeup.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+@app.task
+async def monitor_jobs():
+    session = get_session()
+    while True:
+        try:
+            machines = await get_machines(session)
+            break
+        except aiohttp.ClientError:
+            logger.exception("Exception fetching machines.")
+            await asyncio.sleep(settings.JOB_MONITOR_IDLE_INTERVAL)
+
+    await asyncio.gather(
+        *[
+            monitor_machine(session, machine, machine_params)
+            for machine, machine_params in machines.items()
+        ]
+    )
@@ -0,0 +1,118 @@
+# Verified copies of files to NCEMHub. The copy runs in a thread, so this module
+# should stay free of faust.
+import hashlib
+import os
+import shutil
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+
+class CopyVerificationError(Exception):
+    pass
+
+
+def _checksum(path: str, chunk_size: int) -> Tuple[int, bytes]:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as fp:
+        while chunk := fp.read(chunk_size):
+            digest.update(chunk)
+            size += len(chunk)
+
+    return (size, digest.digest())
+
+
+# Copy to {dest}.part, hashing the source as it is read, then read the copy back
+# and only move it into place if its size and checksum match. Returns the size of
+# the file.
+def copy_file(src: str, dest: str, chunk_size: int) -> int:
+    part_path = f"{dest}.part"
+    digest = hashlib.sha256()
+    size = 0
+
+    with open(src, "rb") as fsrc, open(part_path, "wb") as fdest:
+        while chunk := fsrc.read(chunk_size):
+            digest.update(chunk)
+            fdest.write(chunk)
+            size += len(chunk)
+        fdest.flush()
+        os.fsync(fdest.fileno())
+
+    try:
+        src_size = os.stat(src).st_size
+        (dest_size, dest_digest) = _checksum(part_path, chunk_size)
+
+        if size != src_size or dest_size != size:
+            raise CopyVerificationError(
+                f"Size mismatch copying '{src}', {dest_size} of {src_size} bytes."
+            )
+
+        if dest_digest != digest.digest():
+            raise CopyVerificationError(f"Checksum mismatch copying '{src}'.")
+    except Exception:
+        os.remove(part_path)
+        raise
+
+    shutil.copymode(src, part_path)
+    os.replace(part_path, dest)
+
+    return size
+
+
+class CopyMetrics:
+    def __init__(self, max_copies: int = 100):
+        # The files waiting for or being copied
+        self.pending = 0
+        self.pending_bytes = 0
+        self.copied = 0
+        self.copied_bytes = 0
+        self.failed = 0
+        self.retries = 0
+        # The ( bytes, seconds ) of the most recent copies
+        self.recent: Deque[Tuple[int, float]] = deque(maxlen=max_copies)
+
+    def start(self, size: int) -> float:
+        self.pending += 1
+        self.pending_bytes += size
+
+        return time.monotonic()
+
+    def finish(self, size: int, start: float, error: bool = False) -> None:
+        self.pending -= 1
+        self.pending_bytes -= size
+
+        if error:
+            self.failed += 1
+            return
+
+        self.copied += 1
+        self.copied_bytes += size
+        self.recent.append((size, time.monotonic() - start))
+
+    def retry(self) -> None:
+        self.retries += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        recent_bytes = sum(size for (size, _) in self.recent)
+        recent_seconds = sum(seconds for (_, seconds) in self.recent)
+
+        return {
+            "backlog": {"files": self.pending, "bytes": self.pending_bytes},
+            "copied": {"files": self.copied, "bytes": self.copied_bytes},
+            "failed": self.failed,
+            "retries": self.retries,
+            # Over the most recent copies (bytes/s)
+            "throughput": recent_bytes / recent_seconds if recent_seconds else None,
+        }
+
+
+copy_metrics = CopyMetrics()
+
+
+async def get_copy_metrics(web, request):
+    return web.json(copy_metrics.as_dict())
+
+
+def add_copy_metrics_page(app) -> None:
+    app.page("/ncemhub/metrics/")(get_copy_metrics)
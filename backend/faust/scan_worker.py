@@ -1,20 +1,25 @@
+import asyncio
 import logging
 import re
+import time
+from collections import defaultdict
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Set
 
 import aiohttp
 
 import faust
+from api_client import add_metrics_page, get_session
 from config import settings
 from constants import (FILE_EVENT_TYPE_CREATED, FILE_EVENT_TYPE_DELETED,
                        LOG_PREFIX, PRIMARY_LOG_FILE_REGEX,
-                       TOPIC_LOG_FILE_EVENTS, TOPIC_LOG_FILE_SYNC_EVENTS)
-from schemas import Location, ScanCreate, ScanUpdate
+                       SYNC_SNAPSHOT_TIMEOUT, TOPIC_LOG_FILE_EVENTS,
+                       TOPIC_LOG_FILE_SYNC_EVENTS)
+from schemas import Location, ScanCreate, ScanUpdate, ScanUpsert
 from utils import (create_scan, delete_locations, extract_scan_id, get_scans,
-                   update_scan)
+                   update_scan, upsert_scans)
 
 # Setup logger
 logger = logging.getLogger("scan_worker")
@@ -24,6 +29,8 @@ app = faust.App(
     "distiller-scan", store="rocksdb://", broker=settings.KAFKA_URL, topic_partitions=1
 )
 
+add_metrics_page(app)
+
 
 class FileSystemEvent(faust.Record):
     event_type: str
@@ -55,6 +62,9 @@ class File(faust.Record):
 
 class SyncEvent(faust.Record):
     files: List[File]
+    id: Optional[str] = None
+    chunk: int = 0
+    last: bool = True
 
 
 sync_events_topic = app.topic(TOPIC_LOG_FILE_SYNC_EVENTS, value_type=SyncEvent)
@@ -72,6 +82,64 @@ log_files = app.Table("log_files", default=LogFileState)
 scan_id_to_id = app.Table("scan_id_to_id", default=int)
 # scan id to list of processed log files paths
 scan_id_to_log_files = app.Table("scan_id_to_log_files", default=list)
+# scan id to the paths of all the log files in log_files, a secondary index so
+# we don't have to scan the whole of log_files to find the files for a scan.
+scan_id_to_paths = app.Table("scan_id_to_paths", default=list)
+
+
+def set_log_file_state(path: str, state: LogFileState) -> None:
+    if path not in log_files:
+        scan_id = extract_scan_id(path)
+        paths = set(scan_id_to_paths[scan_id])
+        paths.add(path)
+        scan_id_to_paths[scan_id] = paths
+
+    log_files[path] = state
+
+
+def delete_log_file_state(path: str) -> None:
+    if path not in log_files:
+        return
+
+    del log_files[path]
+
+    scan_id = extract_scan_id(path)
+    paths = set(scan_id_to_paths[scan_id])
+    paths.discard(path)
+    if paths:
+        scan_id_to_paths[scan_id] = paths
+    elif scan_id in scan_id_to_paths:
+        del scan_id_to_paths[scan_id]
+
+
+_scan_id_index_checked = False
+
+
+def ensure_scan_id_index() -> None:
+    global _scan_id_index_checked
+
+    if _scan_id_index_checked:
+        return
+    _scan_id_index_checked = True
+
+    # The index has already been populated
+    if next(iter(scan_id_to_paths.keys()), None) is not None:
+        return
+
+    # Build the index from the existing log file state ( upgrading from a version
+    # without the index ).
+    index = defaultdict(set)
+    for path in log_files.keys():
+        try:
+            index[extract_scan_id(path)].add(path)
+        except ValueError:
+            continue
+
+    for scan_id, paths in index.items():
+        scan_id_to_paths[scan_id] = paths
+
+    if index:
+        logger.info(f"Built scan id index for {len(index)} scans.")
 
 
 def scan_complete(scan_log_files: List[str]):
@@ -84,7 +152,7 @@ async def process_delete_event(session: aiohttp.ClientSession, path: str) -> Non
     host = None
     if path in log_files:
         host = log_files[path].host
-        del log_files[path]
+        delete_log_file_state(path)
 
     scan_log_files = scan_id_to_log_files[scan_id]
     # We are already done
@@ -101,28 +169,178 @@ async def process_delete_event(session: aiohttp.ClientSession, path: str) -> Non
         del scan_id_to_id[scan_id]
         del scan_id_to_log_files[scan_id]
         logger.info(f"Scan {scan_id} removed.")
+        if scan_updates is not None:
+            scan_updates.discard(id)
         if host is not None:
             logger.info(f"Delete all '{host}' locations for scan {id}")
             await delete_locations(session, id, host)
 
 
-async def process_log_file(
-    session: aiohttp.ClientSession, event: FileSystemEvent
-) -> None:
-    path = event.src_path
-    scan_id = extract_scan_id(path)
+# Coalesces the updates for a scan that arrive within a window into a single
+# request with the latest log file count and all the new locations.
+# Connection errors, timeouts and server errors may succeed if tried again
+def _is_transient(ex: Exception) -> bool:
+    if isinstance(ex, aiohttp.client_exceptions.ClientResponseError):
+        return ex.status >= 500
+
+    return isinstance(
+        ex, (aiohttp.client_exceptions.ClientConnectionError, asyncio.TimeoutError)
+    )
+
+
+class ScanUpdateBuffer:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        window: float,
+        max_attempts: int = 5,
+        retry_wait: float = 1.0,
+    ):
+        self._session = session
+        self._window = window
+        self._max_attempts = max_attempts
+        self._retry_wait = retry_wait
+        self._updates: Dict[int, ScanUpdate] = {}
+        # The number of failed attempts to send the pending update for a scan
+        self._attempts: Dict[int, int] = {}
+        self._handles: Dict[int, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def add(self, update: ScanUpdate, delay: float = None) -> None:
+        pending = self._updates.get(update.id)
+        if pending is not None:
+            locations = {(l.host, l.path): l for l in pending.locations or []}
+            locations.update({(l.host, l.path): l for l in update.locations or []})
+            update = ScanUpdate(
+                id=update.id,
+                log_files=max(pending.log_files or 0, update.log_files or 0),
+                locations=list(locations.values()),
+            )
+
+        self._updates[update.id] = update
+
+        # A retry replaces the window of any newer update, so it is backed off
+        if delay is not None:
+            handle = self._handles.pop(update.id, None)
+            if handle is not None:
+                handle.cancel()
+
+        if update.id not in self._handles:
+            loop = asyncio.get_event_loop()
+            self._handles[update.id] = loop.call_later(
+                self._window if delay is None else delay, self._flush_later, update.id
+            )
+
+    def discard(self, id: int) -> None:
+        handle = self._handles.pop(id, None)
+        if handle is not None:
+            handle.cancel()
+        self._updates.pop(id, None)
+        self._attempts.pop(id, None)
+
+    async def flush(self, id: int) -> None:
+        handle = self._handles.pop(id, None)
+        if handle is not None:
+            handle.cancel()
+
+        update = self._updates.pop(id, None)
+        if update is None:
+            return
+
+        try:
+            await update_scan(self._session, update)
+        except Exception as ex:
+            attempts = self._attempts.pop(id, 0) + 1
+            if not _is_transient(ex) or attempts >= self._max_attempts:
+                logger.error(
+                    f"Dropping update for scan {id} after {attempts} attempt(s)."
+                )
+                raise
+
+            # The log files are already marked as processed, so the update
+            # won't be sent again when the events are replayed. Try again,
+            # backing off, along with any newer update.
+            logger.warning(f"Unable to update scan {id}, will retry: {ex!r}")
+            self._attempts[id] = attempts
+            self.add(update, delay=self._retry_wait * 2 ** (attempts - 1))
+
+            return
+
+        self._attempts.pop(id, None)
+
+    def _flush_later(self, id: int) -> None:
+        async def _flush():
+            try:
+                await self.flush(id)
+            except Exception:
+                logger.exception(f"Exception updating scan {id}")
+
+        task = asyncio.create_task(_flush())
+        task.add_done_callback(self._tasks.discard)
+        self._tasks.add(task)
 
+    async def close(self) -> None:
+        for id in list(self._updates.keys()):
+            self._flush_later(id)
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        # Anything that failed can't be retried once the session is closed
+        for handle in self._handles.values():
+            handle.cancel()
+        self._handles.clear()
+
+        if self._updates:
+            logger.error(f"Unable to update scans: {list(self._updates.keys())}")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        # Send anything pending before the session is closed
+        await self.close()
+
+
+# The pending scan updates, set while watch_for_logs is running
+scan_updates: Optional[ScanUpdateBuffer] = None
+
+
+def add_scan_log_files(scan_id: int, events: List[FileSystemEvent]) -> None:
     # Update list of log file for the scan
-    scan_log_files = scan_id_to_log_files[scan_id]
-    scan_log_files.append(path)
-    scan_log_files = set(scan_log_files)
+    scan_log_files = set(scan_id_to_log_files[scan_id])
+    scan_log_files.update(e.src_path for e in events)
     scan_id_to_log_files[scan_id] = scan_log_files
 
-    primary_log_file = re.match(PRIMARY_LOG_FILE_REGEX, path)
+
+def find_primary_log_file_event(
+    events: List[FileSystemEvent],
+) -> Optional[FileSystemEvent]:
+    for event in events:
+        if re.match(PRIMARY_LOG_FILE_REGEX, event.src_path):
+            return event
+
+    return None
+
+
+def scan_locations(scan_id: int, host: str) -> List[Location]:
+    paths = set()
+    for log_file in scan_id_to_log_files[scan_id]:
+        paths.add(str(Path(log_file).parent))
+
+    return [Location(host=host, path=p) for p in paths]
+
+
+async def process_log_files(
+    session: aiohttp.ClientSession, scan_id: int, events: List[FileSystemEvent]
+) -> None:
+    add_scan_log_files(scan_id, events)
+    primary_log_file_event = find_primary_log_file_event(events)
 
     # If this is the primary log file for the scan ( the one we use the timestamp from )
     # then check if we have a scan and create one if necessary
-    if primary_log_file:
+    if primary_log_file_event is not None:
+        event = primary_log_file_event
         # First check if we already have a scan
         scans = await get_scans(session, scan_id=scan_id, created=event.created)
         if len(scans) > 1:
@@ -130,11 +348,7 @@ async def process_log_file(
 
         if len(scans) == 0:
             # We need get all paths
-            paths = set()
-            for log_file in scan_id_to_log_files[scan_id]:
-                paths.add(str(Path(log_file).parent))
-
-            locations = [Location(host=event.host, path=p) for p in paths]
+            locations = scan_locations(scan_id, event.host)
             scan = await create_scan(
                 session,
                 ScanCreate(
@@ -145,28 +359,38 @@ async def process_log_file(
                 ),
             )
             scan_id_to_id[scan_id] = scan.id
-
-            # Faust version
-            locations = [Location(host=event.host, path=str(Path(path).parent))]
         else:
             scan = scans[0]
             scan_id_to_id[scan_id] = scan.id
 
     if scan_id in scan_id_to_id:
-        locations = [Location(host=event.host, path=str(Path(path).parent))]
-        await update_scan(
-            session,
-            ScanUpdate(
-                id=scan_id_to_id[scan_id],
-                log_files=len(scan_id_to_log_files[scan_id]),
-                locations=locations,
-            ),
+        # A single update for all the log files
+        locations = {(e.host, str(Path(e.src_path).parent)) for e in events}
+        update = ScanUpdate(
+            id=scan_id_to_id[scan_id],
+            log_files=len(scan_id_to_log_files[scan_id]),
+            locations=[Location(host=h, path=p) for (h, p) in locations],
         )
 
+        if scan_updates is None:
+            await update_scan(session, update)
+        else:
+            scan_updates.add(update)
+            # Don't keep the UI waiting for the last update
+            if scan_complete(scan_id_to_log_files[scan_id]):
+                await scan_updates.flush(update.id)
+
     if scan_complete(scan_id_to_log_files[scan_id]):
         logger.info(f"Transfer complete for scan {scan_id}")
 
 
+async def process_log_file(
+    session: aiohttp.ClientSession, event: FileSystemEvent
+) -> None:
+    scan_id = extract_scan_id(event.src_path)
+    await process_log_files(session, scan_id, [event])
+
+
 def is_override(event: FileSystemEvent, state: LogFileState) -> bool:
     return state.created is not None and state.created != event.created
 
@@ -175,15 +399,26 @@ async def process_override(event: FileSystemEvent) -> None:
     scan_id = extract_scan_id(event.src_path)
     del scan_id_to_id[scan_id]
     del scan_id_to_log_files[scan_id]
-    for p in log_files.keys():
-        if scan_id == extract_scan_id(p):
+    for p in scan_id_to_paths[scan_id]:
+        if p in log_files:
             del log_files[p]
+    if scan_id in scan_id_to_paths:
+        del scan_id_to_paths[scan_id]
 
 
 @app.agent(file_events_topic)
 async def watch_for_logs(file_events):
-    async with aiohttp.ClientSession() as session:
+    global scan_updates
+
+    session = get_session()
+    async with ScanUpdateBuffer(
+        session,
+        settings.SCAN_UPDATE_WINDOW,
+        settings.SCAN_UPDATE_MAX_ATTEMPTS,
+        settings.SCAN_UPDATE_RETRY_WAIT,
+    ) as scan_updates:
         async for event in file_events:
+            ensure_scan_id_index()
             path = event.src_path
             event_type = event.event_type
 
@@ -218,63 +453,161 @@ async def watch_for_logs(file_events):
             # First set processed to True, otherwise another event for this
             # file could trigger double processing ...
             state.processed = True
-            log_files[path] = state
+            set_log_file_state(path, state)
             try:
                 await process_log_file(session, event)
             except:
                 # Reset the processed state
                 state.processed = False
-                log_files[path] = state
+                set_log_file_state(path, state)
                 raise
 
             # Ensure changelog is updated
-            log_files[path] = state
+            set_log_file_state(path, state)
 
 
-async def process_sync_event(session: aiohttp.ClientSession, event: SyncEvent) -> None:
-    # Handle deleted log files
-    log_file_paths = [f.path for f in event.files]
-    for f in log_files.keys():
-        if f not in log_file_paths:
-            await process_delete_event(session, f)
+class SyncSnapshot:
+    def __init__(self):
+        self.paths: Set[str] = set()
+        self.chunks: Set[int] = set()
+        self.last_chunk: Optional[int] = None
+        self.updated = time.monotonic()
+
+    def complete(self) -> bool:
+        return self.last_chunk is not None and self.chunks == set(
+            range(self.last_chunk + 1)
+        )
+
+
+# sync id to the snapshot being received. This is only kept in memory, if we
+# restart part way through a snapshot it will be incomplete and so no files will
+# be removed, which is the safe thing to do.
+sync_snapshots: Dict[str, SyncSnapshot] = {}
+
+
+def expire_sync_snapshots() -> None:
+    now = time.monotonic()
+    for id, snapshot in list(sync_snapshots.items()):
+        if now - snapshot.updated > SYNC_SNAPSHOT_TIMEOUT:
+            logger.warning(f"Discarding incomplete sync snapshot {id}")
+            del sync_snapshots[id]
+
+
+def mark_processed(events: List[FileSystemEvent]) -> None:
+    for e in events:
+        state = log_files[e.src_path]
+        state.created = e.created
+        state.host = e.host
+        state.processed = True
 
-    for f in event.files:
+        # Ensure changelog is updated
+        set_log_file_state(e.src_path, state)
+
+
+async def process_sync_files(session: aiohttp.ClientSession, files: List[File]) -> None:
+    # Log files to process grouped by scan
+    scan_events: Dict[int, List[FileSystemEvent]] = defaultdict(list)
+    overridden = set()
+
+    for f in files:
         path = f.path
-        state = log_files[f.path]
 
         # Only process log files
         if not Path(path).name.startswith(LOG_PREFIX):
             continue
 
+        state = log_files[path]
+
         # Skip over anything that has already been proccessed
         if state.processed and state.created == f.created:
             continue
 
         file_event = FileSystemEvent(
-            src_path=f.path,
+            src_path=path,
             created=f.created,
             event_type=FILE_EVENT_TYPE_CREATED,
             is_directory=False,
             host=f.host,
         )
+        scan_id = extract_scan_id(path)
+
         # We are seeing a scan being overridden
-        if is_override(file_event, state):
+        if scan_id not in overridden and is_override(file_event, state):
             await process_override(file_event)
+            overridden.add(scan_id)
+
+        scan_events[scan_id].append(file_event)
+
+    # Scans we have the primary log file for can be created or updated in a
+    # single bulk request, the rest are processed as normal.
+    upserts = {}
+    for scan_id, events in scan_events.items():
+        primary_log_file_event = find_primary_log_file_event(events)
+        if primary_log_file_event is None:
+            await process_log_files(session, scan_id, events)
+            mark_processed(events)
+            continue
 
-        await process_log_file(session, file_event)
+        add_scan_log_files(scan_id, events)
+        upserts[scan_id] = ScanUpsert(
+            scan_id=scan_id,
+            created=primary_log_file_event.created,
+            log_files=len(scan_id_to_log_files[scan_id]),
+            locations=scan_locations(scan_id, primary_log_file_event.host),
+        )
 
-        state.created = f.created
-        state.host = f.host
-        state.received_created_event = True
-        state.received_closed_event = True
-        state.processed = True
+    if not upserts:
+        return
 
-        # Ensure changelog is updated
-        log_files[path] = state
+    scans = await upsert_scans(session, list(upserts.values()))
+    for scan in scans:
+        scan_id_to_id[scan.scan_id] = scan.id
+        if scan_complete(scan_id_to_log_files[scan.scan_id]):
+            logger.info(f"Transfer complete for scan {scan.scan_id}")
+
+    for scan_id in upserts.keys():
+        mark_processed(scan_events[scan_id])
+
+
+async def process_sync_event(session: aiohttp.ClientSession, event: SyncEvent) -> None:
+    expire_sync_snapshots()
+
+    # Unchunked snapshots from older watchers have no id
+    id = event.id if event.id is not None else ""
+    snapshot = sync_snapshots.get(id)
+    if snapshot is None or event.chunk == 0:
+        snapshot = SyncSnapshot()
+        sync_snapshots[id] = snapshot
+
+    snapshot.paths.update(f.path for f in event.files)
+    snapshot.chunks.add(event.chunk)
+    snapshot.updated = time.monotonic()
+    if event.last:
+        snapshot.last_chunk = event.chunk
+
+    await process_sync_files(session, event.files)
+
+    if not event.last:
+        return
+
+    del sync_snapshots[id]
+
+    # Only handle deleted log files if we have seen every chunk of the snapshot,
+    # a missing chunk doesn't mean the files in it have gone.
+    if not snapshot.complete():
+        logger.warning(
+            f"Sync snapshot {id} is incomplete, skipping removal of deleted files."
+        )
+        return
+
+    deleted = [f for f in log_files.keys() if f not in snapshot.paths]
+    for f in deleted:
+        await process_delete_event(session, f)
 
 
 @app.agent(sync_events_topic)
 async def watch_for_sync_event(sync_events):
-    async with aiohttp.ClientSession() as session:
-        async for event in sync_events:
-            await process_sync_event(session, event)
+    session = get_session()
+    async for event in sync_events:
+        ensure_scan_id_index()
+        await process_sync_event(session, event)
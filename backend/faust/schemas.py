@@ -24,6 +24,13 @@ class ScanCreate(BaseModel):
     locations: List[Location]
 
 
+class ScanUpsert(BaseModel):
+    scan_id: int
+    created: datetime
+    log_files: Optional[int]
+    locations: List[Location] = []
+
+
 class ScanUpdate(BaseModel):
     id: int
     log_files: Optional[int]
@@ -0,0 +1,21 @@
+# Compile the job script templates to python modules, so the job worker doesn't
+# have to compile them at runtime. The templates must be compiled for async
+# rendering to match the worker's environment.
+#
+# Usage: python scripts/compile_templates.py <output dir>
+import sys
+from pathlib import Path
+
+import jinja2
+
+
+def main():
+    template_dir = Path(__file__).parent.parent / "templates"
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(searchpath=template_dir), enable_async=True
+    )
+    env.compile_templates(sys.argv[1], zip=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+import api_client
+from schemas import JobUpdate
+
+
+@pytest_asyncio.fixture
+async def api(mocker, unused_tcp_port):
+    requests = []
+
+    async def update_job(request):
+        requests.append(await request.json())
+
+        return web.json_response({"id": int(request.match_info["id"])})
+
+    async def delete_locations(request):
+        return web.Response(status=204)
+
+    async def missing(request):
+        raise web.HTTPNotFound()
+
+    server = web.Application()
+    server.router.add_patch("/jobs/{id}", update_job)
+    server.router.add_delete("/scans/{id}/locations", delete_locations)
+    server.router.add_get("/missing", missing)
+
+    runner = web.AppRunner(server)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", unused_tcp_port)
+    await site.start()
+
+    mocker.patch.object(
+        api_client.settings, "API_URL", f"http://127.0.0.1:{unused_tcp_port}"
+    )
+    mocker.patch.object(api_client, "request_metrics", api_client.RequestMetrics())
+
+    yield requests
+
+    await runner.cleanup()
+
+
+def test_route():
+    url = api_client.aiohttp.client.URL("http://localhost/api/v1/scans/12/locations")
+
+    assert api_client.route("DELETE", url) == "DELETE /api/v1/scans/{id}/locations"
+
+
+def test_dumps():
+    update = JobUpdate(id=1, state="RUNNING", elapsed=timedelta(seconds=90))
+
+    assert api_client.orjson.loads(api_client.dumps([update])) == [
+        {"id": 1, "slurm_id": None, "state": "RUNNING", "output": None, "elapsed": 90.0}
+    ]
+    assert api_client.dumps({"created": datetime(2022, 1, 10)}) == (
+        '{"created":"2022-01-10T00:00:00"}'
+    )
+
+
+@pytest.mark.asyncio
+async def test_api_request(api):
+    session = api_client.create_session()
+    try:
+        update = JobUpdate(id=1, state="RUNNING")
+        assert await api_client.api_request(session, "PATCH", "jobs/1", update) == {
+            "id": 1
+        }
+        assert api[0]["state"] == "RUNNING"
+
+        assert (
+            await api_client.api_request(session, "DELETE", "scans/1/locations") is None
+        )
+
+        with pytest.raises(api_client.aiohttp.ClientResponseError):
+            await api_client.api_request(session, "GET", "missing")
+    finally:
+        await session.close()
+
+    metrics = api_client.request_metrics.as_dict()
+    assert metrics["PATCH /jobs/{id}"]["requests"] == 1
+    assert metrics["DELETE /scans/{id}/locations"]["errors"] == 0
+    assert metrics["GET /missing"]["errors"] == 1
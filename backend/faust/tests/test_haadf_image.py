@@ -0,0 +1,84 @@
+import matplotlib
+import numpy as np
+from matplotlib.colors import Normalize
+from PIL import Image
+
+from haadf_image import (colorize, extract_metadata, normalize,
+                         render_haadf_image)
+
+
+def test_normalize():
+    data = np.array([[-1.0, 0.0], [1.0, np.nan]])
+
+    assert normalize(data).tolist() == [[0, 128], [255, 128]]
+    assert normalize(np.ones((2, 2))).tolist() == [[0, 0], [0, 0]]
+
+
+def test_colorize_matches_matplotlib():
+    data = np.random.default_rng(0).normal(size=(64, 32)).astype(np.float32)
+
+    image = colorize(data, "viridis")
+
+    assert image.mode == "RGB"
+    assert image.size == (32, 64)
+
+    expected = matplotlib.colormaps["viridis"](Normalize()(data), bytes=True)
+    assert np.array_equal(np.asarray(image), expected[..., :3])
+
+
+def test_render_haadf_image(tmp_path, mocker):
+    data = np.arange(2000 * 1000, dtype=np.uint16).reshape((1000, 2000))
+    mocker.patch("haadf_image.read_haadf", return_value=({"data": data}, {}))
+
+    path = tmp_path / "1.png"
+    (variants, metadata) = render_haadf_image(
+        "1.dm4", str(path), "gray", {"thumbnail": 100, "medium": 500}, 80
+    )
+
+    assert variants == {
+        "medium": str(tmp_path / "1_medium.webp"),
+        "thumbnail": str(tmp_path / "1_thumbnail.webp"),
+    }
+    assert metadata["width"] == 2000
+    assert metadata["height"] == 1000
+
+    with Image.open(path) as image:
+        assert image.format == "PNG"
+        assert image.size == (2000, 1000)
+
+    with Image.open(variants["medium"]) as image:
+        assert image.format == "WEBP"
+        assert image.size == (500, 250)
+
+    with Image.open(variants["thumbnail"]) as image:
+        assert image.format == "WEBP"
+        assert image.size == (100, 50)
+
+
+def test_extract_metadata():
+    data = np.array([[1.0, 2.0], [3.0, np.nan]], dtype=np.float32)
+    haadf = {"data": data, "pixelSize": [0.2, 0.1], "pixelUnit": ["nm", "nm"]}
+    tags = {
+        "Microscope Info Voltage": 300000.0,
+        "Microscope Info Indicated Magnification": 2000000.0,
+        "DigiScan Sample Time": "bad",
+    }
+
+    metadata = extract_metadata(haadf, tags)
+
+    assert metadata == {
+        "pixel_size": 0.1,
+        "pixel_unit": "nm",
+        "width": 2,
+        "height": 2,
+        "dtype": "float32",
+        "intensity_min": 1.0,
+        "intensity_max": 3.0,
+        "intensity_mean": 2.0,
+        "intensity_std": metadata["intensity_std"],
+        "voltage": 300000.0,
+        "magnification": 2000000.0,
+        "camera_length": None,
+        "dwell_time": None,
+    }
+    assert np.isclose(metadata["intensity_std"], np.std([1.0, 2.0, 3.0]))
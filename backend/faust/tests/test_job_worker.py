@@ -1,6 +1,11 @@
+import asyncio
+from datetime import timedelta
+
 import pytest
 
 import job_worker
+from faust_records import Location
+from schemas import SfapiJob
 
 
 @pytest.mark.asyncio
@@ -17,6 +22,23 @@ async def test_cori_submission_script(
     assert cori_submission_script == expected_cori_submission_script
 
 
+@pytest.mark.asyncio
+async def test_submission_script_filters_machine_locations(
+    scan, job, cori_machine, machine_names
+):
+    scan.locations.append(Location(host="cori", path="/pscratch"))
+    locations = list(scan.locations)
+
+    submission_script = await job_worker.render_job_script(
+        scan, job, cori_machine, "/tmp", machine_names
+    )
+
+    assert "list_files localhost /mnt/nvmedata1" in submission_script
+    assert "/pscratch" not in submission_script
+    # The caller's scan is left alone
+    assert scan.locations == locations
+
+
 @pytest.mark.asyncio
 async def test_perlmutter_submission_script(
     mocker,
@@ -81,3 +103,199 @@ async def test_machine_overrides(
     perlmutter = await job_worker.get_machine(None, "perlmutter")
 
     assert perlmutter == expected_perlmutter_overridden
+
+
+def test_has_active_jobs():
+    def sfapi_job(workdir, state):
+        return SfapiJob(
+            slurm_id=1,
+            name="count",
+            workdir=workdir,
+            state=state,
+            elapsed=timedelta(seconds=0),
+        )
+
+    # Only jobs we submitted count
+    jobs = [sfapi_job("/scratch/other", "RUNNING"), sfapi_job("/jobs/1", "COMPLETED")]
+    assert not job_worker.has_active_jobs(jobs)
+
+    jobs.append(sfapi_job("/jobs/2", "PENDING"))
+    assert job_worker.has_active_jobs(jobs)
+
+
+@pytest.mark.asyncio
+async def test_process_machine_jobs_only_sends_changes(mocker):
+    def sfapi_job(workdir, state, elapsed):
+        return SfapiJob(
+            slurm_id=1,
+            name="count",
+            workdir=workdir,
+            state=state,
+            elapsed=timedelta(seconds=elapsed),
+        )
+
+    update_jobs = mocker.patch.object(
+        job_worker, "update_jobs_request", return_value=[]
+    )
+    mocker.patch.object(job_worker, "read_slurm_out", return_value="output")
+    mocker.patch.object(job_worker, "job_states", {})
+    mocker.patch.object(job_worker, "completed_jobs", {})
+
+    jobs = [sfapi_job("/jobs/1", "RUNNING", 10), sfapi_job("/jobs/2", "RUNNING", 10)]
+    await job_worker.process_machine_jobs(None, "perlmutter", jobs)
+    assert [u.id for u in update_jobs.call_args.args[1]] == [1, 2]
+
+    # Nothing has changed
+    update_jobs.reset_mock()
+    await job_worker.process_machine_jobs(None, "perlmutter", jobs)
+    update_jobs.assert_not_called()
+
+    # Only the job that changed is sent, completed jobs are only sent once
+    jobs[1] = sfapi_job("/jobs/2", "COMPLETED", 20)
+    await job_worker.process_machine_jobs(None, "perlmutter", jobs)
+    updates = update_jobs.call_args.args[1]
+    assert [(u.id, u.state, u.output) for u in updates] == [(2, "COMPLETED", "output")]
+
+    update_jobs.reset_mock()
+    await job_worker.process_machine_jobs(None, "perlmutter", jobs)
+    update_jobs.assert_not_called()
+    assert list(job_worker.job_states["perlmutter"]) == [1]
+
+    # Jobs that are no longer reported are forgotten, only for that machine
+    await job_worker.process_machine_jobs(None, "cori", [jobs[0]])
+    await job_worker.process_machine_jobs(None, "perlmutter", [])
+    assert job_worker.job_states == {"cori": {1: mocker.ANY}, "perlmutter": {}}
+
+
+@pytest.mark.asyncio
+async def test_compiled_templates(
+    mocker,
+    tmp_path,
+    scan,
+    job,
+    cori_machine,
+    expected_cori_submission_script,
+    machine_names,
+):
+    compiled_path = tmp_path / "compiled_templates"
+    job_worker.template_env.compile_templates(str(compiled_path), zip=None)
+
+    mocker.patch.object(
+        job_worker.settings, "JOB_COMPILED_TEMPLATES_PATH", str(compiled_path)
+    )
+    mocker.patch.object(job_worker, "template_env", job_worker.create_template_env())
+
+    cori_submission_script = await job_worker.render_job_script(
+        scan, job, cori_machine, "/tmp", machine_names
+    )
+
+    assert cori_submission_script == expected_cori_submission_script
+
+
+@pytest.mark.asyncio
+async def test_sfapi_task_tracker(mocker):
+    responses = {
+        "1": [{"status": "ok"}, {"status": "ok", "result": '{"jobid": "10"}'}],
+        "2": [{"status": "ok", "result": '{"jobid": "20"}'}],
+        "3": [{"status": "error", "error": "failed"}],
+    }
+    polled = []
+
+    async def sfapi_get(url):
+        task_id = url.split("/")[-1]
+        polled.append(task_id)
+        response = mocker.Mock()
+        response.json.return_value = responses[task_id].pop(0)
+
+        return response
+
+    mocker.patch.object(job_worker, "sfapi_get", sfapi_get)
+
+    tracker = job_worker.SfapiTaskTracker(0.01, 0.1)
+    results = await asyncio.gather(
+        tracker.wait("1"), tracker.wait("2"), tracker.wait("3"), return_exceptions=True
+    )
+
+    assert results[0] == {"jobid": "10"}
+    assert results[1] == {"jobid": "20"}
+    assert isinstance(results[2], job_worker.SfApiError)
+    assert sorted(polled) == ["1", "1", "2", "3"]
+
+
+@pytest.mark.asyncio
+async def test_submit_job_event_ordering(mocker, perlmutter_machine):
+    running = {"perlmutter": 0}
+    max_running = {"perlmutter": 0}
+    submitted = []
+
+    async def fetch_machines(session):
+        await asyncio.sleep(0.01)
+
+        return ["perlmutter"]
+
+    async def fetch_machine(session, name):
+        await asyncio.sleep(0.01)
+
+        return perlmutter_machine
+
+    async def process_submit_job_event(session, event):
+        # The cache is empty, so the first submissions all wait for the fetch
+        machines = await job_worker.get_machines(session)
+        assert machines[event.job.machine] == perlmutter_machine
+
+        running[event.job.machine] += 1
+        max_running[event.job.machine] = max(
+            max_running[event.job.machine], running[event.job.machine]
+        )
+        await asyncio.sleep(0.01)
+        running[event.job.machine] -= 1
+        submitted.append((event.scan.id, event.job.id))
+
+    mocker.patch.object(
+        job_worker, "process_submit_job_event", process_submit_job_event
+    )
+    fetch_machines = mocker.patch.object(
+        job_worker, "fetch_machines", side_effect=fetch_machines
+    )
+    mocker.patch.object(job_worker, "fetch_machine", side_effect=fetch_machine)
+    mocker.patch.object(job_worker, "_machines", None)
+    mocker.patch.object(job_worker, "_machines_lock", None)
+    mocker.patch.object(
+        job_worker.settings, "JOB_SUBMIT_CONCURRENCY", {"perlmutter": 2}
+    )
+    mocker.patch.object(job_worker, "_machine_submission_slots", {})
+    mocker.patch.object(job_worker, "_scan_submissions", {})
+    mocker.patch.object(
+        job_worker, "submission_metrics", job_worker.SubmissionMetrics()
+    )
+
+    def event(scan_id, job_id):
+        event = mocker.Mock()
+        event.value.scan.id = scan_id
+        event.value.job.id = job_id
+        event.value.job.machine = "perlmutter"
+
+        return event
+
+    events = [event(1, 1), event(2, 2), event(1, 3), event(3, 4), event(1, 5)]
+    tasks = []
+    for e in events:
+        previous = job_worker._scan_submissions.get(e.value.scan.id)
+        task = asyncio.create_task(job_worker.submit_job_event(None, e, previous))
+        job_worker._scan_submissions[e.value.scan.id] = task
+        tasks.append(task)
+    await asyncio.gather(*tasks)
+
+    # Jobs for the same scan are submitted in order
+    assert [job_id for (scan_id, job_id) in submitted if scan_id == 1] == [1, 3, 5]
+    assert max_running["perlmutter"] == 2
+    assert all(e.ack.called for e in events)
+    assert job_worker._scan_submissions == {}
+
+    fetch_machines.assert_called_once()
+
+    metrics = job_worker.submission_metrics.as_dict()
+    assert metrics["submitted"] == 5
+    assert metrics["failed"] == 0
+    assert metrics["queued"] == {"perlmutter": 0}
+    assert metrics["running"] == {"perlmutter": 0}
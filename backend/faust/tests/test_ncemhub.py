@@ -0,0 +1,75 @@
+import os
+
+import pytest
+import tenacity
+from aiopath import AsyncPath
+
+import haadf_worker
+import ncemhub
+from ncemhub import CopyMetrics, CopyVerificationError, copy_file
+
+
+def test_copy_file(tmp_path):
+    src = tmp_path / "scan1.dm4"
+    src.write_bytes(os.urandom(10000))
+    dest = tmp_path / "copy.dm4"
+
+    assert copy_file(str(src), str(dest), 1024) == 10000
+    assert dest.read_bytes() == src.read_bytes()
+    assert not (tmp_path / "copy.dm4.part").exists()
+
+
+def test_copy_file_checksum_mismatch(tmp_path, mocker):
+    src = tmp_path / "scan1.dm4"
+    src.write_bytes(os.urandom(10000))
+    dest = tmp_path / "copy.dm4"
+    mocker.patch.object(ncemhub, "_checksum", return_value=(10000, b"0" * 32))
+
+    with pytest.raises(CopyVerificationError):
+        copy_file(str(src), str(dest), 1024)
+
+    assert sorted(os.listdir(tmp_path)) == ["scan1.dm4"]
+
+
+def test_copy_metrics():
+    metrics = CopyMetrics()
+
+    start = metrics.start(100)
+    metrics.start(50)
+    assert metrics.as_dict()["backlog"] == {"files": 2, "bytes": 150}
+
+    metrics.finish(100, start)
+    metrics.finish(50, start, error=True)
+
+    as_dict = metrics.as_dict()
+    assert as_dict["backlog"] == {"files": 0, "bytes": 0}
+    assert as_dict["copied"] == {"files": 1, "bytes": 100}
+    assert as_dict["failed"] == 1
+    assert as_dict["throughput"] > 0
+
+
+@pytest.mark.asyncio
+async def test_copy_to_ncemhub_retries(tmp_path, mocker):
+    src = tmp_path / "scan1.dm4"
+    src.write_bytes(os.urandom(1000))
+    mocker.patch.object(
+        haadf_worker.settings, "HAADF_NCEMHUB_DM4_DATA_PATH", str(tmp_path / "hub")
+    )
+    mocker.patch.object(haadf_worker._copy_file.retry, "wait", tenacity.wait_none())
+    metrics = CopyMetrics()
+    mocker.patch.object(haadf_worker, "copy_metrics", metrics)
+    mocker.patch.object(
+        haadf_worker, "copy_file", side_effect=[CopyVerificationError(), 1000]
+    )
+
+    assert await haadf_worker.copy_to_ncemhub(AsyncPath(src))
+    assert metrics.copied == 1
+    assert metrics.retries == 1
+    assert (tmp_path / "hub").is_dir()
+
+    # Give up once out of attempts
+    haadf_worker.copy_file.side_effect = CopyVerificationError()
+
+    assert not await haadf_worker.copy_to_ncemhub(AsyncPath(src))
+    assert metrics.failed == 1
+    assert metrics.retries == haadf_worker.settings.HAADF_NCEMHUB_COPY_ATTEMPTS
@@ -0,0 +1,112 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+import scan_worker
+from scan_worker import ScanUpdateBuffer, SyncSnapshot
+from schemas import Location, ScanUpdate
+
+
+def test_sync_snapshot_complete():
+    snapshot = SyncSnapshot()
+    snapshot.chunks.update([0, 1])
+    assert not snapshot.complete()
+
+    snapshot.chunks.add(2)
+    snapshot.last_chunk = 2
+    assert snapshot.complete()
+
+
+def test_sync_snapshot_missing_chunk():
+    snapshot = SyncSnapshot()
+    snapshot.chunks.update([0, 2])
+    snapshot.last_chunk = 2
+
+    assert not snapshot.complete()
+
+
+@pytest.mark.asyncio
+async def test_scan_update_buffer_coalesces(mocker):
+    update_scan = mocker.patch.object(scan_worker, "update_scan")
+
+    buffer = ScanUpdateBuffer(None, 60)
+    buffer.add(
+        ScanUpdate(id=1, log_files=1, locations=[Location(host="a", path="/one")])
+    )
+    buffer.add(
+        ScanUpdate(id=1, log_files=2, locations=[Location(host="a", path="/two")])
+    )
+    await buffer.flush(1)
+
+    update_scan.assert_called_once()
+    (_, update) = update_scan.call_args.args
+    assert update.log_files == 2
+    assert {l.path for l in update.locations} == {"/one", "/two"}
+
+
+def response_error(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+
+@pytest.mark.asyncio
+async def test_scan_update_buffer_requeues_failed_update(mocker):
+    update_scan = mocker.patch.object(
+        scan_worker, "update_scan", side_effect=[response_error(503), None]
+    )
+
+    buffer = ScanUpdateBuffer(None, 60, retry_wait=30)
+    buffer.add(
+        ScanUpdate(id=1, log_files=1, locations=[Location(host="a", path="/one")])
+    )
+    await buffer.flush(1)
+
+    # Retried after backing off, along with the next update for the scan
+    loop = asyncio.get_event_loop()
+    assert buffer._handles[1].when() - loop.time() == pytest.approx(30, abs=1)
+    buffer.add(
+        ScanUpdate(id=1, log_files=2, locations=[Location(host="a", path="/two")])
+    )
+    await buffer.flush(1)
+
+    assert update_scan.call_count == 2
+    (_, update) = update_scan.call_args.args
+    assert update.log_files == 2
+    assert {l.path for l in update.locations} == {"/one", "/two"}
+    assert buffer._attempts == {}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", [400, 401, 404, 422])
+async def test_scan_update_buffer_drops_client_errors(mocker, status):
+    update_scan = mocker.patch.object(
+        scan_worker, "update_scan", side_effect=response_error(status)
+    )
+
+    buffer = ScanUpdateBuffer(None, 60)
+    buffer.add(ScanUpdate(id=1, log_files=1))
+    with pytest.raises(aiohttp.ClientResponseError):
+        await buffer.flush(1)
+
+    update_scan.assert_called_once()
+    assert buffer._updates == {}
+    assert buffer._handles == {}
+
+
+@pytest.mark.asyncio
+async def test_scan_update_buffer_gives_up(mocker):
+    update_scan = mocker.patch.object(
+        scan_worker, "update_scan", side_effect=asyncio.TimeoutError()
+    )
+
+    buffer = ScanUpdateBuffer(None, 60, max_attempts=3)
+    buffer.add(ScanUpdate(id=1, log_files=1))
+    await buffer.flush(1)
+    await buffer.flush(1)
+    with pytest.raises(asyncio.TimeoutError):
+        await buffer.flush(1)
+
+    assert update_scan.call_count == 3
+    assert buffer._updates == {}
+    assert buffer._handles == {}
+    assert buffer._attempts == {}
@@ -5,9 +5,9 @@ from typing import List, Union
 
 import aiohttp
 import tenacity
-
-from config import settings
-from schemas import Job, JobUpdate, Machine, Scan, ScanCreate, ScanUpdate
+from api_client import api_request
+from schemas import (Job, JobUpdate, Machine, Scan, ScanCreate, ScanUpdate,
+                     ScanUpsert)
 
 pattern = re.compile(r"^log_scan([0-9]*)_.*\.data")
 
@@ -30,18 +30,24 @@ def extract_scan_id(path: str) -> int:
     stop=tenacity.stop_after_attempt(10),
 )
 async def create_scan(session: aiohttp.ClientSession, event: ScanCreate) -> Scan:
-    headers = {
-        settings.API_KEY_NAME: settings.API_KEY,
-        "Content-Type": "application/json",
-    }
+    json = await api_request(session, "POST", "scans", event)
+
+    return Scan(**json)
 
-    async with session.post(
-        f"{settings.API_URL}/scans", headers=headers, data=event.json()
-    ) as r:
-        r.raise_for_status()
-        json = await r.json()
 
-        return Scan(**json)
+@tenacity.retry(
+    retry=tenacity.retry_if_exception_type(
+        aiohttp.client_exceptions.ServerConnectionError
+    ),
+    wait=tenacity.wait_exponential(max=10),
+    stop=tenacity.stop_after_attempt(10),
+)
+async def upsert_scans(
+    session: aiohttp.ClientSession, scans: List[ScanUpsert]
+) -> List[Scan]:
+    json = await api_request(session, "POST", "scans/bulk", scans)
+
+    return [Scan(**x) for x in json]
 
 
 @tenacity.retry(
@@ -52,18 +58,9 @@ async def create_scan(session: aiohttp.ClientSession, event: ScanCreate) -> Scan
     stop=tenacity.stop_after_attempt(10),
 )
 async def update_scan(session: aiohttp.ClientSession, event: ScanUpdate) -> dict:
-    headers = {
-        settings.API_KEY_NAME: settings.API_KEY,
-        "Content-Type": "application/json",
-    }
-
-    async with session.patch(
-        f"{settings.API_URL}/scans/{event.id}", headers=headers, data=event.json()
-    ) as r:
-        r.raise_for_status()
-        json = await r.json()
+    json = await api_request(session, "PATCH", f"scans/{event.id}", event)
 
-        return Scan(**json)
+    return Scan(**json)
 
 
 @tenacity.retry(
@@ -79,11 +76,6 @@ async def get_scans(
     state: str = None,
     created: datetime = None,
 ) -> Union[Scan, None]:
-    headers = {
-        settings.API_KEY_NAME: settings.API_KEY,
-        "Content-Type": "application/json",
-    }
-
     params = {"scan_id": scan_id}
 
     if state is not None:
@@ -92,13 +84,9 @@ async def get_scans(
     if created is not None:
         params["created"] = created
 
-    async with session.get(
-        f"{settings.API_URL}/scans", headers=headers, params=params
-    ) as r:
-        r.raise_for_status()
-        json = await r.json()
+    json = await api_request(session, "GET", "scans", params=params)
 
-        return [Scan(**x) for x in json]
+    return [Scan(**x) for x in json]
 
 
 @tenacity.retry(
@@ -109,16 +97,9 @@ async def get_scans(
     stop=tenacity.stop_after_attempt(10),
 )
 async def get_scan(session: aiohttp.ClientSession, id: int) -> Scan:
-    headers = {
-        settings.API_KEY_NAME: settings.API_KEY,
-        "Content-Type": "application/json",
-    }
-
-    async with session.get(f"{settings.API_URL}/scans/{id}", headers=headers) as r:
-        r.raise_for_status()
-        json = await r.json()
+    json = await api_request(session, "GET", f"scans/{id}")
 
-        return Scan(**json)
+    return Scan(**json)
 
 
 @tenacity.retry(
@@ -129,18 +110,24 @@ async def get_scan(session: aiohttp.ClientSession, id: int) -> Scan:
     stop=tenacity.stop_after_attempt(10),
 )
 async def update_job(session: aiohttp.ClientSession, event: JobUpdate) -> dict:
-    headers = {
-        settings.API_KEY_NAME: settings.API_KEY,
-        "Content-Type": "application/json",
-    }
+    json = await api_request(session, "PATCH", f"jobs/{event.id}", event)
 
-    async with session.patch(
-        f"{settings.API_URL}/jobs/{event.id}", headers=headers, data=event.json()
-    ) as r:
-        r.raise_for_status()
-        json = await r.json()
+    return Job(**json)
 
-        return Job(**json)
+
+@tenacity.retry(
+    retry=tenacity.retry_if_exception_type(
+        aiohttp.client_exceptions.ServerConnectionError
+    ),
+    wait=tenacity.wait_exponential(max=10),
+    stop=tenacity.stop_after_attempt(10),
+)
+async def update_jobs(
+    session: aiohttp.ClientSession, updates: List[JobUpdate]
+) -> List[Job]:
+    json = await api_request(session, "PATCH", "jobs", updates)
+
+    return [Job(**x) for x in json]
 
 
 @tenacity.retry(
@@ -151,20 +138,11 @@ async def update_job(session: aiohttp.ClientSession, event: JobUpdate) -> dict:
     stop=tenacity.stop_after_attempt(10),
 )
 async def get_jobs(session: aiohttp.ClientSession, slurm_id: int) -> Union[Scan, None]:
-    headers = {
-        settings.API_KEY_NAME: settings.API_KEY,
-        "Content-Type": "application/json",
-    }
-
     params = {"slurm_id": slurm_id}
 
-    async with session.get(
-        f"{settings.API_URL}/jobs", headers=headers, params=params
-    ) as r:
-        r.raise_for_status()
-        json = await r.json()
+    json = await api_request(session, "GET", "jobs", params=params)
 
-        return [Job(**x) for x in json]
+    return [Job(**x) for x in json]
 
 
 @tenacity.retry(
@@ -175,16 +153,9 @@ async def get_jobs(session: aiohttp.ClientSession, slurm_id: int) -> Union[Scan,
     stop=tenacity.stop_after_attempt(10),
 )
 async def get_job(session: aiohttp.ClientSession, id: int) -> Union[Scan, None]:
-    headers = {
-        settings.API_KEY_NAME: settings.API_KEY,
-        "Content-Type": "application/json",
-    }
-
-    async with session.get(f"{settings.API_URL}/jobs/{id}", headers=headers) as r:
-        r.raise_for_status()
-        json = await r.json()
+    json = await api_request(session, "GET", f"jobs/{id}")
 
-        return Job(**json)
+    return Job(**json)
 
 
 @tenacity.retry(
@@ -195,18 +166,10 @@ async def get_job(session: aiohttp.ClientSession, id: int) -> Union[Scan, None]:
     stop=tenacity.stop_after_attempt(10),
 )
 async def delete_locations(session: aiohttp.ClientSession, id: int, host: str) -> None:
-    headers = {
-        settings.API_KEY_NAME: settings.API_KEY,
-        "Content-Type": "application/json",
-    }
-
     params = {"host": host}
 
     try:
-        async with session.delete(
-            f"{settings.API_URL}/scans/{id}/locations", headers=headers, params=params
-        ) as r:
-            r.raise_for_status()
+        await api_request(session, "DELETE", f"scans/{id}/locations", params=params)
     except aiohttp.client_exceptions.ClientResponseError as ex:
         # Ignore 404, the scan may have been deleted
         if ex.status != 404:
@@ -221,17 +184,10 @@ async def delete_locations(session: aiohttp.ClientSession, id: int, host: str) -
     stop=tenacity.stop_after_attempt(10),
 )
 async def get_machines(session: aiohttp.ClientSession) -> List[str]:
-    headers = {
-        settings.API_KEY_NAME: settings.API_KEY,
-        "Content-Type": "application/json",
-    }
-
-    async with session.get(f"{settings.API_URL}/machines", headers=headers) as r:
-        r.raise_for_status()
-        json = await r.json()
+    json = await api_request(session, "GET", "machines")
 
-        # We only want the names
-        return [m["name"] for m in json]
+    # We only want the names
+    return [m["name"] for m in json]
 
 
 @tenacity.retry(
@@ -242,13 +198,6 @@ async def get_machines(session: aiohttp.ClientSession) -> List[str]:
     stop=tenacity.stop_after_attempt(10),
 )
 async def get_machine(session: aiohttp.ClientSession, name: str) -> Machine:
-    headers = {
-        settings.API_KEY_NAME: settings.API_KEY,
-        "Content-Type": "application/json",
-    }
-
-    async with session.get(f"{settings.API_URL}/machines/{name}", headers=headers) as r:
-        r.raise_for_status()
-        json = await r.json()
+    json = await api_request(session, "GET", f"machines/{name}")
 
-        return Machine(**json)
+    return Machine(**json)
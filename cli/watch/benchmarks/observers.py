@@ -0,0 +1,109 @@
+# Compare event latency and CPU use of the watcher observer backends for
+# directories containing a large number of files.
+#
+# Usage: python benchmarks/observers.py --files 10000 100000 1000000
+import argparse
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "distiller"))
+
+from constants import OBSERVER_INOTIFY, OBSERVER_POLLING  # noqa: E402
+from observers import create_observer  # noqa: E402
+from watchdog.events import FileSystemEventHandler  # noqa: E402
+
+
+class LatencyHandler(FileSystemEventHandler):
+    def __init__(self):
+        self.expected = None
+        self.received = threading.Event()
+
+    def on_created(self, event):
+        if event.src_path == self.expected:
+            self.received.set()
+
+
+def populate(dir: Path, count: int) -> None:
+    for i in range(count):
+        (dir / f"log_scan{i}_module0to1_dst0.data").touch()
+
+
+def run(backend: str, dir: Path, args: argparse.Namespace) -> dict:
+    handler = LatencyHandler()
+
+    start = time.perf_counter()
+    observer = create_observer(backend, args.polling_interval)
+    observer.start()
+    observer.schedule(handler, str(dir))
+    setup = time.perf_counter() - start
+
+    # CPU used by the observer threads while nothing is changing
+    cpu_start = time.process_time()
+    time.sleep(args.idle)
+    idle_cpu = (time.process_time() - cpu_start) / args.idle
+
+    latencies = []
+    for i in range(args.events):
+        path = dir / f"bench_{backend}_{i}.data"
+        handler.expected = str(path)
+        handler.received.clear()
+        start = time.perf_counter()
+        path.touch()
+        if not handler.received.wait(args.timeout):
+            latencies.append(float("inf"))
+            continue
+        latencies.append(time.perf_counter() - start)
+
+    observer.stop()
+    observer.join()
+
+    latencies.sort()
+
+    return {
+        "setup": setup,
+        "idle_cpu": idle_cpu,
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the watcher observer backends."
+    )
+    parser.add_argument(
+        "--files", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument(
+        "--backends", nargs="+", default=[OBSERVER_POLLING, OBSERVER_INOTIFY]
+    )
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--idle", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--polling-interval", type=float, default=1.0)
+    parser.add_argument("--dir", help="Parent directory for the test directories")
+    args = parser.parse_args()
+
+    print(
+        f"{'files':>10} {'backend':>10} {'setup (s)':>10} {'idle cpu':>10} "
+        f"{'p50 (ms)':>10} {'p99 (ms)':>10}"
+    )
+    for count in args.files:
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            dir = Path(tmp)
+            populate(dir, count)
+            for backend in args.backends:
+                r = run(backend, dir, args)
+                print(
+                    f"{count:>10} {backend:>10} {r['setup']:>10.2f} "
+                    f"{r['idle_cpu']:>9.1%} {r['p50'] * 1000:>10.1f} "
+                    f"{r['p99'] * 1000:>10.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# The state of a log file when the checkpoint was taken ( ctime, size )
+FileState = Tuple[float, int]
+
+CHECKPOINT_VERSION = 1
+
+
+def load_checkpoint(path: str, host: str) -> Optional[Dict[str, FileState]]:
+    checkpoint_path = Path(path)
+    if not checkpoint_path.exists():
+        return None
+
+    try:
+        with checkpoint_path.open("r") as fp:
+            checkpoint = json.load(fp)
+    except ValueError:
+        # Corrupted checkpoint, the caller will fallback to a full sync
+        return None
+
+    # A checkpoint for another host or format is of no use to us
+    if checkpoint.get("version") != CHECKPOINT_VERSION or checkpoint.get("host") != host:
+        return None
+
+    return {p: tuple(state) for p, state in checkpoint["files"].items()}
+
+
+def save_checkpoint(path: str, host: str, files: Dict[str, FileState]) -> None:
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "host": host,
+        "files": files,
+    }
+
+    # Write to a temporary file and then move it into place so we never leave
+    # a partially written checkpoint behind.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(checkpoint, fp)
+    os.replace(tmp_path, path)
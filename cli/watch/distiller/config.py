@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 
 from pydantic import AnyHttpUrl, BaseSettings
 
@@ -11,6 +11,25 @@ class Settings(BaseSettings):
     HOST: str = None
     LOG_FILE_PATH: str = None
     SYNC: bool = True
+    # Max number of files sent in a single sync message
+    SYNC_CHUNK_SIZE: int = 1000
+    # Where to store the state of the log files at the last sync. If set only the
+    # changes since the last sync are sent on startup. Remove the file to force
+    # a full sync.
+    SYNC_CHECKPOINT_PATH: str = None
+    # The observer backend to use, one of "polling", "inotify" or "native"
+    OBSERVER: str = "polling"
+    # Per watch directory overrides of OBSERVER, for example
+    # {"/mnt/nvmedata1": "inotify"}
+    WATCH_DIRECTORY_OBSERVERS: Dict[str, str] = {}
+    # Interval between polls for the polling observer (seconds)
+    POLLING_INTERVAL: float = 1.0
+    # Accumulate file events and post them to the API in batches
+    BATCH_FILE_EVENTS: bool = False
+    # Max number of events in a batch
+    BATCH_MAX_EVENTS: int = 500
+    # Max time to hold an event before the batch is flushed (seconds)
+    BATCH_MAX_WAIT: float = 1.0
 
     class Config:
         case_sensitive = True
@@ -1 +1,9 @@
 LOG_FILE_GLOB = "log_scan*.data"
+
+# The size of the reads used to calculate the checksum of uploads (bytes)
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+OBSERVER_POLLING = "polling"
+OBSERVER_INOTIFY = "inotify"
+# Let watchdog pick the best native backend for the platform
+OBSERVER_NATIVE = "native"
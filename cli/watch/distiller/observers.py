@@ -0,0 +1,86 @@
+import logging
+from typing import Dict, List, Type
+
+from constants import OBSERVER_INOTIFY, OBSERVER_NATIVE, OBSERVER_POLLING
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer as NativeObserver
+from watchdog.observers.api import BaseObserver
+from watchdog.observers.polling import PollingObserver
+
+logger = logging.getLogger("watch")
+
+
+def observer_class(backend: str) -> Type[BaseObserver]:
+    if backend == OBSERVER_POLLING:
+        return PollingObserver
+    elif backend == OBSERVER_INOTIFY:
+        # Only available on Linux
+        from watchdog.observers.inotify import InotifyObserver
+
+        return InotifyObserver
+    elif backend == OBSERVER_NATIVE:
+        return NativeObserver
+
+    raise ValueError(f"Invalid observer backend: '{backend}'")
+
+
+def create_observer(backend: str, polling_interval: float) -> BaseObserver:
+    cls = observer_class(backend)
+    if cls is PollingObserver:
+        return cls(timeout=polling_interval)
+
+    return cls()
+
+
+def start_observers(
+    dirs: List[str],
+    handler: FileSystemEventHandler,
+    default_backend: str,
+    overrides: Dict[str, str],
+    polling_interval: float,
+) -> Dict[str, BaseObserver]:
+    # Observers are shared between all the directories using the same backend.
+    observers: Dict[str, BaseObserver] = {}
+    # The observer watching each directory
+    dir_observers: Dict[str, BaseObserver] = {}
+
+    def _observer(backend: str) -> BaseObserver:
+        if backend not in observers:
+            observer = create_observer(backend, polling_interval)
+            # Start the observer before scheduling, so the emitters are started
+            # as they are scheduled and any errors are raised here.
+            observer.start()
+            observers[backend] = observer
+
+        return observers[backend]
+
+    for d in dirs:
+        backend = overrides.get(str(d), default_backend)
+        try:
+            _observer(backend).schedule(handler, str(d))
+        except (ImportError, OSError):
+            if backend == OBSERVER_POLLING:
+                raise
+
+            # For example the filesystem doesn't support inotify ( NFS ) or
+            # we have hit the inotify watch limit.
+            logger.exception(
+                f"Unable to use '{backend}' observer for '{d}', falling back to polling."
+            )
+            backend = OBSERVER_POLLING
+            _observer(backend).schedule(handler, str(d))
+
+        logger.info(f"Using '{backend}' observer for '{d}'")
+        dir_observers[str(d)] = observers[backend]
+
+    return dir_observers
+
+
+# Only inotify reports a file being closed after it has been written to.
+def reports_closed(observer: BaseObserver) -> bool:
+    try:
+        from watchdog.observers.inotify import InotifyObserver
+    except ImportError:
+        return False
+
+    return isinstance(observer, InotifyObserver)
@@ -1,12 +1,17 @@
 import asyncio
+import base64
+import hashlib
+import json
 import logging
+import os
 import platform
 import re
 import signal
 import sys
+import uuid
 from datetime import datetime
 from logging.handlers import RotatingFileHandler
-from typing import List
+from typing import Any, AsyncIterator, Dict, List, Set, Tuple
 
 import aiohttp
 import coloredlogs
@@ -15,14 +20,17 @@ from aiopath import AsyncPath
 from pathlib import Path
 from aiowatchdog import AIOEventHandler, AIOEventIterator
 from cachetools import TTLCache
+from checkpoint import FileState, load_checkpoint, save_checkpoint
 from config import settings
-from constants import LOG_FILE_GLOB
+from constants import CHECKSUM_CHUNK_SIZE, LOG_FILE_GLOB
+from observers import reports_closed, start_observers
+from pydantic.json import pydantic_encoder
 from schemas import File
 from schemas import FileSystemEvent as FileSystemEventModel
+from schemas import FileSystemEventType
 from schemas import SyncEvent
 from watchdog.events import (EVENT_TYPE_CLOSED, EVENT_TYPE_MODIFIED, EVENT_TYPE_CREATED,
                              EVENT_TYPE_MOVED, FileSystemEvent)
-from watchdog.observers.polling import PollingObserver as Observer
 
 
 # Setup logger
@@ -51,17 +59,138 @@ def get_host():
     return host
 
 
-async def create_sync_snapshot(watch_dirs: List[str]) -> List[File]:
-    files = []
-    host = get_host()
+async def stat_log_files(
+    watch_dirs: List[str],
+) -> AsyncIterator[Tuple[str, os.stat_result]]:
     for watch_dir in watch_dirs:
         async for f in AsyncPath(watch_dir).glob(LOG_FILE_GLOB):
             path = AsyncPath(f)
-            stat_info = await path.stat()
-            created = datetime.fromtimestamp(stat_info.st_ctime).astimezone()
-            files.append(File(path=str(f), created=created, host=host))
+            try:
+                stat_info = await path.stat()
+            except FileNotFoundError:
+                # Removed since we globbed
+                continue
+
+            yield (str(f), stat_info)
+
+
+def _file_state(stat_info: os.stat_result) -> FileState:
+    return (stat_info.st_ctime, stat_info.st_size)
+
+
+def _created(stat_info: os.stat_result) -> datetime:
+    return datetime.fromtimestamp(stat_info.st_ctime).astimezone()
+
+
+async def send_sync_snapshot(
+    session: aiohttp.ClientSession, watch_dirs: List[str]
+) -> Dict[str, FileState]:
+    host = get_host()
+    sync_id = uuid.uuid4().hex
+    chunk = 0
+    files = []
+    states = {}
+
+    # Stream the snapshot in chunks, rather than sending one huge message
+    async for path, stat_info in stat_log_files(watch_dirs):
+        states[path] = _file_state(stat_info)
+        files.append(File(path=path, created=_created(stat_info), host=host))
+
+        if len(files) >= settings.SYNC_CHUNK_SIZE:
+            await post_sync_event(
+                session, SyncEvent(id=sync_id, chunk=chunk, last=False, files=files)
+            )
+            chunk += 1
+            files = []
+
+    # Always send the last chunk, even if its empty, so the end of the snapshot
+    # is marked.
+    await post_sync_event(
+        session, SyncEvent(id=sync_id, chunk=chunk, last=True, files=files)
+    )
+    logger.info(f"Sent sync snapshot of {len(states)} files in {chunk + 1} chunk(s).")
+
+    return states
+
+
+async def send_sync_diff(
+    session: aiohttp.ClientSession,
+    watch_dirs: List[str],
+    checkpoint: Dict[str, FileState],
+) -> Dict[str, FileState]:
+    host = get_host()
+    events = []
+    states = {}
+    sent = 0
+
+    async def _flush():
+        nonlocal events, sent
+        if events:
+            await post_file_events(session, events)
+            sent += len(events)
+            events = []
+
+    # Send a created event for every new or changed file
+    async for path, stat_info in stat_log_files(watch_dirs):
+        state = _file_state(stat_info)
+        states[path] = state
+        if checkpoint.get(path) == state:
+            continue
+
+        events.append(
+            FileSystemEventModel(
+                event_type=FileSystemEventType.CREATED,
+                src_path=path,
+                is_directory=False,
+                host=host,
+                created=_created(stat_info),
+            )
+        )
+        if len(events) >= settings.SYNC_CHUNK_SIZE:
+            await _flush()
+
+    # and a deleted event for everything that has gone
+    for path in checkpoint.keys() - states.keys():
+        events.append(
+            FileSystemEventModel(
+                event_type=FileSystemEventType.DELETED,
+                src_path=path,
+                is_directory=False,
+                host=host,
+            )
+        )
+        if len(events) >= settings.SYNC_CHUNK_SIZE:
+            await _flush()
+
+    await _flush()
+    logger.info(f"Sent {sent} file event(s) since the last sync checkpoint.")
+
+    return states
 
-    return files
+
+async def sync(watch_dirs: List[str]) -> None:
+    host = get_host()
+    loop = asyncio.get_event_loop()
+
+    checkpoint = None
+    if settings.SYNC_CHECKPOINT_PATH is not None:
+        checkpoint = await loop.run_in_executor(
+            None, load_checkpoint, settings.SYNC_CHECKPOINT_PATH, host
+        )
+
+    async with aiohttp.ClientSession() as session:
+        if checkpoint is None:
+            logger.info("Sending sync message.")
+            states = await send_sync_snapshot(session, watch_dirs)
+        else:
+            logger.info("Sending changes since last sync checkpoint.")
+            states = await send_sync_diff(session, watch_dirs, checkpoint)
+
+    # Only checkpoint once everything has been sent
+    if settings.SYNC_CHECKPOINT_PATH is not None:
+        await loop.run_in_executor(
+            None, save_checkpoint, settings.SYNC_CHECKPOINT_PATH, host, states
+        )
 
 
 async def watch(
@@ -69,16 +198,19 @@ async def watch(
 ) -> None:
     handler = AIOEventHandler(queue, loop)
 
-    observer = Observer()
-    for d in dirs:
-        observer.schedule(handler, str(d))
-    observer.start()
+    observers = start_observers(
+        dirs,
+        handler,
+        settings.OBSERVER,
+        settings.WATCH_DIRECTORY_OBSERVERS,
+        settings.POLLING_INTERVAL,
+    )
+    closed_event_dirs.update(
+        Path(d) for (d, observer) in observers.items() if reports_closed(observer)
+    )
 
     if settings.SYNC:
-        logger.info("Sending sync message.")
-        files = await create_sync_snapshot(dirs)
-        async with aiohttp.ClientSession() as session:
-            await post_sync_event(session, SyncEvent(files=files))
+        await sync(dirs)
 
 
 @tenacity.retry(
@@ -114,49 +246,219 @@ async def post_file_event(
     wait=tenacity.wait_exponential(max=10),
     stop=tenacity.stop_after_attempt(10),
 )
-async def post_sync_event(session: aiohttp.ClientSession, event: SyncEvent) -> None:
+async def post_file_events(
+    session: aiohttp.ClientSession, events: List[FileSystemEventModel]
+) -> None:
     headers = {
         settings.API_KEY_NAME: settings.API_KEY,
         "Content-Type": "application/json",
     }
 
     async with session.post(
-        f"{settings.API_URL}/files/sync", headers=headers, data=event.json()
+        f"{settings.API_URL}/files/batch",
+        headers=headers,
+        data=json.dumps(events, default=pydantic_encoder),
     ) as r:
         r.raise_for_status()
 
-        return await r.json()
+
+def _log_exception(task: asyncio.Task) -> None:
+    try:
+        task.result()
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logger.exception("Exception posting file event.")
+
+
+# Accumulates file events and posts them to the API as a single request. A
+# batch is flushed once it holds max_events events or max_wait seconds after
+# its first event was added, whichever comes first.
+class FileEventBatcher:
+    def __init__(
+        self, session: aiohttp.ClientSession, max_events: int, max_wait: float
+    ):
+        self._session = session
+        self._max_events = max_events
+        self._max_wait = max_wait
+        self._events: List[FileSystemEventModel] = []
+        self._flush_handle = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def add(self, event: FileSystemEventModel) -> None:
+        self._events.append(event)
+
+        if len(self._events) >= self._max_events:
+            self.flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_event_loop()
+            self._flush_handle = loop.call_later(self._max_wait, self.flush)
+
+    def flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._events:
+            return
+
+        events = self._events
+        self._events = []
+
+        # Fire and forget
+        task = asyncio.create_task(post_file_events(self._session, events))
+        task.add_done_callback(_log_exception)
+        task.add_done_callback(self._tasks.discard)
+        self._tasks.add(task)
+
+    async def close(self) -> None:
+        self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        # Make sure any pending events are sent before the session is closed
+        await self.close()
 
 
 @tenacity.retry(
     retry=tenacity.retry_if_exception_type(
         aiohttp.client_exceptions.ServerConnectionError
     ) | tenacity.retry_if_exception_type(
-        aiohttp.client_exceptions.ClientResponseError
-    ) | tenacity.retry_if_exception_type(
-        OSError
-    ) | tenacity.retry_if_exception_type(
-         asyncio.TimeoutError
+        aiohttp.client_exceptions.ClientConnectionError
+    ),
+    wait=tenacity.wait_exponential(max=10),
+    stop=tenacity.stop_after_attempt(10),
+)
+async def post_sync_event(session: aiohttp.ClientSession, event: SyncEvent) -> None:
+    headers = {
+        settings.API_KEY_NAME: settings.API_KEY,
+        "Content-Type": "application/json",
+    }
+
+    async with session.post(
+        f"{settings.API_URL}/files/sync", headers=headers, data=event.json()
+    ) as r:
+        r.raise_for_status()
+
+        return await r.json()
+
+
+# Returns the size and checksum of the data read, which is what is uploaded, even
+# if the file is still growing.
+def _dm4_checksum(path: Path) -> Tuple[int, str]:
+    sha256 = hashlib.sha256()
+    size = 0
+    with path.open("rb") as fp:
+        for chunk in iter(lambda: fp.read(CHECKSUM_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            size += len(chunk)
+
+    return (size, f"sha256 {base64.b64encode(sha256.digest()).decode()}")
+
+
+# Only the first size bytes are sent, so the body matches Upload-Length
+async def _read_dm4(path: Path, offset: int, size: int) -> AsyncIterator[bytes]:
+    with path.open("rb") as fp:
+        fp.seek(offset)
+        remaining = size - offset
+        while remaining > 0:
+            chunk = fp.read(min(CHECKSUM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+# Connection errors, timeouts and server errors are transient, as are errors
+# reading the file. A 409 is an offset mismatch and a 400 a failed verification,
+# the server has discarded the data, both are recovered from by resuming at the
+# offset the server reports. Any other client error, such as a 401 or 413, won't
+# be fixed by retrying.
+def _retry_upload(ex: BaseException) -> bool:
+    if isinstance(ex, aiohttp.client_exceptions.ClientResponseError):
+        return ex.status >= 500 or ex.status in (400, 409)
+
+    return isinstance(
+        ex,
+        (
+            aiohttp.client_exceptions.ClientConnectionError,
+            OSError,
+            asyncio.TimeoutError,
+        ),
     )
-    ,
+
+
+# Each attempt resumes from the offset the server has already received, so a
+# retry after a timeout doesn't resend the whole file. The size and checksum are
+# kept in upload between attempts, they are calculated on the first attempt and
+# again after a failed verification, as the file may have still been written to.
+@tenacity.retry(
+    retry=tenacity.retry_if_exception(_retry_upload),
     wait=tenacity.wait_exponential(max=10),
     stop=tenacity.stop_after_attempt(10),
 )
+async def upload_dm4_data(
+    session: aiohttp.ClientSession, path: Path, upload: Dict[str, Any]
+):
+    if "checksum" not in upload:
+        loop = asyncio.get_event_loop()
+        (upload["size"], upload["checksum"]) = await loop.run_in_executor(
+            None, _dm4_checksum, path
+        )
+    size = upload["size"]
+
+    url = f"{settings.API_URL}/files/haadf/uploads/{path.name}"
+    headers = {settings.API_KEY_NAME: settings.API_KEY}
+
+    async with session.head(url, headers=headers) as r:
+        r.raise_for_status()
+        offset = int(r.headers["Upload-Offset"])
+
+    if offset > 0:
+        logger.info(f"Resuming upload of {path} at {offset} of {size} bytes")
+
+    headers.update({
+        "Content-Type": "application/octet-stream",
+        "Upload-Offset": str(offset),
+        "Upload-Length": str(size),
+        "Upload-Checksum": upload["checksum"],
+    })
+    async with session.patch(
+        url, headers=headers, data=_read_dm4(path, offset, size)
+    ) as r:
+        if r.status == 400:
+            upload.clear()
+        r.raise_for_status()
+
+
 async def upload_dm4(session: aiohttp.ClientSession, dm4_path: AsyncPath):
     logger.info(f"Uploading {dm4_path}")
-    data = aiohttp.FormData()
-    headers = {settings.API_KEY_NAME: settings.API_KEY}
     # We use the standard Path object here rather than the async version here,
     # as the AsyncPath performs very badly in our deployment (SL7). We can
     # probably revert this fix if/when we move away from SL7.
-    with Path(dm4_path).open("rb") as fp:
-        data.add_field(
-            "file", fp, filename=dm4_path.name, content_type="application/octet-stream"
-        )
-        async with session.post(
-            f"{settings.API_URL}/files/haadf", headers=headers, data=data
-        ) as r:
-            r.raise_for_status()
+    await upload_dm4_data(session, Path(dm4_path), {})
+
+
+# The watched directories that report files being closed after writing
+closed_event_dirs: Set[Path] = set()
+
+
+# inotify reports a DM4 file being created while it is still empty, so where we
+# get closed events we wait for the file to be closed before uploading it. The
+# other observers don't report closed events, so there we upload when the file is
+# created or modified. A move always means the file is complete.
+def dm4_written(event: FileSystemEvent, path: AsyncPath) -> bool:
+    if event.event_type == EVENT_TYPE_MOVED:
+        return True
+
+    if Path(path).parent in closed_event_dirs:
+        return event.event_type == EVENT_TYPE_CLOSED
+
+    return event.event_type in [EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED]
 
 
 async def monitor(queue: asyncio.Queue) -> None:
@@ -167,10 +469,17 @@ async def monitor(queue: asyncio.Queue) -> None:
 
     cache = TTLCache(maxsize=100000, ttl=30)
 
-    dm4_file_events = [EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED]
+    dm4_file_events = [
+        EVENT_TYPE_CREATED,
+        EVENT_TYPE_MODIFIED,
+        EVENT_TYPE_MOVED,
+        EVENT_TYPE_CLOSED,
+    ]
 
     try:
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession() as session, FileEventBatcher(
+            session, settings.BATCH_MAX_EVENTS, settings.BATCH_MAX_WAIT
+        ) as batcher:
             while True:
                 async for event in AIOEventIterator(queue):
                     if isinstance(event, FileSystemEvent):
@@ -193,13 +502,18 @@ async def monitor(queue: asyncio.Queue) -> None:
 
                             # Check we are dealing with a DM4
                             if dm4_pattern.match(path.name):
-                                await upload_dm4(session, path)
+                                if dm4_written(event, path):
+                                    await upload_dm4(session, path)
                                 continue
 
                         # We are only looking for log files
                         if not log_pattern.match(path.name):
                             continue
 
+                        # Closed events are only used to upload DM4 files
+                        if event.event_type == EVENT_TYPE_CLOSED:
+                            continue
+
                         event_type = event.event_type
                         # We just send a single created event to the server
                         if event_type == EVENT_TYPE_MODIFIED:
@@ -218,13 +532,9 @@ async def monitor(queue: asyncio.Queue) -> None:
                     else:
                         model = event
 
-                    def _log_exception(task: asyncio.Task) -> None:
-                        try:
-                            task.result()
-                        except asyncio.CancelledError:
-                            pass
-                        except Exception:
-                            logger.exception("Exception posting file event.")
+                    if settings.BATCH_FILE_EVENTS:
+                        batcher.add(model)
+                        continue
 
                     # Fire and forget
                     task = asyncio.create_task(post_file_event(session, model))
@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# The watcher modules import each other as top level modules
+sys.path.insert(0, str(Path(__file__).parent.parent / "distiller"))
+
+os.environ.setdefault("API_KEY_NAME", "X-API-KEY")
+os.environ.setdefault("API_KEY", "key")
+os.environ.setdefault("WATCH_DIRECTORIES", '["/tmp"]')
@@ -0,0 +1,312 @@
+import asyncio
+import base64
+import hashlib
+import os
+from pathlib import Path
+
+import aiohttp
+import pytest
+import pytest_asyncio
+import tenacity
+from aiohttp import web
+from watchdog.events import (FileClosedEvent, FileCreatedEvent,
+                             FileModifiedEvent, FileMovedEvent)
+
+import watch
+from schemas import File
+from schemas import FileSystemEvent as FileSystemEventModel
+from schemas import FileSystemEventType, SyncEvent
+
+
+@pytest_asyncio.fixture
+async def api(mocker, unused_tcp_port):
+    state = {"requests": [], "uploads": {}, "failures": []}
+
+    async def file_event(request):
+        state["requests"].append(("files", await request.json()))
+
+        return web.Response()
+
+    async def file_events(request):
+        state["requests"].append(("files/batch", await request.json()))
+
+        return web.Response()
+
+    async def sync(request):
+        state["requests"].append(("files/sync", await request.json()))
+
+        return web.json_response({"id": "1"})
+
+    async def upload_offset(request):
+        state["requests"].append(("HEAD", request.match_info["filename"]))
+        data = state["uploads"].get(request.match_info["filename"], b"")
+
+        return web.Response(headers={"Upload-Offset": str(len(data))})
+
+    async def upload_chunk(request):
+        filename = request.match_info["filename"]
+        offset = int(request.headers["Upload-Offset"])
+        state["requests"].append(("PATCH", offset))
+        body = await request.read()
+
+        # The status to fail the next PATCH with
+        status = state["failures"].pop(0) if state["failures"] else None
+        if status == 503:
+            # Only part of the data made it before the connection dropped
+            body = body[: len(body) // 2]
+        elif status is not None:
+            return web.Response(status=status)
+
+        data = state["uploads"].get(filename, b"")[:offset] + body
+        state["uploads"][filename] = data
+
+        if status is not None:
+            return web.Response(status=status)
+
+        # Verify the upload once complete, discarding the data if it fails
+        length = int(request.headers["Upload-Length"])
+        if len(data) >= length:
+            digest = base64.b64encode(hashlib.sha256(data).digest()).decode()
+            if (
+                len(data) != length
+                or request.headers["Upload-Checksum"] != f"sha256 {digest}"
+            ):
+                del state["uploads"][filename]
+
+                return web.Response(status=400)
+
+        return web.Response(status=204, headers={"Upload-Offset": str(len(data))})
+
+    server = web.Application()
+    server.router.add_post("/files", file_event)
+    server.router.add_post("/files/batch", file_events)
+    server.router.add_post("/files/sync", sync)
+    server.router.add_head("/files/haadf/uploads/{filename}", upload_offset)
+    server.router.add_patch("/files/haadf/uploads/{filename}", upload_chunk)
+
+    runner = web.AppRunner(server)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", unused_tcp_port)
+    await site.start()
+
+    mocker.patch.object(
+        watch.settings, "API_URL", f"http://127.0.0.1:{unused_tcp_port}"
+    )
+    mocker.patch.object(watch.upload_dm4_data.retry, "wait", tenacity.wait_none())
+
+    yield state
+
+    await runner.cleanup()
+
+
+def file_event(path: str) -> FileSystemEventModel:
+    return FileSystemEventModel(
+        event_type=FileSystemEventType.CREATED,
+        host="host",
+        src_path=path,
+        is_directory=False,
+    )
+
+
+@pytest.mark.asyncio
+async def test_post_file_event(api):
+    async with aiohttp.ClientSession() as session:
+        await watch.post_file_event(session, file_event("/data/log_scan1.data"))
+
+    assert api["requests"] == [
+        (
+            "files",
+            {
+                "event_type": "created",
+                "host": "host",
+                "src_path": "/data/log_scan1.data",
+                "is_directory": False,
+                "created": None,
+            },
+        )
+    ]
+
+
+@pytest.mark.asyncio
+async def test_file_event_batcher(api):
+    async with aiohttp.ClientSession() as session:
+        async with watch.FileEventBatcher(session, 2, 60) as batcher:
+            for i in range(3):
+                batcher.add(file_event(f"/data/log_scan{i}.data"))
+
+    batches = [
+        [event["src_path"] for event in events] for (_, events) in api["requests"]
+    ]
+    assert sorted(batches) == [
+        ["/data/log_scan0.data", "/data/log_scan1.data"],
+        ["/data/log_scan2.data"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_post_sync_event(api):
+    event = SyncEvent(files=[File(host="host", path="/data/log_scan1.data")])
+
+    async with aiohttp.ClientSession() as session:
+        assert await watch.post_sync_event(session, event) == {"id": "1"}
+
+    assert api["requests"][0][0] == "files/sync"
+
+
+@pytest.mark.asyncio
+async def test_upload_dm4_resumes(api, tmp_path):
+    path = tmp_path / "scan1.dm4"
+    data = os.urandom(10000)
+    path.write_bytes(data)
+    api["failures"] = [503]
+
+    async with aiohttp.ClientSession() as session:
+        await watch.upload_dm4(session, path)
+
+    assert api["uploads"]["scan1.dm4"] == data
+    # The second attempt only sends the data the server didn't receive
+    assert api["requests"] == [
+        ("HEAD", "scan1.dm4"),
+        ("PATCH", 0),
+        ("HEAD", "scan1.dm4"),
+        ("PATCH", 5000),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_upload_dm4_growing_file(api, tmp_path, mocker):
+    path = tmp_path / "scan1.dm4"
+    data = os.urandom(10000)
+    path.write_bytes(data)
+    dm4_checksum = watch._dm4_checksum
+
+    # The file is still being written to after the checksum is calculated
+    def checksum(path):
+        result = dm4_checksum(path)
+        with path.open("ab") as fp:
+            fp.write(os.urandom(1000))
+
+        return result
+
+    mocker.patch.object(watch, "_dm4_checksum", side_effect=checksum)
+
+    async with aiohttp.ClientSession() as session:
+        await watch.upload_dm4(session, path)
+
+    # Only the data that was checksummed is sent
+    assert api["uploads"]["scan1.dm4"] == data
+    assert watch._dm4_checksum.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_upload_dm4_recalculates_checksum_after_failed_verification(
+    api, tmp_path, mocker
+):
+    path = tmp_path / "scan1.dm4"
+    path.write_bytes(os.urandom(10000))
+    mocker.patch.object(watch, "_dm4_checksum", side_effect=watch._dm4_checksum)
+    api["failures"] = [400]
+
+    async with aiohttp.ClientSession() as session:
+        await watch.upload_dm4(session, path)
+
+    assert api["uploads"]["scan1.dm4"] == path.read_bytes()
+    assert watch._dm4_checksum.call_count == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", [400, 409])
+async def test_upload_dm4_retries_protocol_errors(api, tmp_path, status):
+    path = tmp_path / "scan1.dm4"
+    data = os.urandom(1000)
+    path.write_bytes(data)
+    api["failures"] = [status]
+
+    async with aiohttp.ClientSession() as session:
+        await watch.upload_dm4(session, path)
+
+    assert api["uploads"]["scan1.dm4"] == data
+    assert [method for (method, _) in api["requests"]].count("PATCH") == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", [401, 403, 404, 413])
+async def test_upload_dm4_client_errors_not_retried(api, tmp_path, status):
+    path = tmp_path / "scan1.dm4"
+    path.write_bytes(os.urandom(1000))
+    api["failures"] = [status]
+
+    async with aiohttp.ClientSession() as session:
+        with pytest.raises(aiohttp.ClientResponseError) as ex:
+            await watch.upload_dm4(session, path)
+
+    assert ex.value.status == status
+    assert [method for (method, _) in api["requests"]].count("PATCH") == 1
+
+
+async def run_monitor(mocker, events):
+    mocker.patch.object(watch.settings, "BATCH_FILE_EVENTS", False)
+    upload_dm4 = mocker.patch.object(watch, "upload_dm4")
+    post_file_event = mocker.patch.object(watch, "post_file_event")
+
+    queue = asyncio.Queue()
+    for event in events:
+        queue.put_nowait(event)
+
+    task = asyncio.create_task(watch.monitor(queue))
+    while not queue.empty():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await task
+
+    uploaded = [str(call.args[1]) for call in upload_dm4.call_args_list]
+    posted = [call.args[1] for call in post_file_event.call_args_list]
+
+    return (uploaded, posted)
+
+
+@pytest.mark.asyncio
+async def test_monitor_uploads_dm4_once_closed(tmp_path, mocker):
+    mocker.patch.object(watch, "closed_event_dirs", {Path(tmp_path)})
+    dm4 = str(tmp_path / "scan1.dm4")
+
+    (uploaded, posted) = await run_monitor(
+        mocker,
+        [FileCreatedEvent(dm4), FileModifiedEvent(dm4), FileClosedEvent(dm4)],
+    )
+
+    assert uploaded == [dm4]
+    assert posted == []
+
+
+@pytest.mark.asyncio
+async def test_monitor_uploads_dm4_when_created_without_closed_events(
+    tmp_path, mocker
+):
+    mocker.patch.object(watch, "closed_event_dirs", set())
+    dm4 = str(tmp_path / "scan1.dm4")
+    tmp = str(tmp_path / "scan2.tmp")
+    moved = str(tmp_path / "scan2.dm4")
+
+    (uploaded, _) = await run_monitor(
+        mocker, [FileCreatedEvent(dm4), FileMovedEvent(tmp, moved)]
+    )
+
+    assert uploaded == [dm4, moved]
+
+
+@pytest.mark.asyncio
+async def test_monitor_ignores_closed_log_files(tmp_path, mocker):
+    mocker.patch.object(watch, "closed_event_dirs", {Path(tmp_path)})
+    log = tmp_path / "log_scan1_0.data"
+    log.write_bytes(b"log")
+
+    (uploaded, posted) = await run_monitor(
+        mocker, [FileClosedEvent(str(log)), FileCreatedEvent(str(log))]
+    )
+
+    assert uploaded == []
+    assert [(event.event_type, event.src_path) for event in posted] == [
+        ("created", str(log))
+    ]
@@ -5,6 +5,13 @@ export enum ScanEventType {
   Updated = 'scan.updated',
 }
 
+export const ReloadEventType = 'notifications.reload';
+
+export interface ReloadEvent {
+  event_type: typeof ReloadEventType;
+  seq: number | null;
+}
+
 export interface ScanEvent<T extends ScanEventType> extends Partial<Scan> {
   id: IdType;
   event_type: T;
@@ -26,3 +33,7 @@ export function isCreatedEvent(ev: any): ev is ScanCreatedEvent {
 export function isUpdatedEvent(ev: any): ev is ScanUpdatedEvent {
   return ev && ev.event_type === ScanEventType.Updated;
 }
+
+export function isReloadEvent(ev: any): ev is ReloadEvent {
+  return ev && ev.event_type === ReloadEventType;
+}
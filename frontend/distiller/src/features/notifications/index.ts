@@ -3,18 +3,42 @@ import { createAsyncThunk, createSlice, PayloadAction } from '@reduxjs/toolkit';
 import { AppDispatch, RootState } from '../../app/store';
 import { apiClient } from '../../client';
 import { startMockNotifications } from './mock';
-import { isCreatedEvent, isUpdatedEvent } from './events';
+import { isCreatedEvent, isReloadEvent, isUpdatedEvent } from './events';
 import { setScan, updateScan } from '../scans';
+import { IdType } from '../../types';
+
+// Restricts the events the server sends us, null subscribes to everything.
+export interface NotificationFilter {
+  // Only send events for these scans
+  ids?: IdType[];
+  // Only send events for scans with ids in these inclusive ranges, a range with
+  // no end is open ended.
+  id_ranges?: [IdType, IdType | null][];
+  created_only?: boolean;
+  jobs_only?: boolean;
+}
 
 class NotificationHub {
+  ws: WebSocket;
+
   constructor(ws: WebSocket, getState: () => RootState, dispatch: AppDispatch) {
+    this.ws = ws;
+
     const messageListener = (ev: MessageEvent<string>) => {
       let msg: any = undefined;
       try {
         msg = JSON.parse(ev.data);
       } catch {}
 
-      if (isCreatedEvent(msg)) {
+      // Used to resume the stream when we reconnect
+      if (msg && typeof msg.seq === 'number') {
+        lastSeq = msg.seq;
+      }
+
+      if (isReloadEvent(msg)) {
+        // The events we missed are no longer available
+        dispatch(reload());
+      } else if (isCreatedEvent(msg)) {
         const scan = { ...msg, jobs: [] };
         dispatch(setScan(scan));
       } else if (isUpdatedEvent(msg)) {
@@ -28,16 +52,33 @@ class NotificationHub {
       ws.removeEventListener('message', messageListener);
     });
   }
+
+  subscribe(filter: NotificationFilter | null) {
+    if (this.ws.readyState === WebSocket.OPEN) {
+      this.ws.send(JSON.stringify({ subscribe: filter }));
+    }
+  }
 }
 
 let notificationHub: NotificationHub | undefined = undefined;
+let lastSeq: number | undefined = undefined;
+// Kept so the subscription can be restored when we reconnect
+let notificationFilter: NotificationFilter | null = null;
+
+export function subscribeNotifications(filter: NotificationFilter | null) {
+  notificationFilter = filter;
+  notificationHub?.subscribe(filter);
+}
 
 export interface NotificationsState {
   status: 'connected' | 'disconnected' | 'connecting';
+  // Incremented when the stream could not be resumed and data should be reloaded
+  reloads: number;
 }
 
 const initialState: NotificationsState = {
   status: 'disconnected',
+  reloads: 0,
 };
 
 export const connectNotifications = createAsyncThunk(
@@ -45,9 +86,13 @@ export const connectNotifications = createAsyncThunk(
   async (_payload, thunkAPI) => {
     const { dispatch, getState } = thunkAPI;
 
-    let ws: WebSocket = await apiClient.ws({ url: 'notifications' });
+    const params = lastSeq !== undefined ? { since: lastSeq } : {};
+    let ws: WebSocket = await apiClient.ws({ url: 'notifications', params });
 
     notificationHub = new NotificationHub(ws, getState as any, dispatch);
+    if (notificationFilter !== null) {
+      notificationHub.subscribe(notificationFilter);
+    }
 
     const mock = process.env.NODE_ENV === 'development';
 
@@ -64,6 +109,9 @@ export const notificationsSlice = createSlice({
     setStatus(state, action: PayloadAction<NotificationsState['status']>) {
       state.status = action.payload;
     },
+    reload(state) {
+      state.reloads += 1;
+    },
   },
   // The `extraReducers` field lets the slice handle actions defined elsewhere,
   // including actions generated by createAsyncThunk or in other slices.
@@ -81,7 +129,7 @@ export const notificationsSlice = createSlice({
   },
 });
 
-export const { setStatus } = notificationsSlice.actions;
+export const { setStatus, reload } = notificationsSlice.actions;
 
 export function getNotificationHub() {
   return notificationHub;
@@ -50,9 +50,10 @@ import CountDialog from '../components/count-dialog';
 import { createJob } from '../features/jobs/api';
 import { RemoveScanFilesConfirmDialog } from '../components/scan-confirm-dialog';
 import JobOutputDialog from '../components/job-output';
-import { isNil } from '../utils';
+import { fallbackImage, isNil } from '../utils';
 import { SCANS_PATH } from '../routes';
 import { canRunJobs } from '../utils/machine';
+import { subscribeNotifications } from '../features/notifications';
 
 const useStyles = makeStyles((theme) => ({
   card: {
@@ -123,6 +124,15 @@ const ScanPage: React.FC<Props> = () => {
     dispatch(getScan({ id: scanId }));
   }, [dispatch, scanId]);
 
+  // We only need the events for this scan
+  useEffect(() => {
+    subscribeNotifications({ ids: [scanId] });
+  }, [scanId]);
+
+  useEffect(() => {
+    return () => subscribeNotifications(null);
+  }, []);
+
   const onSaveNotes = (id: IdType, notes: string) => {
     return dispatch(patchScan({ id, updates: { notes } }));
   };
@@ -208,7 +218,8 @@ const ScanPage: React.FC<Props> = () => {
             <Grid item xs={12} sm={4} md={3}>
               {scan.haadf_path ? (
                 <img
-                  src={`${staticURL}${scan.haadf_path}`}
+                  src={`${staticURL}${scan.haadf_medium_path || scan.haadf_path}`}
+                  onError={fallbackImage(`${staticURL}${scan.haadf_path}`)}
                   alt="scan thumbnail"
                   className={classes.image}
                 />
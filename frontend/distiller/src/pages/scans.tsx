@@ -37,12 +37,13 @@ import { staticURL } from '../client';
 import ImageDialog from '../components/image-dialog';
 import LocationComponent from '../components/location';
 import { SCANS_PATH } from '../routes';
-import { stopPropagation } from '../utils';
+import { fallbackImage, stopPropagation } from '../utils';
 import {
   ScanDeleteConfirmDialog,
   RemoveScanFilesConfirmDialog,
 } from '../components/scan-confirm-dialog';
 import { machineSelectors, machineState } from '../features/machines';
+import { subscribeNotifications } from '../features/notifications';
 
 const useStyles = makeStyles((theme) => ({
   headCell: {
@@ -104,9 +105,28 @@ const ScansPage: React.FC = () => {
   const [onScanFilesRemovalConfirm, setOnScanFilesRemovalConfirm] =
     React.useState<(params: { [key: string]: any }) => void | undefined>();
 
+  const reloads = useAppSelector((state) => state.notifications.reloads);
+
   useEffect(() => {
     dispatch(getScans({ skip: page * rowsPerPage, limit: rowsPerPage }));
-  }, [dispatch, page, rowsPerPage]);
+  }, [dispatch, page, rowsPerPage, reloads]);
+
+  // Only ask for the events for the scans on this page, the first page also
+  // needs the scans created after the newest one we have.
+  const scanIds = scans.map((scan) => scan.id).join(',');
+  useEffect(() => {
+    const ids = scanIds === '' ? [] : scanIds.split(',').map(Number);
+    if (page === 0) {
+      const next = ids.length > 0 ? Math.max(...ids) + 1 : 0;
+      subscribeNotifications({ ids, id_ranges: [[next, null]] });
+    } else {
+      subscribeNotifications({ ids });
+    }
+  }, [scanIds, page]);
+
+  useEffect(() => {
+    return () => subscribeNotifications(null);
+  }, []);
 
   const onSaveNotes = (id: IdType, notes: string) => {
     return dispatch(patchScan({ id, updates: { notes } }));
@@ -196,7 +216,10 @@ const ScansPage: React.FC = () => {
                   <TableCell className={classes.imgCell}>
                     {scan.haadf_path ? (
                       <img
-                        src={`${staticURL}${scan.haadf_path}`}
+                        src={`${staticURL}${scan.haadf_thumbnail_path || scan.haadf_path}`}
+                        onError={fallbackImage(
+                          `${staticURL}${scan.haadf_path}`
+                        )}
                         alt="scan thumbnail"
                         className={classes.thumbnail}
                         onClick={stopPropagation(() => onImgClick(scan))}
@@ -96,6 +96,8 @@ export type Scan = {
   locations: ScanLocation[];
   notes?: string;
   haadf_path?: string;
+  haadf_thumbnail_path?: string;
+  haadf_medium_path?: string;
   jobs: ScanJob[];
   prevScanId?: IdType;
   nextScanId?: IdType;
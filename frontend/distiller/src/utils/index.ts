@@ -26,3 +26,16 @@ export function pickNil<T, N extends undefined | null>(
     return val;
   }
 }
+
+// Images processed before the downscaled versions were generated only have the
+// full image, so fall back to it.
+export function fallbackImage(src: string) {
+  return function (ev: React.SyntheticEvent<HTMLImageElement>) {
+    // Only fall back once, in case the full image is missing too
+    const img = ev.currentTarget;
+    if (img.dataset.fallback === undefined) {
+      img.dataset.fallback = src;
+      img.src = src;
+    }
+  };
+}